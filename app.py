@@ -5,33 +5,64 @@ This module provides the application factory pattern for creating Flask app inst
 Routes are organized in separate blueprint modules in the routes package.
 """
 
+import os
+
 from flask import Flask
+import database
 from database import init_database, add_sample_data
 from routes import register_blueprints
+from routes.http_cache import init_http_cache
+from routes.fragment_cache import init_fragment_cache
+from routes.metrics import init_metrics
+from routes.profiling import init_profiling
+from commands import register_commands
 
 
-def create_app():
+def create_app(config=None):
     """
     Application factory function to create and configure Flask app.
     
+    Args:
+        config: Optional mapping of config overrides (e.g. DATABASE_POOL_SIZE)
+    
     Returns:
         Flask: Configured Flask application instance
     """
     app = Flask(__name__)
     app.secret_key = "super secret key"
+    if config:
+        app.config.update(config)
     
-    # Initialize the database
-    init_database()
+    # Set up the pooled connection manager and its per-request teardown
+    database.init_app(app)
     
-    # Add sample data for testing and demonstration
-    add_sample_data()
+    # Create or migrate the schema (a no-op once it is current); sample data
+    # is loaded separately with `flask --app app load-sample-data`
+    init_database()
     
     # Register all route blueprints
     register_blueprints(app)
     
+    # ETag/304 handling and per-blueprint Cache-Control (CACHE_CONTROL config)
+    init_http_cache(app)
+    
+    # Rendered catalog rows (CATALOG_FRAGMENT_CACHE_BYTES config)
+    init_fragment_cache(app)
+    
+    # Request/template/SQL timing and /metrics (METRICS_ENABLED, SLOW_QUERY_MS config)
+    init_metrics(app)
+    
+    # Opt-in per-request profiles (PROFILE_REQUESTS / PROFILE_HEADER_TOKEN config)
+    init_profiling(app)
+    
+    # Register CLI commands (flask --app app <command>)
+    register_commands(app)
+    
     return app
 
 
 if __name__ == '__main__':
     app = create_app()
-    app.run(debug=True, host='0.0.0.0', port=5000)
+    add_sample_data()
+    # development server only; production runs wsgi:app under gunicorn
+    app.run(debug=os.environ.get('FLASK_DEBUG') == '1', host='0.0.0.0', port=5000)
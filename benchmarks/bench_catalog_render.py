@@ -0,0 +1,96 @@
+"""
+Catalog render benchmark - /catalog with a cold versus warm fragment cache.
+
+Seeds --books books and requests a --limit row catalog page through the
+Flask test client: cold (fragment cache cleared before every request), warm
+(every row and the page layout cached) and after one borrow per request
+(one row re-rendered). Conditional GETs are not used, so every request
+renders the page.
+
+Usage:
+    python -m benchmarks.bench_catalog_render --books 5000 --limit 200 --requests 50
+"""
+
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import database
+from app import create_app
+from routes.fragment_cache import catalog_fragments
+
+
+def _median_ms(client, url: str, requests: int, before_each) -> float:
+    times = []
+    for n in range(requests):
+        before_each(n)
+        start = time.perf_counter()
+        response = client.get(url)
+        times.append(time.perf_counter() - start)
+        assert response.status_code == 200
+    return statistics.median(times) * 1000
+
+
+def run(books: int, limit: int, requests: int) -> dict:
+    original = database.DATABASE
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            database.DATABASE = os.path.join(tmp, 'library.db')
+            database.configure_pool()
+            database.init_database()
+            database.insert_books_bulk([(f"Book {n:06d}", "Author", f"{n:013d}", 3)
+                                        for n in range(books)])
+            client = create_app({'CATALOG_PAGE_SIZE': limit}).test_client()
+            page_ids = [book['id'] for book in database.get_books_page(limit=limit)[0]]
+            now = datetime.now()
+
+            def borrow(n):
+                book_id = page_ids[n % len(page_ids)]
+                database.borrow_book_transaction(f"{n:06d}", book_id, now, now + timedelta(days=14))
+                database.return_book_transaction(f"{n:06d}", book_id, now)
+
+            cold = _median_ms(client, '/catalog', requests, lambda n: catalog_fragments.clear())
+            client.get('/catalog')
+            warm = _median_ms(client, '/catalog', requests, lambda n: None)
+            after_borrow = _median_ms(client, '/catalog', requests, borrow)
+            return {
+                'books': books,
+                'rows_per_page': limit,
+                'requests': requests,
+                'cold_ms': cold,
+                'warm_ms': warm,
+                'after_borrow_ms': after_borrow,
+                'speedup': cold / warm if warm else 0.0,
+                'cache': catalog_fragments.stats(),
+            }
+    finally:
+        database.close_pool()
+        database.DATABASE = original
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--books', type=int, default=5000)
+    parser.add_argument('--limit', type=int, default=200, help='rows per catalog page (max 200)')
+    parser.add_argument('--requests', type=int, default=50, help='requests timed per mode')
+    parser.add_argument('--json', action='store_true', help='print machine-readable output')
+    args = parser.parse_args()
+
+    results = run(args.books, args.limit, args.requests)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{results['books']} books, {results['rows_per_page']} rows per page, "
+          f"median of {results['requests']} requests")
+    print(f"cold cache:        {results['cold_ms']:7.2f} ms")
+    print(f"warm cache:        {results['warm_ms']:7.2f} ms ({results['speedup']:.1f}x)")
+    print(f"after each borrow: {results['after_borrow_ms']:7.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""
+Export benchmark - stream a large borrow_records table through /api/export.
+
+Seeds --rows borrow records, then drains /api/export/borrow_records through
+the Flask test client without buffering, reporting rows/s and the Python
+heap peak (tracemalloc) for each format. The peak should stay flat as
+--rows grows.
+
+Usage:
+    python -m benchmarks.bench_export --rows 1000000
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+import database
+from app import create_app
+
+
+def seed(rows: int) -> None:
+    start = datetime(2024, 1, 1)
+    with database.db_connection() as conn:
+        conn.executemany('''
+            INSERT INTO books (title, author, isbn, total_copies, available_copies)
+            VALUES (?, ?, ?, ?, ?)
+        ''', ((f"Title {n}", "Author", f"{n:013d}", 5, 5) for n in range(1, 1001)))
+        conn.executemany('''
+            INSERT INTO borrow_records (patron_id, book_id, borrow_date, due_date, return_date)
+            VALUES (?, ?, ?, ?, ?)
+        ''', ((f"{n % 900000 + 100000}", n % 1000 + 1,
+               (start + timedelta(minutes=n)).isoformat(),
+               (start + timedelta(minutes=n, days=14)).isoformat(),
+               (start + timedelta(minutes=n, days=10)).isoformat())
+              for n in range(rows)))
+        conn.commit()
+
+
+def drain(client, export_format: str, trace: bool) -> dict:
+    if trace:
+        tracemalloc.start()
+    start = time.perf_counter()
+    response = client.get(f'/api/export/borrow_records?format={export_format}', buffered=False)
+    size = 0
+    for chunk in response.response:
+        size += len(chunk)
+    response.close()
+    elapsed = time.perf_counter() - start
+    result = {'seconds': elapsed, 'bytes': size}
+    if trace:
+        result['peak_heap_mb'] = tracemalloc.get_traced_memory()[1] / 1e6
+        tracemalloc.stop()
+    return result
+
+
+def run(rows: int, trace: bool) -> dict:
+    original = database.DATABASE
+    results = {'rows': rows}
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            database.DATABASE = os.path.join(tmp, 'library.db')
+            database.configure_pool(profile='bulk-load')
+            database.init_database()
+            seed(rows)
+            client = create_app().test_client()
+            for export_format in ('ndjson', 'csv'):
+                r = drain(client, export_format, trace)
+                r['rows_per_sec'] = rows / r['seconds']
+                results[export_format] = r
+            database.close_pool()
+    finally:
+        database.DATABASE = original
+        database.configure_pool(profile=database.DEFAULT_PROFILE)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--no-trace', action='store_true',
+                        help='skip tracemalloc (faster, no memory figure)')
+    parser.add_argument('--json', action='store_true', help='print machine-readable output')
+    args = parser.parse_args()
+
+    results = run(args.rows, trace=not args.no_trace)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{results.pop('rows')} borrow records")
+    for export_format, r in results.items():
+        peak = f"{r['peak_heap_mb']:.1f} MB peak" if 'peak_heap_mb' in r else ''
+        print(f"{export_format:<7} {r['rows_per_sec']:>10.0f} rows/s "
+              f"{r['bytes'] / 1e6:>8.1f} MB out  {peak}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""
+Import benchmark - bulk catalog import throughput.
+
+Generates a --rows CSV vendor feed (about 1% invalid and 1% duplicate rows),
+then runs it through import_books_from_file() against a fresh database and
+reports rows/s.
+
+Usage:
+    python -m benchmarks.bench_import --rows 200000 --profile bulk-load
+"""
+
+import argparse
+import io
+import json
+import os
+import tempfile
+import time
+
+import database
+from services.catalog_import import DEFAULT_CHUNK_SIZE, import_books_from_file
+
+
+def make_feed(rows: int) -> io.StringIO:
+    feed = io.StringIO()
+    feed.write("title,author,isbn,total_copies\n")
+    for n in range(rows):
+        isbn = f"{n:013d}" if n % 100 != 99 else f"{n - 1:013d}"   # 1% duplicates
+        copies = "3" if n % 100 != 50 else "0"                      # 1% invalid
+        feed.write(f"Vendor Title {n},Vendor Author {n % 5000},{isbn},{copies}\n")
+    feed.seek(0)
+    return feed
+
+
+def run(rows: int, chunk_size: int, profile: str) -> dict:
+    original = database.DATABASE
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            database.DATABASE = os.path.join(tmp, 'library.db')
+            database.configure_pool(profile=profile)
+            database.init_database()
+            feed = make_feed(rows)
+
+            start = time.perf_counter()
+            report = import_books_from_file(feed, 'csv', chunk_size=chunk_size)
+            elapsed = time.perf_counter() - start
+            database.close_pool()
+    finally:
+        database.DATABASE = original
+        database.configure_pool(profile=database.DEFAULT_PROFILE)
+
+    return {'rows': rows, 'profile': profile, 'chunk_size': chunk_size,
+            'inserted': report['inserted'], 'failed': report['failed'],
+            'seconds': elapsed, 'rows_per_sec': rows / elapsed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument('--profile', default='bulk-load', choices=sorted(database.STORAGE_PROFILES))
+    parser.add_argument('--json', action='store_true', help='print machine-readable output')
+    args = parser.parse_args()
+
+    result = run(args.rows, args.chunk_size, args.profile)
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return
+    print(f"{result['inserted']} inserted, {result['failed']} rejected in "
+          f"{result['seconds']:.2f}s ({result['rows_per_sec']:.0f} rows/s, "
+          f"profile={result['profile']}, chunk={result['chunk_size']})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""
+Late-fee benchmark - the nightly sweep, set-based versus one loan at a time.
+
+Seeds --loans borrow records (about a third of them open and overdue) and
+times pricing every overdue loan with get_overdue_fees() against the
+per-loan path (calculate_late_fee_for_book for each pair).
+
+Usage:
+    python -m benchmarks.bench_late_fees --loans 500000 --sample 2000
+"""
+
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import database
+from services.library_service import calculate_late_fee_for_book, calculate_late_fees
+
+
+def seed(loans: int, books: int) -> None:
+    rng = random.Random(42)
+    now = datetime.now()
+    with database.db_connection() as conn:
+        conn.executemany('''
+            INSERT INTO books (title, author, isbn, total_copies, available_copies)
+            VALUES (?, ?, ?, ?, ?)
+        ''', ((f"Book {n}", "Author", f"{n:013d}", 5, 5) for n in range(1, books + 1)))
+
+        def rows():
+            for n in range(loans):
+                borrowed = now - timedelta(days=rng.randint(0, 60), hours=rng.randint(0, 23))
+                due = borrowed + timedelta(days=14)
+                returned = None if n % 3 == 0 else (due + timedelta(days=rng.randint(-10, 10))).isoformat()
+                yield (f"{rng.randint(0, loans // 4):06d}", rng.randint(1, books),
+                       borrowed.isoformat(), due.isoformat(), returned)
+
+        conn.executemany('''
+            INSERT INTO borrow_records (patron_id, book_id, borrow_date, due_date, return_date)
+            VALUES (?, ?, ?, ?, ?)
+        ''', rows())
+        conn.commit()
+
+
+def run(loans: int, books: int, sample: int) -> dict:
+    original = database.DATABASE
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            database.DATABASE = os.path.join(tmp, 'library.db')
+            database.configure_pool(profile='bulk-load')
+            database.init_database()
+            seed(loans, books)
+
+            start = time.perf_counter()
+            fees = database.get_overdue_fees()
+            sweep = time.perf_counter() - start
+
+            pairs = [(f['patron_id'], f['book_id']) for f in fees[:sample]]
+            start = time.perf_counter()
+            for patron_id, book_id in pairs:
+                calculate_late_fee_for_book(patron_id, book_id)
+            per_loan = time.perf_counter() - start
+
+            start = time.perf_counter()
+            calculate_late_fees(pairs)
+            batch = time.perf_counter() - start
+
+            return {
+                'loans': loans,
+                'overdue': len(fees),
+                'sweep_s': sweep,
+                'sweep_loans_per_s': len(fees) / sweep if sweep else 0.0,
+                'sample': len(pairs),
+                'per_loan_s': per_loan,
+                'batch_s': batch,
+                'per_loan_estimated_sweep_s': per_loan / len(pairs) * len(fees) if pairs else 0.0,
+            }
+    finally:
+        database.close_pool()
+        database.DATABASE = original
+        database.configure_pool(profile=database.DEFAULT_PROFILE)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--loans', type=int, default=200000)
+    parser.add_argument('--books', type=int, default=20000)
+    parser.add_argument('--sample', type=int, default=2000,
+                        help='overdue loans priced one at a time for comparison')
+    parser.add_argument('--json', action='store_true', help='print machine-readable output')
+    args = parser.parse_args()
+
+    results = run(args.loans, args.books, args.sample)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{results['loans']} loans, {results['overdue']} overdue")
+    print(f"set-based sweep: {results['sweep_s']:.2f}s ({results['sweep_loans_per_s']:,.0f} loans/s)")
+    print(f"per-loan path:   {results['per_loan_s']:.2f}s for {results['sample']} loans "
+          f"(~{results['per_loan_estimated_sweep_s']:.1f}s for the full sweep)")
+    print(f"batched lookup:  {results['batch_s']:.3f}s for the same {results['sample']} loans")
+
+
+if __name__ == '__main__':
+    main()
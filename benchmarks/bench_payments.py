@@ -0,0 +1,84 @@
+"""
+Payment benchmark - gateway throughput bounded by workers versus in-flight requests.
+
+Starts the stub gateway with --latency seconds per call and pushes --payments
+charges through it two ways: blocking calls from a fixed pool of --workers
+threads (one payment per Flask worker at a time), and the asyncio client
+with 10/50/--in-flight requests outstanding over one pooled session.
+
+Usage:
+    python -m benchmarks.bench_payments --payments 500 --latency 0.5 --workers 8
+"""
+
+import argparse
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from services.payment_service import AsyncPaymentGateway, PaymentGateway
+from services.payment_simulator import StubGatewayServer
+
+
+def _blocking(url: str, payments: int, workers: int) -> float:
+    gateway = PaymentGateway(base_url=url)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(workers) as pool:
+        results = list(pool.map(lambda n: gateway.process_payment(f"{n % 999999:06d}", 5.0),
+                                range(payments)))
+    elapsed = time.perf_counter() - start
+    assert all(ok for ok, _, _ in results)
+    return elapsed
+
+
+def _async(url: str, payments: int, in_flight: int) -> float:
+    async def pay_all():
+        slots = asyncio.Semaphore(in_flight)
+        async with AsyncPaymentGateway(base_url=url, max_connections=in_flight) as gateway:
+            async def pay(n):
+                async with slots:
+                    return await gateway.process_payment(f"{n % 999999:06d}", 5.0)
+            return await asyncio.gather(*(pay(n) for n in range(payments)))
+
+    start = time.perf_counter()
+    results = asyncio.run(pay_all())
+    elapsed = time.perf_counter() - start
+    assert all(ok for ok, _, _ in results)
+    return elapsed
+
+
+def run(payments: int, latency: float, workers: int, in_flight: int) -> dict:
+    results = {'payments': payments, 'latency_s': latency, 'runs': []}
+    with StubGatewayServer(latency=latency) as server:
+        elapsed = _blocking(server.url, payments, workers)
+        results['runs'].append({'mode': f'blocking, {workers} workers', 'seconds': elapsed,
+                                'payments_per_s': payments / elapsed})
+        for level in sorted({10, 50, in_flight}):
+            elapsed = _async(server.url, payments, level)
+            results['runs'].append({'mode': f'async, {level} in flight', 'seconds': elapsed,
+                                    'payments_per_s': payments / elapsed})
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--payments', type=int, default=500)
+    parser.add_argument('--latency', type=float, default=0.5, help='stub gateway seconds per call')
+    parser.add_argument('--workers', type=int, default=8, help='threads for the blocking run')
+    parser.add_argument('--in-flight', type=int, default=200, help='largest async concurrency level')
+    parser.add_argument('--json', action='store_true', help='print machine-readable output')
+    args = parser.parse_args()
+
+    results = run(args.payments, args.latency, args.workers, args.in_flight)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{results['payments']} payments, {results['latency_s']}s gateway latency")
+    print(f"{'mode':<26} {'seconds':>9} {'payments/s':>11}")
+    for r in results['runs']:
+        print(f"{r['mode']:<26} {r['seconds']:>9.2f} {r['payments_per_s']:>11.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""
+Reconciliation benchmark - verifying ledger payments one at a time versus a worker pool.
+
+Seeds --payments completed ledger payments, starts the stub gateway with
+--latency seconds per call and times reconcile_payments() with one worker
+(on --sample payments, extrapolated) and with --workers lookups in flight.
+
+Usage:
+    python -m benchmarks.bench_reconcile --payments 10000 --latency 0.3 --workers 200
+"""
+
+import argparse
+import json
+import os
+import tempfile
+from datetime import datetime
+
+import database
+from services.payment_service import AsyncPaymentGateway
+from services.payment_simulator import StubGatewayServer
+from services.reconciliation import reconcile_payments
+
+
+def seed(payments: int) -> list:
+    now = datetime.now().isoformat()
+    ids = [f"txn_{n % 999999:06d}_{n}" for n in range(payments)]
+    with database.db_connection() as conn:
+        conn.executemany('''
+            INSERT INTO payments (idempotency_key, patron_id, amount, status, transaction_id,
+                                  message, created_at, updated_at)
+            VALUES (?, ?, 5.0, ?, ?, 'Paid', ?, ?)
+        ''', ((f"key-{n}", f"{n % 999999:06d}", database.PAYMENT_COMPLETED, txn, now, now)
+              for n, txn in enumerate(ids)))
+        conn.commit()
+    return ids
+
+
+def run(payments: int, latency: float, workers: int, sample: int, rate_limit: float = None) -> dict:
+    original = database.DATABASE
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            database.DATABASE = os.path.join(tmp, 'library.db')
+            database.configure_pool()
+            database.init_database()
+            ids = seed(payments)
+
+            with StubGatewayServer(latency=latency) as server:
+                gateway = AsyncPaymentGateway(base_url=server.url, max_connections=workers)
+                sequential = reconcile_payments(ids[:sample], workers=1, gateway=gateway)
+                pooled = reconcile_payments(ids, workers=workers, rate_limit=rate_limit, gateway=gateway)
+
+            assert pooled['matched'] == payments
+            return {
+                'payments': payments,
+                'latency_s': latency,
+                'workers': workers,
+                'sequential_sample': sample,
+                'sequential_estimated_s': sequential['seconds'] / sample * payments,
+                'pooled_s': pooled['seconds'],
+                'pooled_per_s': payments / pooled['seconds'],
+            }
+    finally:
+        database.close_pool()
+        database.DATABASE = original
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--payments', type=int, default=10000)
+    parser.add_argument('--latency', type=float, default=0.3, help='stub gateway seconds per call')
+    parser.add_argument('--workers', type=int, default=200, help='lookups in flight')
+    parser.add_argument('--sample', type=int, default=20, help='payments verified one at a time')
+    parser.add_argument('--rate-limit', type=float, help='most lookups per second')
+    parser.add_argument('--json', action='store_true', help='print machine-readable output')
+    args = parser.parse_args()
+
+    results = run(args.payments, args.latency, args.workers, args.sample, args.rate_limit)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{results['payments']} payments, {results['latency_s']}s gateway latency")
+    print(f"one at a time:        ~{results['sequential_estimated_s']:.0f}s "
+          f"(from {results['sequential_sample']} payments)")
+    print(f"{results['workers']} workers:  {results['pooled_s']:>9.1f}s "
+          f"({results['pooled_per_s']:,.0f} payments/s)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""
+Search benchmark - latency of every search mode at a given catalog size.
+
+Seeds a fresh database with --books synthetic titles (executemany in one
+transaction, FTS kept in sync by the triggers) and times --queries searches
+per mode, reporting mean/p50/p95 in milliseconds.
+
+Usage:
+    python -m benchmarks.bench_search --books 1000000 --queries 200
+"""
+
+import argparse
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+
+import database
+
+# ~3,000 pronounceable words, so term selectivity resembles a real catalog
+_SYLLABLES = ("ka", "lo", "mi", "ren", "sha", "tor", "vel", "dun", "qui", "bra",
+              "est", "mor", "lin", "gar", "fi", "pol", "zen", "ur", "hal", "no")
+WORDS = tuple(a + b + c for a in _SYLLABLES for b in _SYLLABLES for c in ("n", "s", "th", "r", "", "x", "l", "m")
+              if a != b)
+SURNAMES = ("Herbert", "Le Guin", "Atwood", "Butler", "Tolkien", "Asimov",
+            "Morrison", "Ishiguro", "Calvino", "Borges")
+
+
+def seed(books: int) -> None:
+    rng = random.Random(42)
+    with database.db_connection() as conn:
+        conn.executemany('''
+            INSERT INTO books (title, author, isbn, total_copies, available_copies)
+            VALUES (?, ?, ?, ?, ?)
+        ''', ((f"{' '.join(rng.sample(WORDS, 3)).title()} {n}",
+               f"{rng.choice(SURNAMES)} {n % 997}", f"{n:013d}", 3, 3)
+              for n in range(1, books + 1)))
+        conn.commit()
+
+
+def _time(fn, queries) -> dict:
+    samples = []
+    for q in queries:
+        start = time.perf_counter()
+        fn(q)
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return {'mean_ms': statistics.fmean(samples),
+            'p50_ms': samples[len(samples) // 2],
+            'p95_ms': samples[int(len(samples) * 0.95) - 1]}
+
+
+def run(books: int, queries: int, limit: int) -> dict:
+    rng = random.Random(7)
+    original = database.DATABASE
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            database.DATABASE = os.path.join(tmp, 'library.db')
+            database.configure_pool(profile='bulk-load')
+            database.init_database()
+            seed(books)
+
+            words = [rng.choice(WORDS) for _ in range(queries)]
+            pairs = [f"{rng.choice(WORDS)} {rng.choice(WORDS)[:3]}" for _ in range(queries)]
+            isbns = [f"{rng.randint(1, books):013d}" for _ in range(queries)]
+            return {
+                'books': books,
+                'isbn': _time(lambda q: database.search_books(q, 'isbn'), isbns),
+                'title_prefix': _time(lambda q: database.search_books(
+                    q, 'title', limit=limit, match='prefix'), words),
+                'title_substring': _time(lambda q: database.search_books(
+                    q, 'title', limit=limit), words),
+                'fulltext': _time(lambda q: database.fulltext_search_books(
+                    q, limit=limit), pairs),
+            }
+    finally:
+        database.close_pool()
+        database.DATABASE = original
+        database.configure_pool(profile=database.DEFAULT_PROFILE)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--books', type=int, default=100000)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--limit', type=int, default=20, help='results per query')
+    parser.add_argument('--json', action='store_true', help='print machine-readable output')
+    args = parser.parse_args()
+
+    results = run(args.books, args.queries, args.limit)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{results.pop('books')} books")
+    print(f"{'mode':<16} {'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9}")
+    for mode, r in results.items():
+        print(f"{mode:<16} {r['mean_ms']:>9.2f} {r['p50_ms']:>9.2f} {r['p95_ms']:>9.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+"""
+Server benchmark - the Flask development server versus gunicorn on the same database.
+
+Seeds a --books book database (see benchmarks.suite.seed), then starts each
+server as a subprocess on wsgi:app and drives read-only routes over HTTP,
+--concurrency requests in flight at once, reporting p50/p95/p99 and
+requests per second:
+  * dev: app.run(threaded=True), one process,
+  * gunicorn: gunicorn.conf.py with --workers gthread workers.
+
+Results depend heavily on the machine's core count; run it on hardware
+shaped like production.
+
+Usage:
+    python -m benchmarks.bench_servers --books 10000 --requests 2000 --concurrency 32
+"""
+
+import argparse
+import http.client
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+import database
+from benchmarks.bench_search import WORDS
+from benchmarks.suite import drive_load, seed
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ROUTES = ('/catalog', '/api/books?limit=50', f'/api/search?q={WORDS[0]}&type=title')
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _commands(port: int, workers: int) -> Dict[str, List[str]]:
+    return {
+        'dev': [sys.executable, '-c',
+                f"from wsgi import app; app.run(host='127.0.0.1', port={port}, threaded=True)"],
+        'gunicorn': [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py',
+                     '--bind', f'127.0.0.1:{port}', '--workers', str(workers),
+                     'wsgi:app'],
+    }
+
+
+def _wait_until_up(port: int, process: subprocess.Popen, timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'server exited with status {process.returncode}')
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.5).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError('server did not start')
+
+
+def run(books: int, requests: int, concurrency: int, workers: int) -> Dict:
+    original = database.DATABASE
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            database.DATABASE = os.path.join(tmp, 'library.db')
+            database.configure_pool(profile='bulk-load')
+            database.init_database()
+            seed(books, books * 2)
+            database.close_pool()
+
+            results = {'meta': {'books': books, 'requests': requests, 'concurrency': concurrency,
+                                'workers': workers, 'cpus': os.cpu_count()}}
+            port = _free_port()
+            env = dict(os.environ, DATABASE_PATH=database.DATABASE, GUNICORN_ACCESS_LOG='',
+                       GUNICORN_THREADS=str(max(concurrency // workers, 1)))
+            for server, command in _commands(port, workers).items():
+                process = subprocess.Popen(command, cwd=ROOT, env=env,
+                                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                try:
+                    _wait_until_up(port, process)
+
+                    def send(path):
+                        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+                        try:
+                            conn.request('GET', path)
+                            response = conn.getresponse()
+                            response.read()
+                            return response.status
+                        finally:
+                            conn.close()
+
+                    results[server] = {}
+                    for path in ROUTES:
+                        drive_load(send, lambda i: (path,), concurrency, concurrency)    # warm up
+                        results[server][path] = drive_load(send, lambda i: (path,), requests, concurrency)
+                finally:
+                    process.terminate()
+                    process.wait(timeout=30)
+            return results
+    finally:
+        database.DATABASE = original
+        database.configure_pool(profile=database.DEFAULT_PROFILE)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--books', type=int, default=10000)
+    parser.add_argument('--requests', type=int, default=2000, help='requests per route and server')
+    parser.add_argument('--concurrency', type=int, default=32, help='requests in flight')
+    parser.add_argument('--workers', type=int, default=(os.cpu_count() or 1) * 2 + 1,
+                        help='gunicorn worker processes')
+    parser.add_argument('--json', action='store_true', help='print machine-readable output')
+    args = parser.parse_args()
+
+    results = run(args.books, args.requests, args.concurrency, args.workers)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    meta = results['meta']
+    print(f"{meta['books']} books, {meta['concurrency']} concurrent, {meta['workers']} gunicorn workers, "
+          f"{meta['cpus']} CPUs")
+    print(f"{'server':<10} {'route':<34} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'req/s':>8}")
+    for server in ('dev', 'gunicorn'):
+        for path, r in results[server].items():
+            errors = f"  {r['errors']} errors" if r['errors'] else ''
+            print(f"{server:<10} {path:<34} {r['p50_ms']:>8.2f} {r['p95_ms']:>8.2f} {r['p99_ms']:>8.2f} "
+                  f"{r['rps']:>8.1f}{errors}")
+
+
+if __name__ == '__main__':
+    main()
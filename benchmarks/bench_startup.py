@@ -0,0 +1,121 @@
+"""
+Startup benchmark - how long a new process takes to import the app and run create_app().
+
+Each run is a fresh interpreter (as for a new server worker or test session)
+that imports app and calls create_app() against:
+  * cold: a new, empty database file (schema created),
+  * warm: a database already at the current schema version,
+  * unversioned: an up-to-date database whose stored schema version was
+    reset, so every DDL statement and migration check runs again; what
+    every start cost before the version was stored.
+
+Also reports create_app() in an already-warm process (modules imported), as
+a test suite creating an app per test sees it. Medians over --runs.
+
+Usage:
+    python -m benchmarks.bench_startup --runs 10
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict
+
+import database
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in the child: the split between importing and create_app()
+_BOOT = """
+import json, sys, time
+start = time.perf_counter()
+import database
+database.DATABASE = sys.argv[1]
+from app import create_app
+imported = time.perf_counter()
+create_app()
+done = time.perf_counter()
+print(json.dumps({'import_ms': (imported - start) * 1000, 'create_app_ms': (done - imported) * 1000,
+                  'aiohttp_imported': 'aiohttp' in sys.modules}))
+"""
+
+
+def _boot(db_path: str) -> Dict:
+    start = time.perf_counter()
+    out = subprocess.run([sys.executable, '-c', _BOOT, db_path], cwd=ROOT, check=True,
+                         capture_output=True, text=True).stdout
+    return dict(json.loads(out), process_ms=(time.perf_counter() - start) * 1000)
+
+
+def _median(boots) -> Dict:
+    return {key: statistics.median(boot[key] for boot in boots)
+            for key in ('process_ms', 'import_ms', 'create_app_ms')}
+
+
+def run(runs: int) -> Dict:
+    original = database.DATABASE
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            cold = []
+            for n in range(runs):
+                cold.append(_boot(os.path.join(tmp, f'cold-{n}.db')))
+
+            warm_db = os.path.join(tmp, 'warm.db')
+            _boot(warm_db)
+            warm = [_boot(warm_db) for _ in range(runs)]
+
+            unversioned = []
+            for _ in range(runs):
+                with sqlite3.connect(warm_db) as conn:
+                    conn.execute('PRAGMA user_version = 0')
+                unversioned.append(_boot(warm_db))
+
+            from app import create_app
+            database.DATABASE = warm_db
+            create_app()
+            in_process = []
+            for _ in range(runs):
+                start = time.perf_counter()
+                create_app()
+                in_process.append((time.perf_counter() - start) * 1000)
+            database.close_pool()
+
+            return {
+                'runs': runs,
+                'cold': _median(cold),
+                'warm': _median(warm),
+                'unversioned': _median(unversioned),
+                'in_process_create_app_ms': statistics.median(in_process),
+                'aiohttp_imported': any(boot['aiohttp_imported'] for boot in cold + warm),
+            }
+    finally:
+        database.DATABASE = original
+        database.configure_pool(profile=database.DEFAULT_PROFILE)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--runs', type=int, default=10, help='boots per scenario')
+    parser.add_argument('--json', action='store_true', help='print machine-readable output')
+    args = parser.parse_args()
+
+    results = run(args.runs)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'boot':<12} {'process ms':>11} {'import ms':>10} {'create_app ms':>14}")
+    for name in ('cold', 'warm', 'unversioned'):
+        r = results[name]
+        print(f"{name:<12} {r['process_ms']:>11.1f} {r['import_ms']:>10.1f} {r['create_app_ms']:>14.2f}")
+    print(f"create_app() in a warm process: {results['in_process_create_app_ms']:.2f} ms")
+    print(f"aiohttp imported at startup: {'yes' if results['aiohttp_imported'] else 'no'}")
+
+
+if __name__ == '__main__':
+    main()
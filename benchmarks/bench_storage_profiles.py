@@ -0,0 +1,121 @@
+"""
+Storage profile benchmark - read/write throughput per STORAGE_PROFILES entry.
+
+Each profile gets a fresh database seeded with --books titles. The write phase
+runs borrow/return transactions back to back; the mixed phase runs --readers
+threads doing get_book_by_id() while one writer keeps borrowing and returning.
+
+Usage:
+    python -m benchmarks.bench_storage_profiles --books 5000 --seconds 3
+"""
+
+import argparse
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+import database
+
+
+def _seed(books: int) -> None:
+    with database.db_connection() as conn:
+        conn.executemany('''
+            INSERT INTO books (title, author, isbn, total_copies, available_copies)
+            VALUES (?, ?, ?, ?, ?)
+        ''', ((f"Title {n}", f"Author {n % 500}", f"{n:013d}", 5, 5) for n in range(1, books + 1)))
+        conn.commit()
+
+
+def _borrow_and_return(book_id: int, patron_id: str) -> None:
+    now = datetime.now()
+    database.borrow_book_transaction(patron_id, book_id, now, now + timedelta(days=14))
+    database.return_book_transaction(patron_id, book_id, now)
+
+
+def _write_phase(books: int, seconds: float) -> float:
+    ops = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        _borrow_and_return(random.randint(1, books), "100000")
+        ops += 2
+    return ops / seconds
+
+
+def _mixed_phase(books: int, seconds: float, readers: int) -> dict:
+    stop = threading.Event()
+    counts = {'reads': 0, 'writes': 0}
+    lock = threading.Lock()
+
+    def reader():
+        n = 0
+        while not stop.is_set():
+            database.get_book_by_id(random.randint(1, books))
+            n += 1
+        with lock:
+            counts['reads'] += n
+
+    def writer():
+        n = 0
+        while not stop.is_set():
+            _borrow_and_return(random.randint(1, books), "200000")
+            n += 2
+        with lock:
+            counts['writes'] += n
+
+    threads = [threading.Thread(target=reader) for _ in range(readers)]
+    threads.append(threading.Thread(target=writer))
+    for t in threads:
+        t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    return {'reads_per_sec': counts['reads'] / seconds,
+            'writes_per_sec': counts['writes'] / seconds}
+
+
+def run(books: int, seconds: float, readers: int) -> dict:
+    results = {}
+    original = database.DATABASE
+    try:
+        for profile in database.STORAGE_PROFILES:
+            with tempfile.TemporaryDirectory() as tmp:
+                database.DATABASE = os.path.join(tmp, 'library.db')
+                database.configure_pool(size=readers + 2, profile=profile)
+                database.init_database()
+                _seed(books)
+                results[profile] = {'writes_per_sec': _write_phase(books, seconds)}
+                mixed = _mixed_phase(books, seconds, readers)
+                results[profile].update({f'mixed_{k}': v for k, v in mixed.items()})
+                database.close_pool()
+    finally:
+        database.DATABASE = original
+        database.configure_pool(profile=database.DEFAULT_PROFILE)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--books', type=int, default=5000)
+    parser.add_argument('--seconds', type=float, default=3.0)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--json', action='store_true', help='print machine-readable output')
+    args = parser.parse_args()
+
+    results = run(args.books, args.seconds, args.readers)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'profile':<10} {'writes/s':>10} {'mixed reads/s':>14} {'mixed writes/s':>15}")
+    for profile, r in results.items():
+        print(f"{profile:<10} {r['writes_per_sec']:>10.0f} "
+              f"{r['mixed_reads_per_sec']:>14.0f} {r['mixed_writes_per_sec']:>15.0f}")
+
+
+if __name__ == '__main__':
+    main()
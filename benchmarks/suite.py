@@ -0,0 +1,475 @@
+"""
+Benchmark suite - latency and throughput of every data and service function and route.
+
+Seeds a library database at a given scale, then:
+  * micro-benchmarks each public function in database.py and
+    services/library_service.py (--iterations calls each),
+  * drives the main routes through the Flask test client and through a real
+    threaded WSGI server, --concurrency requests in flight at once.
+
+Every entry reports p50/p95/p99 in milliseconds and calls (or requests) per
+second. --output writes the results as JSON; --compare checks them against an
+earlier run and exits 1 if any p95 grew by more than --tolerance.
+
+Scales: small (1k books, 10k loans), medium (100k books, 1M loans) and
+large (1M books, 10M loans); --books/--loans override either number. Seeding
+the large scale takes minutes, so pass --database to keep the seeded file:
+a later run with the same path reuses it.
+
+Usage:
+    python -m benchmarks.suite --scale medium --output baseline.json
+    python -m benchmarks.suite --scale medium --compare baseline.json
+"""
+
+import argparse
+import http.client
+import inspect
+import json
+import logging
+import math
+import os
+import platform
+import random
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+
+from werkzeug.serving import make_server
+
+import database
+from app import create_app
+from benchmarks.bench_search import SURNAMES, WORDS
+from services import library_service
+
+SCALES = {
+    'small': (1_000, 10_000),
+    'medium': (100_000, 1_000_000),
+    'large': (1_000_000, 10_000_000),
+}
+
+# Set-up and plumbing, timed indirectly through everything else
+_NOT_TIMED = {
+    'apply_storage_profile', 'configure_pool', 'get_pool', 'close_pool', 'configure_book_cache',
+    'add_catalog_listener', 'get_db_connection', 'release_db_connection', 'db_connection',
+    'close_request_connection', 'init_app', 'migrate_schema', 'init_database', 'add_sample_data',
+    'add_query_listener', 'add_acquire_listener',
+}
+
+# Calls capped for functions that scan a whole table
+_FULL_SCAN_CALLS = 5
+
+COPIES = 5
+OPEN_PER_PATRON = 4             # seeded open loans per patron, one below the borrow limit
+
+
+def percentiles(samples: List[float]) -> Dict:
+    """p50/p95/p99 (nearest rank) and mean of a list of seconds, in milliseconds."""
+    ordered = sorted(samples)
+
+    def rank(p):
+        return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)] * 1000
+
+    return {'count': len(ordered), 'mean_ms': sum(ordered) / len(ordered) * 1000,
+            'p50_ms': rank(50), 'p95_ms': rank(95), 'p99_ms': rank(99)}
+
+
+def seed(books: int, loans: int) -> None:
+    """
+    Synthetic catalog and loan history, with availability consistent with open loans.
+
+    One in ten loans (at most two per book) is still open, four per patron;
+    the rest are returned. Loans were made over the last 60 days, so some
+    open ones are overdue.
+    """
+    rng = random.Random(42)
+    now = datetime.now()
+    open_loans = min(loans // 10, books * 2)
+    patrons = max(open_loans // OPEN_PER_PATRON, 1)
+    with database.db_connection() as conn:
+        conn.executemany('''
+            INSERT INTO books (title, author, isbn, total_copies, available_copies)
+            VALUES (?, ?, ?, ?, ?)
+        ''', ((f"{' '.join(rng.sample(WORDS, 3)).title()} {n}",
+               f"{rng.choice(SURNAMES)} {n % 997}", f"{n:013d}", COPIES, COPIES)
+              for n in range(1, books + 1)))
+
+        def rows():
+            for n in range(loans):
+                borrowed = now - timedelta(days=rng.randint(0, 60), hours=rng.randint(0, 23))
+                due = borrowed + timedelta(days=14)
+                if n < open_loans:
+                    yield (f"{n // OPEN_PER_PATRON:06d}", n % books + 1,
+                           borrowed.isoformat(), due.isoformat(), None)
+                else:
+                    returned = due + timedelta(days=rng.randint(-10, 10))
+                    yield (f"{rng.randrange(patrons):06d}", rng.randint(1, books),
+                           borrowed.isoformat(), due.isoformat(), returned.isoformat())
+
+        conn.executemany('''
+            INSERT INTO borrow_records (patron_id, book_id, borrow_date, due_date, return_date)
+            VALUES (?, ?, ?, ?, ?)
+        ''', rows())
+        conn.execute('''
+            UPDATE books SET available_copies = total_copies - (
+                SELECT COUNT(*) FROM borrow_records
+                WHERE book_id = books.id AND return_date IS NULL)
+            WHERE id <= ?
+        ''', (min(open_loans, books),))
+        conn.commit()
+
+
+def _micro_cases(books: int, patrons: int, rng: random.Random) -> List[Tuple[str, Callable, Optional[int]]]:
+    """(name, call(i), call cap) for every function benchmarked; runs in order, sharing state."""
+    now = datetime.now()
+    due = now + timedelta(days=14)
+    book_ids = [rng.randint(1, books) for _ in range(1000)]
+    patron_ids = [f"{rng.randrange(patrons):06d}" for _ in range(1000)]
+    words = [rng.choice(WORDS) for _ in range(1000)]
+    keys = [(book['title'], book['id']) for book in (database.get_book_by_id(b) for b in book_ids[:50])]
+    cursors = [database.encode_cursor(key) for key in keys]
+
+    def pick(seq, i):
+        return seq[i % len(seq)]
+
+    def loan(prefix, i):
+        # a fresh patron per call (above the seeded patron IDs), so the borrow limit never interferes
+        return f"{prefix}{i:05d}", pick(book_ids, i)
+
+    def pairs(i, size):
+        return [(pick(patron_ids, i + n), pick(book_ids, i + n)) for n in range(size)]
+
+    def explain(sql, parameters):
+        with database.db_connection() as conn:
+            return database.explain_query_plan(conn, sql, parameters)
+
+    payments: List[Dict] = []
+    refunds: List[Dict] = []
+    jobs: List[int] = []
+    db, svc = 'database', 'library_service'
+    return [
+        (f'{db}.get_all_books', lambda i: database.get_all_books(), _FULL_SCAN_CALLS),
+        (f'{db}.iter_table_rows', lambda i: sum(1 for _ in database.iter_table_rows('books')),
+         _FULL_SCAN_CALLS),
+        (f'{db}.encode_cursor', lambda i: database.encode_cursor(pick(keys, i)), None),
+        (f'{db}.decode_cursor', lambda i: database.decode_cursor(pick(cursors, i)), None),
+        (f'{db}.get_books_page', lambda i: database.get_books_page(after=pick(keys, i)), None),
+        (f'{db}.get_book_by_id', lambda i: database.get_book_by_id(pick(book_ids, i)), None),
+        (f'{db}.get_book_by_isbn', lambda i: database.get_book_by_isbn(f"{pick(book_ids, i):013d}"), None),
+        (f'{db}.search_books', lambda i: database.search_books(pick(words, i), 'title', limit=20), None),
+        (f'{db}.fulltext_search_books', lambda i: database.fulltext_search_books(pick(words, i), limit=20),
+         None),
+        (f'{db}.get_patron_borrowed_books', lambda i: database.get_patron_borrowed_books(pick(patron_ids, i)),
+         None),
+        (f'{db}.get_patron_borrow_count', lambda i: database.get_patron_borrow_count(pick(patron_ids, i)),
+         None),
+        (f'{db}.get_patron_status', lambda i: database.get_patron_status(pick(patron_ids, i)), None),
+        (f'{db}.get_loan_fees', lambda i: database.get_loan_fees(pairs(i, 50)), None),
+        (f'{db}.get_overdue_fees', lambda i: database.get_overdue_fees(), _FULL_SCAN_CALLS),
+        (f'{db}.get_outstanding_fees', lambda i: database.get_outstanding_fees(pick(patron_ids, i)), None),
+        (f'{db}.insert_book', lambda i: database.insert_book(
+            f"Bench Book {i}", "Bench Author", f"98{i:011d}", 2, 2), None),
+        (f'{db}.insert_books_bulk', lambda i: database.insert_books_bulk(
+            [(f"Bulk Book {i}-{n}", "Bench Author", f"97{i:08d}{n:03d}", 2) for n in range(10)]), None),
+        (f'{db}.update_book_availability', lambda i: database.update_book_availability(
+            pick(book_ids, i), -1 if i % 2 == 0 else 1), None),
+        (f'{db}.insert_borrow_record', lambda i: database.insert_borrow_record(*loan('5', i), now, due),
+         None),
+        (f'{db}.update_borrow_record_return_date', lambda i: database.update_borrow_record_return_date(
+            *loan('5', i), now), None),
+        (f'{db}.borrow_book_transaction', lambda i: database.borrow_book_transaction(
+            *loan('6', i), now, due), None),
+        (f'{db}.return_book_transaction', lambda i: database.return_book_transaction(*loan('6', i), now),
+         None),
+        (f'{db}.borrow_books_transaction', lambda i: database.borrow_books_transaction(
+            [loan('7', i * 10 + n) for n in range(10)], now, due), None),
+        (f'{db}.return_books_transaction', lambda i: database.return_books_transaction(
+            [loan('7', i * 10 + n) for n in range(10)], now), None),
+        (f'{db}.create_payment', lambda i: payments.append(database.create_payment(
+            f"bench-{i}", pick(patron_ids, i), 5.0, [])[1]), None),
+        (f'{db}.payment_unsettled', lambda i: database.payment_unsettled(pick(payments, i)), None),
+        (f'{db}.record_payment_error', lambda i: database.record_payment_error(
+            pick(payments, i)['id'], "Payment processing error: timeout"), None),
+        (f'{db}.get_unsettled_payments', lambda i: database.get_unsettled_payments(pick(patron_ids, i)), None),
+        (f'{db}.settle_payment', lambda i: database.settle_payment(
+            pick(payments, i)['id'], database.PAYMENT_COMPLETED, f"txn_bench_{i}", "Paid"), None),
+        (f'{db}.get_payment', lambda i: database.get_payment(f"bench-{i % len(payments)}"), None),
+        (f'{db}.get_payment_by_transaction', lambda i: database.get_payment_by_transaction(
+            f"txn_bench_{i % len(payments)}"), None),
+        (f'{db}.reserve_refund', lambda i: refunds.append(database.reserve_refund(
+            f"txn_bench_{i % len(payments)}", 0.01, f"bench-refund-{i}")[1]), None),
+        (f'{db}.record_refund_error', lambda i: database.record_refund_error(
+            pick(refunds, i)['id'], "Refund processing error: timeout"), None),
+        (f'{db}.get_refund', lambda i: database.get_refund(f"bench-refund-{i % len(refunds)}"), None),
+        (f'{db}.settle_refund', lambda i: database.settle_refund(
+            pick(refunds, i)['id'], database.PAYMENT_FAILED, "declined"), None),
+        (f'{db}.get_unreconciled_transactions', lambda i: database.get_unreconciled_transactions(100), None),
+        (f'{db}.get_payment_statuses', lambda i: database.get_payment_statuses(
+            [f"txn_bench_{n}" for n in range(min(100, len(payments)))]), None),
+        (f'{db}.record_reconciliation', lambda i: database.record_reconciliation(
+            [(f"txn_bench_{i % len(payments)}", 'completed')]), None),
+        (f'{db}.enqueue_job', lambda i: jobs.append(database.enqueue_job(
+            'bench', {'n': i}, idempotency_key=f"bench-job-{i}")[1]['id']), None),
+        (f'{db}.claim_job', lambda i: database.claim_job('bench'), None),
+        (f'{db}.renew_job_leases', lambda i: database.renew_job_leases('bench'), None),
+        (f'{db}.retry_job', lambda i: database.retry_job(pick(jobs, i), 0, 'bench'), None),
+        (f'{db}.requeue_running_jobs', lambda i: database.requeue_running_jobs(), None),
+        (f'{db}.finish_job', lambda i: database.finish_job(pick(jobs, i), database.JOB_DONE, {}), None),
+        (f'{db}.get_job', lambda i: database.get_job(pick(jobs, i)), None),
+        (f'{db}.count_jobs_by_status', lambda i: database.count_jobs_by_status(), None),
+        (f'{db}.get_pool_stats', lambda i: database.get_pool_stats(), None),
+        (f'{db}.get_book_cache_stats', lambda i: database.get_book_cache_stats(), None),
+        (f'{db}.get_catalog_version', lambda i: database.get_catalog_version(), None),
+        (f'{db}.sync_catalog', lambda i: database.sync_catalog(), None),
+        (f'{db}.explain_query_plan', lambda i: explain(
+            'SELECT * FROM books WHERE id = ?', (pick(book_ids, i),)), None),
+        (f'{svc}.validate_book_fields', lambda i: library_service.validate_book_fields(
+            "Title", "Author", f"{i:013d}", 3), None),
+        (f'{svc}.add_book_to_catalog', lambda i: library_service.add_book_to_catalog(
+            f"Service Book {i}", "Bench Author", f"96{i:011d}", 2), None),
+        (f'{svc}.borrow_book_by_patron', lambda i: library_service.borrow_book_by_patron(*loan('8', i)),
+         None),
+        (f'{svc}.return_book_by_patron', lambda i: library_service.return_book_by_patron(*loan('8', i)),
+         None),
+        (f'{svc}.borrow_books_batch', lambda i: library_service.borrow_books_batch(
+            [loan('9', i * 10 + n) for n in range(10)]), None),
+        (f'{svc}.return_books_batch', lambda i: library_service.return_books_batch(
+            [loan('9', i * 10 + n) for n in range(10)]), None),
+        (f'{svc}.calculate_late_fee', lambda i: library_service.calculate_late_fee(i % 30), None),
+        (f'{svc}.calculate_late_fee_for_book', lambda i: library_service.calculate_late_fee_for_book(
+            *pairs(i, 1)[0]), None),
+        (f'{svc}.calculate_late_fees', lambda i: library_service.calculate_late_fees(pairs(i, 50)), None),
+        (f'{svc}.get_patron_late_fees', lambda i: library_service.get_patron_late_fees(pick(patron_ids, i)),
+         None),
+        (f'{svc}.search_books_in_catalog', lambda i: library_service.search_books_in_catalog(
+            pick(words, i), 'author' if i % 2 else 'title', limit=20), None),
+        (f'{svc}.get_patron_status_report', lambda i: library_service.get_patron_status_report(
+            pick(patron_ids, i)), None),
+    ]
+
+
+def not_benchmarked(names) -> List[str]:
+    """Public functions of the two modules with no micro-benchmark (other than set-up)."""
+    missing = []
+    for prefix, module in (('database', database), ('library_service', library_service)):
+        for name, fn in inspect.getmembers(module, inspect.isfunction):
+            if (fn.__module__ == module.__name__ and not name.startswith('_')
+                    and name not in _NOT_TIMED and f'{prefix}.{name}' not in names):
+                missing.append(f'{prefix}.{name}')
+    return missing
+
+
+def run_micro(books: int, patrons: int, iterations: int) -> Dict:
+    results = {}
+    for name, call, cap in _micro_cases(books, patrons, random.Random(7)):
+        samples = []
+        for i in range(min(iterations, cap or iterations)):
+            start = time.perf_counter()
+            call(i)
+            samples.append(time.perf_counter() - start)
+        results[name] = dict(percentiles(samples), ops_per_s=len(samples) / sum(samples))
+    return results
+
+
+def _http_scenarios(books: int, patrons: int, prefix: str) -> List[Tuple[str, Callable]]:
+    """(name, request(i) -> (method, path, json body, form)) for each route driven."""
+    rng = random.Random(11)
+    book_ids = [rng.randint(1, books) for _ in range(1000)]
+    patron_ids = [f"{rng.randrange(patrons):06d}" for _ in range(1000)]
+    words = [rng.choice(WORDS) for _ in range(1000)]
+
+    def pick(seq, i):
+        return seq[i % len(seq)]
+
+    def loan(i):
+        # the borrow and return scenarios pair up: POST /return returns what POST /borrow took
+        return {'patron_id': f"{prefix}{i:05d}", 'book_id': str(pick(book_ids, i))}
+
+    return [
+        ('GET /catalog', lambda i: ('GET', '/catalog', None, None)),
+        ('GET /api/books', lambda i: ('GET', '/api/books?limit=50', None, None)),
+        ('GET /search', lambda i: ('GET', f'/search?q={pick(words, i)}&type=title', None, None)),
+        ('GET /api/search', lambda i: ('GET', f'/api/search?q={pick(words, i)}&type=title', None, None)),
+        ('GET /patron/<id>', lambda i: ('GET', f'/patron/{pick(patron_ids, i)}', None, None)),
+        ('GET /api/patron/<id>', lambda i: ('GET', f'/api/patron/{pick(patron_ids, i)}', None, None)),
+        ('GET /api/late_fees/<id>', lambda i: ('GET', f'/api/late_fees/{pick(patron_ids, i)}', None, None)),
+        ('POST /api/late_fees', lambda i: ('POST', '/api/late_fees', {'items': [
+            {'patron_id': pick(patron_ids, i + n), 'book_id': pick(book_ids, i + n)} for n in range(20)]},
+            None)),
+        ('POST /borrow', lambda i: ('POST', '/borrow', None, loan(i))),
+        ('POST /return', lambda i: ('POST', '/return', None, loan(i))),
+    ]
+
+
+def drive_load(send: Callable, request: Callable, requests: int, concurrency: int) -> Dict:
+    """Call send(*request(i)) for i in range(requests), concurrency at a time; latency percentiles and rps."""
+    samples, errors = [], 0
+    lock = threading.Lock()
+
+    def one(i):
+        nonlocal errors
+        start = time.perf_counter()
+        try:
+            status = send(*request(i))
+        except OSError:
+            status = 0
+        elapsed = time.perf_counter() - start
+        with lock:
+            samples.append(elapsed)
+            errors += not 200 <= status < 400
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(one, range(requests)))
+    wall = time.perf_counter() - start
+    return dict(percentiles(samples), rps=requests / wall, errors=errors)
+
+
+def run_http(app, books: int, patrons: int, requests: int, concurrency: int) -> Dict:
+    local = threading.local()
+
+    def test_client_send(method, path, body, form):
+        if not hasattr(local, 'client'):
+            local.client = app.test_client()
+        return local.client.open(path, method=method, json=body, data=form).status_code
+
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    def wsgi_send(method, path, body, form):
+        conn = http.client.HTTPConnection('127.0.0.1', server.server_port, timeout=30)
+        try:
+            if body is not None:
+                payload, headers = json.dumps(body), {'Content-Type': 'application/json'}
+            elif form is not None:
+                payload = '&'.join(f"{k}={v}" for k, v in form.items())
+                headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+            else:
+                payload, headers = None, {}
+            conn.request(method, path, payload, headers)
+            response = conn.getresponse()
+            response.read()
+            return response.status
+        finally:
+            conn.close()
+
+    results = {'test_client': {}, 'wsgi': {}}
+    try:
+        for mode, send, prefix in (('test_client', test_client_send, '3'), ('wsgi', wsgi_send, '4')):
+            for name, request in _http_scenarios(books, patrons, prefix):
+                results[mode][name] = drive_load(send, request, requests, concurrency)
+    finally:
+        server.shutdown()
+    return results
+
+
+def run(books: int, loans: int, iterations: int, requests: int, concurrency: int,
+        db_path: Optional[str] = None, skip_http: bool = False) -> Dict:
+    original = database.DATABASE
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            database.DATABASE = db_path or os.path.join(tmp, 'library.db')
+            reuse = db_path is not None and os.path.exists(db_path)
+            database.configure_pool(profile='bulk-load')
+            database.init_database()
+            start = time.perf_counter()
+            if not reuse:
+                seed(books, loans)
+            seeded = time.perf_counter() - start
+
+            app = create_app({'DATABASE_POOL_SIZE': max(concurrency, database.DEFAULT_POOL_SIZE)})
+            with database.db_connection() as conn:
+                books = conn.execute('SELECT MAX(id) FROM books').fetchone()[0]
+                loans = conn.execute('SELECT COUNT(*) FROM borrow_records').fetchone()[0]
+            patrons = max(min(loans // 10, books * 2) // OPEN_PER_PATRON, 1)
+
+            results = {
+                'meta': {'books': books, 'loans': loans, 'iterations': iterations,
+                         'requests': requests, 'concurrency': concurrency,
+                         'seed_seconds': seeded, 'reused_database': reuse,
+                         'python': platform.python_version(),
+                         'timestamp': datetime.now().isoformat(timespec='seconds')},
+                'micro': run_micro(books, patrons, iterations),
+            }
+            if not skip_http:
+                results['http'] = run_http(app, books, patrons, requests, concurrency)
+            results['not_benchmarked'] = not_benchmarked(results['micro'])
+            return results
+    finally:
+        database.close_pool()
+        database.DATABASE = original
+        database.configure_pool(profile=database.DEFAULT_PROFILE)
+
+
+def _flatten(results: Dict) -> Dict[str, Dict]:
+    entries = {f'micro {name}': r for name, r in results.get('micro', {}).items()}
+    for mode, routes in results.get('http', {}).items():
+        entries.update({f'{mode} {name}': r for name, r in routes.items()})
+    return entries
+
+
+def compare(results: Dict, baseline: Dict, tolerance: float) -> List[Dict]:
+    """Entries whose p95 grew by more than tolerance (0.2 = 20%) over the baseline."""
+    before = _flatten(baseline)
+    regressions = []
+    for name, r in _flatten(results).items():
+        old = before.get(name)
+        if old and old['p95_ms'] > 0 and r['p95_ms'] > old['p95_ms'] * (1 + tolerance):
+            regressions.append({'name': name, 'baseline_p95_ms': old['p95_ms'], 'p95_ms': r['p95_ms'],
+                                'change': r['p95_ms'] / old['p95_ms'] - 1})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--scale', choices=SCALES, default='small')
+    parser.add_argument('--books', type=int, help='override the scale\'s book count')
+    parser.add_argument('--loans', type=int, help='override the scale\'s borrow record count')
+    parser.add_argument('--database', help='seeded database file to keep and reuse')
+    parser.add_argument('--iterations', type=int, default=200, help='calls per function')
+    parser.add_argument('--requests', type=int, default=500, help='requests per route and server')
+    parser.add_argument('--concurrency', type=int, default=16, help='requests in flight')
+    parser.add_argument('--no-http', action='store_true', help='micro-benchmarks only')
+    parser.add_argument('--output', help='write the JSON results to this file')
+    parser.add_argument('--compare', help='earlier JSON results to check for regressions')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed p95 growth (0.2 = 20%%)')
+    parser.add_argument('--json', action='store_true', help='print machine-readable output')
+    args = parser.parse_args()
+
+    books, loans = SCALES[args.scale]
+    results = run(args.books or books, args.loans or loans, args.iterations, args.requests,
+                  args.concurrency, db_path=args.database, skip_http=args.no_http)
+    if args.compare:
+        with open(args.compare) as f:
+            results['regressions'] = compare(results, json.load(f), args.tolerance)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        meta = results['meta']
+        print(f"{meta['books']} books, {meta['loans']} loans (seeded in {meta['seed_seconds']:.1f}s)")
+        print(f"{'benchmark':<58} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'per s':>9}")
+        for name, r in _flatten(results).items():
+            rate = r.get('rps', r.get('ops_per_s'))
+            errors = f"  {r['errors']} errors" if r.get('errors') else ''
+            print(f"{name:<58} {r['p50_ms']:>8.2f} {r['p95_ms']:>8.2f} {r['p99_ms']:>8.2f} "
+                  f"{rate:>9.1f}{errors}")
+        if results['not_benchmarked']:
+            print("not benchmarked: " + ', '.join(results['not_benchmarked']))
+        for r in results.get('regressions', []):
+            print(f"REGRESSION {r['name']}: p95 {r['baseline_p95_ms']:.2f} -> {r['p95_ms']:.2f} ms "
+                  f"(+{r['change']:.0%})")
+    if results.get('regressions'):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""
+CLI Commands - Flask command-line entry points
+Registered by create_app(); run with `flask --app app <command>`.
+"""
+
+import csv
+import os
+
+import click
+
+import database
+from services.catalog_import import DEFAULT_CHUNK_SIZE, READERS, import_books_from_file
+from services.reconciliation import DEFAULT_BATCH_SIZE, DEFAULT_WORKERS, reconcile_payments
+
+
+def register_commands(app):
+    """Register all CLI commands with the Flask app."""
+    app.cli.add_command(load_sample_data_command)
+    app.cli.add_command(import_books_command)
+    app.cli.add_command(late_fee_report_command)
+    app.cli.add_command(reconcile_payments_command)
+
+
+@click.command('load-sample-data')
+def load_sample_data_command():
+    """Add the demo books and loan to an empty catalog."""
+    if database.add_sample_data():
+        click.echo('Sample data loaded.')
+    else:
+        click.echo('The catalog already has books; sample data not loaded.')
+
+
+@click.command('import-books')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'file_format', type=click.Choice(sorted(READERS)),
+              help='Input format (default: from the file extension).')
+@click.option('--chunk-size', default=DEFAULT_CHUNK_SIZE, show_default=True,
+              help='Rows per transaction.')
+@click.option('--profile', type=click.Choice(sorted(database.STORAGE_PROFILES)),
+              help='Storage profile for the import (e.g. bulk-load).')
+@click.option('--errors', 'errors_path', type=click.Path(dir_okay=False),
+              help='Write the per-row error report to this CSV file.')
+def import_books_command(path, file_format, chunk_size, profile, errors_path):
+    """Bulk-import books from a CSV or JSONL file."""
+    if file_format is None:
+        file_format = os.path.splitext(path)[1].lstrip('.').lower()
+        if file_format == 'ndjson':
+            file_format = 'jsonl'
+        if file_format not in READERS:
+            raise click.UsageError('Cannot infer the format from the extension; pass --format.')
+
+    if profile:
+        database.configure_pool(profile=profile)
+
+    with open(path, newline='', encoding='utf-8') as stream:
+        report = import_books_from_file(stream, file_format, chunk_size=chunk_size)
+
+    click.echo(f"{report['inserted']} of {report['total']} books imported, "
+               f"{report['failed']} rejected.")
+
+    if errors_path:
+        with open(errors_path, 'w', newline='', encoding='utf-8') as out:
+            writer = csv.DictWriter(out, fieldnames=['row', 'isbn', 'error'])
+            writer.writeheader()
+            writer.writerows(report['errors'])
+    else:
+        for error in report['errors'][:20]:
+            click.echo(f"  row {error['row']}: {error['error']}", err=True)
+        if report['failed'] > 20:
+            click.echo(f"  ... {report['failed'] - 20} more (use --errors FILE)", err=True)
+
+
+@click.command('late-fee-report')
+@click.option('--patron', 'patron_id', help='Only this patron (6-digit ID).')
+@click.option('--csv', 'csv_path', type=click.Path(dir_okay=False),
+              help='Write every overdue loan and its fee to this CSV file.')
+def late_fee_report_command(patron_id, csv_path):
+    """Price every overdue loan in one pass (the nightly late-fee run)."""
+    fees = database.get_overdue_fees(patron_id)
+    total = sum(fee['fee_amount'] for fee in fees)
+    due = sum(fee['amount_due'] for fee in fees)
+    click.echo(f"{len(fees)} overdue loans, ${total:.2f} in late fees, ${due:.2f} still due.")
+
+    if csv_path:
+        with open(csv_path, 'w', newline='', encoding='utf-8') as out:
+            writer = csv.DictWriter(out, fieldnames=['id', 'patron_id', 'book_id', 'title',
+                                                     'borrow_date', 'due_date',
+                                                     'days_overdue', 'fee_amount', 'paid_amount',
+                                                     'amount_due'])
+            writer.writeheader()
+            writer.writerows(fees)
+
+
+@click.command('reconcile-payments')
+@click.argument('transaction_ids', nargs=-1)
+@click.option('--file', 'ids_path', type=click.Path(exists=True, dir_okay=False),
+              help='Read transaction IDs from this file, one per line.')
+@click.option('--unreconciled', is_flag=True,
+              help='Every ledger payment with a transaction ID not yet reconciled with the gateway.')
+@click.option('--workers', default=DEFAULT_WORKERS, show_default=True,
+              help='Gateway lookups in flight at once.')
+@click.option('--rate-limit', type=float, help='Most gateway lookups per second.')
+@click.option('--batch-size', default=DEFAULT_BATCH_SIZE, show_default=True,
+              help='Ledger rows written per transaction.')
+def reconcile_payments_command(transaction_ids, ids_path, unreconciled, workers, rate_limit, batch_size):
+    """Verify payments with the gateway and record its status in the ledger."""
+    transaction_ids = list(transaction_ids)
+    if ids_path:
+        with open(ids_path, encoding='utf-8') as stream:
+            transaction_ids.extend(line.strip() for line in stream if line.strip())
+    if unreconciled:
+        transaction_ids.extend(database.get_unreconciled_transactions())
+    if not transaction_ids and not unreconciled:
+        raise click.UsageError('Pass transaction IDs, --file or --unreconciled.')
+
+    report = reconcile_payments(transaction_ids, workers=workers, rate_limit=rate_limit,
+                                batch_size=batch_size)
+
+    click.echo(f"{report['checked']} transactions checked in {report['seconds']:.1f}s: "
+               f"{report['matched']} match, {len(report['mismatched'])} mismatched, "
+               f"{len(report['errors'])} errors.")
+    for mismatch in report['mismatched'][:20]:
+        click.echo(f"  {mismatch['transaction_id']}: ledger {mismatch['ledger_status'] or 'missing'}, "
+                   f"gateway {mismatch['gateway_status']}", err=True)
+    if len(report['mismatched']) > 20:
+        click.echo(f"  ... {len(report['mismatched']) - 20} more mismatched", err=True)
+    for error in report['errors'][:5]:
+        click.echo(f"  {error['transaction_id']}: {error['error']}", err=True)
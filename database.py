@@ -3,119 +3,1175 @@ Database module for Library Management System
 Handles all database operations and connections
 """
 
+import base64
+import json
+import os
+import re
 import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Tuple
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from flask import g, has_app_context
 
 # Database configuration
 DATABASE = 'library.db'
+DEFAULT_POOL_SIZE = 5
+DEFAULT_POOL_TIMEOUT = 5.0
+DEFAULT_PROFILE = 'balanced'
+DEFAULT_BOOK_CACHE_SIZE = 1024    # books (by ID and by ISBN) kept in memory; 0 disables
+DEFAULT_BOOK_CACHE_TTL = 30.0     # seconds; bounds staleness from writes by other processes
+
+# Named storage profiles: PRAGMA name -> value, applied to every new connection.
+# WAL lets catalog readers run alongside a writer; the profiles differ in how
+# much durability they trade for write throughput.
+STORAGE_PROFILES = {
+    # fsync on every commit; survives power loss with no lost transactions
+    'durable': {
+        'journal_mode': 'WAL',
+        'synchronous': 'FULL',
+        'cache_size': -16000,       # ~16 MB page cache (negative = KiB)
+        'mmap_size': 0,
+        'temp_store': 'DEFAULT',
+        'busy_timeout': 5000,       # ms
+    },
+    # fsync only at WAL checkpoints; a crash can lose the last commits, never corrupts
+    'balanced': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'cache_size': -64000,
+        'mmap_size': 256 * 1024 * 1024,
+        'temp_store': 'MEMORY',
+        'busy_timeout': 5000,
+    },
+    # no fsync at all; only for imports that can be re-run from source
+    'bulk-load': {
+        'journal_mode': 'WAL',
+        'synchronous': 'OFF',
+        'cache_size': -256000,
+        'mmap_size': 1024 * 1024 * 1024,
+        'temp_store': 'MEMORY',
+        'busy_timeout': 30000,
+    },
+}
+
+
+def apply_storage_profile(conn: sqlite3.Connection, profile: str = DEFAULT_PROFILE) -> None:
+    """Apply the PRAGMAs of a named storage profile to a connection."""
+    if profile not in STORAGE_PROFILES:
+        raise ValueError(f"Unknown storage profile: {profile!r}. "
+                         f"Choose from {', '.join(STORAGE_PROFILES)}.")
+    for pragma, value in STORAGE_PROFILES[profile].items():
+        conn.execute(f'PRAGMA {pragma} = {value}')
+
+
+# Instrumentation hooks. Query listeners are called as
+# listener(conn, sql, parameters, seconds, caller) once per statement, when
+# its rows have all been fetched or its cursor is closed or dropped; seconds
+# covers executing it and fetching its rows (parameters is None for
+# executemany/executescript; caller is the name of the function that issued
+# it). Acquire listeners are called as listener(seconds, opened) after every
+# pool checkout. With no listeners nothing is timed.
+_query_listeners: List[Callable] = []
+_acquire_listeners: List[Callable] = []
+
+
+def add_query_listener(listener: Callable) -> None:
+    """Call listener(conn, sql, parameters, seconds, caller) once every statement is done."""
+    _query_listeners.append(listener)
+
+
+def add_acquire_listener(listener: Callable) -> None:
+    """Call listener(seconds, opened) after every pool checkout; opened means a new connection."""
+    _acquire_listeners.append(listener)
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """
+    Cursor that times a statement from execute() until its last row is fetched.
+
+    SQLite only runs a statement's first step in execute(); a full scan does
+    most of its work while the rows are fetched, so that time is added to the
+    statement's and it is reported to the query listeners once the rows run
+    out, or the cursor is closed, reused or garbage collected.
+    """
+
+    _statement = None       # [sql, parameters, seconds, caller] until reported
+
+    def _run(self, run, sql: str, parameters, caller: str):
+        self._report()
+        start = time.perf_counter()
+        try:
+            run()
+        except BaseException:
+            self._statement = [sql, parameters, time.perf_counter() - start, caller]
+            self._report()
+            raise
+        self._statement = [sql, parameters, time.perf_counter() - start, caller]
+        if self.description is None:    # no rows to fetch
+            self._report()
+        return self
+
+    def _report(self) -> None:
+        statement, self._statement = self._statement, None
+        if statement is not None and _query_listeners:
+            for listener in _query_listeners:
+                listener(self.connection, *statement)
+
+    def _add_time(self, start: float) -> None:
+        if self._statement is not None:
+            self._statement[2] += time.perf_counter() - start
+
+    def execute(self, sql, parameters=(), *, caller=None):
+        if not _query_listeners:
+            return super().execute(sql, parameters)
+        return self._run(lambda: super(InstrumentedCursor, self).execute(sql, parameters), sql, parameters,
+                         caller or sys._getframe(1).f_code.co_name)
+
+    def executemany(self, sql, seq_of_parameters, *, caller=None):
+        if not _query_listeners:
+            return super().executemany(sql, seq_of_parameters)
+        return self._run(lambda: super(InstrumentedCursor, self).executemany(sql, seq_of_parameters), sql,
+                         None, caller or sys._getframe(1).f_code.co_name)
+
+    def executescript(self, sql_script, *, caller=None):
+        if not _query_listeners:
+            return super().executescript(sql_script)
+        return self._run(lambda: super(InstrumentedCursor, self).executescript(sql_script), sql_script,
+                         None, caller or sys._getframe(1).f_code.co_name)
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = super().fetchone()
+        self._add_time(start)
+        if row is None:
+            self._report()
+        return row
+
+    def fetchmany(self, size=None):
+        size = self.arraysize if size is None else size
+        start = time.perf_counter()
+        rows = super().fetchmany(size)
+        self._add_time(start)
+        if len(rows) < size:
+            self._report()
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = super().fetchall()
+        self._add_time(start)
+        self._report()
+        return rows
+
+    def __next__(self):
+        start = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._add_time(start)
+            self._report()
+            raise
+        self._add_time(start)
+        return row
+
+    def close(self):
+        self._report()
+        super().close()
+
+    def __del__(self):
+        # a cursor dropped before its last row, e.g. after one fetchone()
+        self._report()
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """sqlite3 connection whose cursors report each statement's duration to the query listeners."""
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        if not _query_listeners:
+            return super().execute(sql, parameters)
+        return self.cursor().execute(sql, parameters, caller=sys._getframe(1).f_code.co_name)
+
+    def executemany(self, sql, seq_of_parameters):
+        if not _query_listeners:
+            return super().executemany(sql, seq_of_parameters)
+        return self.cursor().executemany(sql, seq_of_parameters, caller=sys._getframe(1).f_code.co_name)
+
+    def executescript(self, sql_script):
+        if not _query_listeners:
+            return super().executescript(sql_script)
+        return self.cursor().executescript(sql_script, caller=sys._getframe(1).f_code.co_name)
+
+
+def explain_query_plan(conn: sqlite3.Connection, sql: str, parameters=()) -> List[str]:
+    """
+    SQLite's query plan for a statement, one line per step.
+
+    Runs un-instrumented, so a query listener can call it. Returns an empty
+    list for statements that cannot be explained.
+    """
+    try:
+        rows = sqlite3.Connection.execute(conn, f'EXPLAIN QUERY PLAN {sql}', parameters or ()).fetchall()
+    except (sqlite3.Error, ValueError):
+        return []
+    return [row[-1] for row in rows]
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of SQLite connections for one database file.
+
+    Connections are opened lazily up to ``size`` and parked on an idle list
+    when released, so sqlite3.connect() is paid once per slot instead of once
+    per query. Callers that find the pool exhausted wait up to ``timeout``
+    seconds for a connection to come back.
+    """
+
+    def __init__(self, database: str, size: int = DEFAULT_POOL_SIZE,
+                 timeout: float = DEFAULT_POOL_TIMEOUT, profile: str = DEFAULT_PROFILE):
+        if size <= 0:
+            raise ValueError("Pool size must be a positive integer.")
+        if profile not in STORAGE_PROFILES:
+            raise ValueError(f"Unknown storage profile: {profile!r}.")
+        self.database = database
+        self.profile = profile
+        self.size = size
+        self.timeout = timeout
+        self._idle: List[sqlite3.Connection] = []
+        self._created = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._stats = {'hits': 0, 'misses': 0, 'waits': 0, 'timeouts': 0}
+
+    def _connect(self) -> sqlite3.Connection:
+        # Pooled connections move between threads, but only one thread
+        # ever holds a given connection at a time.
+        conn = sqlite3.connect(self.database, check_same_thread=False, factory=InstrumentedConnection)
+        conn.row_factory = sqlite3.Row  # This enables column access by name
+        # Unicode-aware lower() for searches SQLite's ASCII-only LIKE can't fold
+        conn.create_function('py_lower', 1, str.lower, deterministic=True)
+        apply_storage_profile(conn, self.profile)
+        return conn
+
+    def acquire(self) -> sqlite3.Connection:
+        """Borrow a connection, opening a new one if the pool has room."""
+        if not _acquire_listeners:
+            return self._acquire()[0]
+        start = time.perf_counter()
+        conn, opened = self._acquire()
+        seconds = time.perf_counter() - start
+        for listener in _acquire_listeners:
+            listener(seconds, opened)
+        return conn
+
+    def _acquire(self) -> Tuple[sqlite3.Connection, bool]:
+        deadline = None
+        with self._cond:
+            while True:
+                if self._idle:
+                    self._stats['hits'] += 1
+                    return self._idle.pop(), False
+                if self._created < self.size:
+                    self._created += 1
+                    self._stats['misses'] += 1
+                    break
+                if deadline is None:
+                    self._stats['waits'] += 1
+                    deadline = time.monotonic() + self.timeout
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats['timeouts'] += 1
+                    raise TimeoutError(
+                        f"No database connection available after {self.timeout}s "
+                        f"(pool size {self.size})."
+                    )
+                self._cond.wait(remaining)
+
+        try:
+            return self._connect(), True
+        except Exception:
+            with self._cond:
+                self._created -= 1
+                self._cond.notify()
+            raise
+
+    def release(self, conn: sqlite3.Connection) -> None:
+        """Return a connection to the pool, discarding any open transaction."""
+        if conn.in_transaction:
+            conn.rollback()
+        with self._cond:
+            if self._closed:
+                self._created -= 1
+                conn.close()
+            else:
+                self._idle.append(conn)
+            self._cond.notify()
+
+    def close(self) -> None:
+        """Close idle connections; connections still in use close on release."""
+        with self._cond:
+            self._closed = True
+            for conn in self._idle:
+                conn.close()
+            self._created -= len(self._idle)
+            self._idle.clear()
+            self._cond.notify_all()
+
+    def stats(self) -> Dict:
+        """Snapshot of pool usage counters."""
+        with self._cond:
+            return dict(self._stats, size=self.size, profile=self.profile, open=self._created,
+                        idle=len(self._idle), in_use=self._created - len(self._idle))
+
+
+_pool: Optional[ConnectionPool] = None
+_pool_lock = threading.Lock()
+_pool_settings = {'size': DEFAULT_POOL_SIZE, 'timeout': DEFAULT_POOL_TIMEOUT,
+                  'profile': DEFAULT_PROFILE}
+
+
+def configure_pool(size: Optional[int] = None, timeout: Optional[float] = None,
+                   profile: Optional[str] = None) -> None:
+    """Set pool size/timeout/storage profile; the pool is rebuilt on next use."""
+    if profile is not None and profile not in STORAGE_PROFILES:
+        raise ValueError(f"Unknown storage profile: {profile!r}.")
+    if size is not None:
+        _pool_settings['size'] = size
+    if timeout is not None:
+        _pool_settings['timeout'] = timeout
+    if profile is not None:
+        _pool_settings['profile'] = profile
+    close_pool()
+
+
+def get_pool() -> ConnectionPool:
+    """Get the pool for the current DATABASE, creating it on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool.database != DATABASE:
+            if _pool is not None:
+                _pool.close()
+            _pool = ConnectionPool(DATABASE, **_pool_settings)
+        return _pool
+
+
+def close_pool() -> None:
+    """Close the current pool (if any)."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+
+
+def get_pool_stats() -> Dict:
+    """Get hit/miss/wait counters for the current pool."""
+    return get_pool().stats()
+
+
+class BookCache:
+    """
+    Thread-safe LRU cache with a TTL for get_book_by_id() / get_book_by_isbn().
+
+    Entries are keyed by (database, 'id' | 'isbn', value) and include misses
+    (None), so a duplicate-ISBN check for a new book is cached too. Writers
+    call invalidate() after committing. Every invalidation bumps a generation
+    counter and a lookup only stores its result if no invalidation happened
+    while it was querying, so a read racing a write can't cache the old row.
+    """
+
+    def __init__(self, size: int = DEFAULT_BOOK_CACHE_SIZE, ttl: float = DEFAULT_BOOK_CACHE_TTL):
+        self.size = size
+        self.ttl = ttl
+        self._entries: OrderedDict = OrderedDict()
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'expired': 0, 'evictions': 0, 'invalidations': 0}
+
+    def get(self, key: tuple) -> Tuple[bool, Optional[Dict], int]:
+        """
+        Returns:
+            tuple: (found, copy of the cached book or None, generation to pass to put())
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires, book = entry
+                if expires > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self._stats['hits'] += 1
+                    return True, dict(book) if book else None, self._generation
+                del self._entries[key]
+                self._stats['expired'] += 1
+            self._stats['misses'] += 1
+            return False, None, self._generation
+
+    def put(self, key: tuple, book: Optional[Dict], generation: int) -> None:
+        with self._lock:
+            if self.size <= 0 or generation != self._generation:
+                return
+            self._entries[key] = (time.monotonic() + self.ttl, dict(book) if book else None)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    def invalidate(self, book_ids: Tuple = (), isbns: Tuple = ()) -> None:
+        """Drop cached books by ID and/or ISBN (including a book's other key)."""
+        with self._lock:
+            self._generation += 1
+            self._stats['invalidations'] += 1
+            doomed = {('id', book_id) for book_id in book_ids} | {('isbn', isbn) for isbn in isbns}
+            for key, (_, book) in list(self._entries.items()):
+                if key[1:] in doomed or (book and (('id', book['id']) in doomed
+                                                   or ('isbn', book['isbn']) in doomed)):
+                    del self._entries[key]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def stats(self) -> Dict:
+        """Snapshot of hit/miss counters."""
+        with self._lock:
+            lookups = self._stats['hits'] + self._stats['misses']
+            return dict(self._stats, size=self.size, ttl=self.ttl, entries=len(self._entries),
+                        hit_rate=round(self._stats['hits'] / lookups, 4) if lookups else 0.0)
+
+
+_book_cache = BookCache()
+
+
+def configure_book_cache(size: Optional[int] = None, ttl: Optional[float] = None) -> None:
+    """Resize the book cache / change its TTL; it starts empty."""
+    global _book_cache
+    _book_cache = BookCache(_book_cache.size if size is None else size,
+                            _book_cache.ttl if ttl is None else ttl)
+
+
+def get_book_cache_stats() -> Dict:
+    """Get hit/miss counters for the book lookup cache."""
+    return _book_cache.stats()
+
+
+# Catalog version: the last catalog_changes row this process has applied to
+# its caches, so anything derived from the catalog (HTTP validators,
+# rendered pages) can tell it is still current without querying. Writers
+# append to catalog_changes in their own transaction and sync_catalog()
+# applies changes from every process, so all processes share one version.
+CATALOG_CHANGES_KEPT = 10000    # change log rows kept; a process further behind resyncs fully
+_MAX_SYNC_CHANGES = 1000        # more pending changes than this drop every cached book
+_catalog = {'database': None, 'version': 0, 'modified': time.time()}
+_catalog_lock = threading.RLock()
+_catalog_listeners: List[Callable] = []
+
+
+def add_catalog_listener(listener: Callable) -> None:
+    """
+    Call listener(book_ids, added) after every committed write to books.
+    book_ids is None when any book may have changed; added holds the
+    (title, id) keys of new books, which can shift catalog pages.
+    """
+    _catalog_listeners.append(listener)
+
+
+def _books_changed(book_ids: Optional[Tuple] = None, isbns: Tuple = (), added: Tuple = ()) -> None:
+    """
+    Apply committed writes to books to this process: drop the cached books
+    and tell the listeners. book_ids None means any book may have changed.
+    """
+    if book_ids is None:
+        _book_cache.clear()
+    else:
+        _book_cache.invalidate(book_ids, isbns)
+    for listener in _catalog_listeners:
+        listener(book_ids, added)
+
+
+def _log_books_changed(conn, books: Optional[List[Tuple[int, Optional[str], Optional[str]]]] = None) -> None:
+    """
+    Append a write to books to catalog_changes, inside the writer's transaction.
+
+    Args:
+        books: (book_id, isbn, title) per changed book; isbn is needed for a
+            new ISBN and title marks a new book. None means any book may
+            have changed.
+    """
+    now = time.time()
+    rows = [(None, None, None, now)] if books is None else \
+        [(book_id, isbn, title, now) for book_id, isbn, title in books]
+    for row in rows:
+        version = conn.execute('''
+            INSERT INTO catalog_changes (book_id, isbn, title, changed_at) VALUES (?, ?, ?, ?)
+        ''', row).lastrowid
+        if version % 1000 == 0:
+            conn.execute('DELETE FROM catalog_changes WHERE version <= ?',
+                         (version - CATALOG_CHANGES_KEPT,))
+
+
+def sync_catalog(conn: Optional[sqlite3.Connection] = None) -> Tuple[int, float]:
+    """
+    Apply writes to books committed since the last sync, by this or any
+    other process, to the in-process caches.
+
+    A single cheap query when nothing changed. Runs after every local write
+    (on the writer's connection) and at the start of a request once the
+    database files have changed.
+
+    Returns:
+        tuple: (version, epoch seconds of the last write to books)
+    """
+    if conn is None:
+        with db_connection() as conn:
+            return sync_catalog(conn)
+    # callers take a connection before the lock: waiting for one while
+    # holding the lock could deadlock against threads that hold a connection
+    with _catalog_lock:
+        latest = conn.execute('SELECT MAX(version) FROM catalog_changes').fetchone()[0] or 0
+        if _catalog['database'] == DATABASE and latest == _catalog['version']:
+            return _catalog['version'], _catalog['modified']
+        changes = conn.execute('''
+            SELECT version, book_id, isbn, title, changed_at FROM catalog_changes
+            WHERE version > ? AND version <= ? ORDER BY version LIMIT ?
+        ''', (_catalog['version'], latest, _MAX_SYNC_CHANGES + 1)).fetchall()
+
+        # a first sync, a recreated database, a gap left by pruning or too
+        # many changes to apply one by one: drop everything instead
+        if (_catalog['database'] != DATABASE or latest < _catalog['version'] or not changes
+                or len(changes) > _MAX_SYNC_CHANGES or changes[0]['version'] != _catalog['version'] + 1
+                or any(change['book_id'] is None for change in changes)):
+            _books_changed()
+        else:
+            _books_changed(tuple({change['book_id'] for change in changes}),
+                           tuple({change['isbn'] for change in changes if change['isbn']}),
+                           added=tuple((change['title'], change['book_id'])
+                                       for change in changes if change['title'] is not None))
+        _catalog['database'] = DATABASE
+        _catalog['version'] = latest
+        complete = changes and len(changes) <= _MAX_SYNC_CHANGES
+        _catalog['modified'] = changes[-1]['changed_at'] if complete else time.time()
+        return _catalog['version'], _catalog['modified']
+
+
+def get_catalog_version() -> Tuple[int, float]:
+    """
+    The catalog version as of the last sync_catalog().
+
+    Returns:
+        tuple: (version, epoch seconds of the last write to books)
+    """
+    with _catalog_lock:
+        return _catalog['version'], _catalog['modified']
+
 
 def get_db_connection():
-    """Get a database connection."""
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row  # This enables column access by name
-    return conn
+    """
+    Get a database connection.
+
+    Inside a Flask app context the connection is opened lazily, bound to the
+    context and shared by every helper until teardown. Outside a context one
+    is borrowed from the pool. Either way, hand it back with
+    release_db_connection().
+    """
+    if has_app_context():
+        conn = g.get('_db_conn')
+        if conn is None:
+            pool = get_pool()
+            conn = pool.acquire()
+            g._db_conn = conn
+            g._db_pool = pool
+        return conn
+    return get_pool().acquire()
+
+
+def release_db_connection(conn) -> None:
+    """Release a connection from get_db_connection()."""
+    if has_app_context() and g.get('_db_conn') is conn:
+        # Kept for the rest of the request; close_request_connection() returns it.
+        if conn.in_transaction:
+            conn.rollback()
+        return
+    get_pool().release(conn)
+
+
+@contextmanager
+def db_connection():
+    """Context manager that yields a connection and releases it afterwards."""
+    if has_app_context():
+        conn = get_db_connection()
+        try:
+            yield conn
+        finally:
+            release_db_connection(conn)
+        return
+
+    pool = get_pool()
+    conn = pool.acquire()
+    try:
+        yield conn
+    finally:
+        pool.release(conn)
+
+
+def close_request_connection(exc=None) -> None:
+    """Teardown hook: return the request's connection to its pool."""
+    conn = g.pop('_db_conn', None)
+    pool = g.pop('_db_pool', None)
+    if conn is not None and pool is not None:
+        pool.release(conn)
+
+
+def init_app(app) -> None:
+    """Configure the pool from app config and register the teardown hook."""
+    app.config.setdefault('DATABASE_POOL_SIZE', DEFAULT_POOL_SIZE)
+    app.config.setdefault('DATABASE_POOL_TIMEOUT', DEFAULT_POOL_TIMEOUT)
+    app.config.setdefault('DATABASE_PROFILE', DEFAULT_PROFILE)
+    app.config.setdefault('BOOK_CACHE_SIZE', DEFAULT_BOOK_CACHE_SIZE)
+    app.config.setdefault('BOOK_CACHE_TTL', DEFAULT_BOOK_CACHE_TTL)
+    configure_pool(size=app.config['DATABASE_POOL_SIZE'],
+                   timeout=app.config['DATABASE_POOL_TIMEOUT'],
+                   profile=app.config['DATABASE_PROFILE'])
+    configure_book_cache(size=app.config['BOOK_CACHE_SIZE'], ttl=app.config['BOOK_CACHE_TTL'])
+    app.before_request(_sync_catalog_for_request)
+    app.teardown_appcontext(close_request_connection)
+
+
+# File timestamps tick coarsely (a few ms on Linux): a stamp read this long
+# after the files last changed will differ once anything is committed
+_STAMP_SLACK = 0.05
+_last_request_sync = {'last': (None, 0.0)}      # (database stamp, time.time() it was read)
+
+
+def _database_stamp() -> Optional[Tuple]:
+    """Modification time and size of the database file and its WAL; None if unreadable."""
+    stamp = [DATABASE]
+    for path in (DATABASE, DATABASE + '-wal'):
+        try:
+            info = os.stat(path)
+        except OSError:
+            if path == DATABASE:
+                return None
+            info = None
+        stamp += [info.st_mtime, info.st_size] if info else [None, None]
+    return tuple(stamp)
+
+
+def _sync_catalog_for_request() -> None:
+    """
+    Before-request hook: see writes other processes made since the last request.
+
+    Every commit, by any process, touches the database file or its WAL, so
+    while neither has changed since the last check (a stat() of each) the
+    request skips the catalog_changes query and never takes a connection.
+    """
+    checked = time.time()
+    stamp = _database_stamp()
+    last, last_checked = _last_request_sync['last']
+    if stamp is not None and stamp == last and last_checked - max(filter(None, stamp[1::2])) > _STAMP_SLACK:
+        return
+    sync_catalog()
+    _last_request_sync['last'] = (stamp, checked)
+
+
+# Stored in PRAGMA user_version once init_database() has brought a database
+# up to date. Bump it with any change to the tables, indexes or FTS schema,
+# or existing databases will skip the migration.
+SCHEMA_VERSION = 3
+
+# Secondary indexes, created (idempotently) by init_database().
+SCHEMA_INDEXES = [
+    # Loans by patron, open ones (return_date IS NULL) first in borrow order:
+    # covers the borrow limit count, the return lookup, current loans and history
+    '''CREATE INDEX IF NOT EXISTS idx_borrow_patron
+       ON borrow_records (patron_id, return_date, borrow_date, book_id)''',
+    # A patron's loans newest first: the status page history
+    '''CREATE INDEX IF NOT EXISTS idx_borrow_patron_history
+       ON borrow_records (patron_id, borrow_date)''',
+    # Loans for one (patron, book) pair: per-loan and batched late-fee lookups
+    '''CREATE INDEX IF NOT EXISTS idx_borrow_patron_book
+       ON borrow_records (patron_id, book_id, return_date, borrow_date)''',
+    # Active loans by book
+    '''CREATE INDEX IF NOT EXISTS idx_borrow_active_book
+       ON borrow_records (book_id) WHERE return_date IS NULL''',
+    # Active loans by due date: the nightly overdue sweep
+    '''CREATE INDEX IF NOT EXISTS idx_borrow_active_due
+       ON borrow_records (due_date) WHERE return_date IS NULL''',
+    # Payments settling a loan's fee, and the ledger by status
+    '''CREATE INDEX IF NOT EXISTS idx_allocations_borrow
+       ON payment_allocations (borrow_id, payment_id)''',
+    '''CREATE INDEX IF NOT EXISTS idx_allocations_payment
+       ON payment_allocations (payment_id)''',
+    '''CREATE INDEX IF NOT EXISTS idx_payments_status
+       ON payments (status, created_at)''',
+    '''CREATE INDEX IF NOT EXISTS idx_refunds_payment
+       ON refunds (payment_id)''',
+    # Charges not yet checked against the gateway
+    '''CREATE INDEX IF NOT EXISTS idx_payments_unreconciled
+       ON payments (id) WHERE reconciled_at IS NULL AND transaction_id IS NOT NULL''',
+    # Next runnable job
+    '''CREATE INDEX IF NOT EXISTS idx_payment_jobs_queue
+       ON payment_jobs (status, run_after)''',
+    # Catalog listing order and keyset pagination cursor (title, id)
+    '''CREATE INDEX IF NOT EXISTS idx_books_title
+       ON books (title, id)''',
+    # Case-insensitive title/author lookups
+    '''CREATE INDEX IF NOT EXISTS idx_books_title_nocase
+       ON books (title COLLATE NOCASE, id)''',
+    '''CREATE INDEX IF NOT EXISTS idx_books_author_nocase
+       ON books (author COLLATE NOCASE, id)''',
+]
+
+# Full-text index over title/author, kept in sync with books by triggers.
+# External content: the FTS table stores only the index, rows live in books.
+# prefix='2 3' keeps extra indexes for 2/3-character prefixes, which otherwise
+# expand to thousands of terms while the user is still typing.
+FTS_SCHEMA = [
+    '''CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5(
+           title, author, content='books', content_rowid='id',
+           tokenize='unicode61 remove_diacritics 2', prefix='2 3')''',
+    # one-row switch that lets insert_books_bulk() index a whole chunk with a
+    # single INSERT ... SELECT instead of one trigger call per row
+    '''CREATE TABLE IF NOT EXISTS fts_sync (
+           id INTEGER PRIMARY KEY CHECK (id = 1),
+           suspended INTEGER NOT NULL DEFAULT 0)''',
+    '''INSERT OR IGNORE INTO fts_sync (id, suspended) VALUES (1, 0)''',
+    '''CREATE TRIGGER IF NOT EXISTS books_fts_insert AFTER INSERT ON books
+       WHEN NOT EXISTS (SELECT 1 FROM fts_sync WHERE suspended) BEGIN
+           INSERT INTO books_fts (rowid, title, author) VALUES (new.id, new.title, new.author);
+       END''',
+    '''CREATE TRIGGER IF NOT EXISTS books_fts_delete AFTER DELETE ON books BEGIN
+           INSERT INTO books_fts (books_fts, rowid, title, author)
+           VALUES ('delete', old.id, old.title, old.author);
+       END''',
+    # availability updates don't touch title/author, so they skip the index
+    '''CREATE TRIGGER IF NOT EXISTS books_fts_update AFTER UPDATE OF title, author ON books BEGIN
+           INSERT INTO books_fts (books_fts, rowid, title, author)
+           VALUES ('delete', old.id, old.title, old.author);
+           INSERT INTO books_fts (rowid, title, author) VALUES (new.id, new.title, new.author);
+       END''',
+]
+
+def migrate_schema(conn) -> None:
+    """Bring an existing database up to date with the current columns and indexes."""
+    payment_columns = {row[1] for row in conn.execute('PRAGMA table_info(payments)')}
+    if 'description' not in payment_columns:
+        # ledgers from before payments could be re-sent
+        conn.execute('ALTER TABLE payments ADD COLUMN description TEXT')
+    if 'reconciled_at' not in payment_columns:
+        # ledgers from before gateway reconciliation
+        conn.execute('ALTER TABLE payments ADD COLUMN gateway_status TEXT')
+        conn.execute('ALTER TABLE payments ADD COLUMN reconciled_at TEXT')
+    job_columns = {row[1] for row in conn.execute('PRAGMA table_info(payment_jobs)')}
+    if 'lease_expires' not in job_columns:
+        # job queues from before leases: a running job is owned by whoever claimed it
+        conn.execute('ALTER TABLE payment_jobs ADD COLUMN owner TEXT')
+        conn.execute('ALTER TABLE payment_jobs ADD COLUMN lease_expires REAL')
+
+    for statement in SCHEMA_INDEXES:
+        conn.execute(statement)
+
+    has_fts = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = 'books_fts'").fetchone()
+    insert_trigger = conn.execute(
+        "SELECT sql FROM sqlite_master WHERE name = 'books_fts_insert'").fetchone()
+    if insert_trigger and 'fts_sync' not in insert_trigger[0]:
+        # trigger from before bulk-import support; recreate it below
+        conn.execute('DROP TRIGGER books_fts_insert')
+    try:
+        for statement in FTS_SCHEMA:
+            conn.execute(statement)
+    except sqlite3.OperationalError:
+        # SQLite built without FTS5: fulltext search is simply unavailable
+        return
+    if not has_fts:
+        # index books that existed before the FTS table
+        conn.execute("INSERT INTO books_fts (books_fts) VALUES ('rebuild')")
 
 def init_database():
-    """Initialize the database with required tables."""
-    conn = get_db_connection()
-    
-    # Create books table
-    conn.execute('''
-        CREATE TABLE IF NOT EXISTS books (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            title TEXT NOT NULL,
-            author TEXT NOT NULL,
-            isbn TEXT UNIQUE NOT NULL,
-            total_copies INTEGER NOT NULL,
-            available_copies INTEGER NOT NULL
-        )
-    ''')
-    
-    # Create borrow_records table
-    conn.execute('''
-        CREATE TABLE IF NOT EXISTS borrow_records (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            patron_id TEXT NOT NULL,
-            book_id INTEGER NOT NULL,
-            borrow_date TEXT NOT NULL,
-            due_date TEXT NOT NULL,
-            return_date TEXT,
-            FOREIGN KEY (book_id) REFERENCES books (id)
-        )
-    ''')
-    
-    conn.commit()
-    conn.close()
+    """
+    Initialize the database with required tables.
 
-def add_sample_data():
-    """Add sample data to the database if it's empty."""
-    conn = get_db_connection()
-    book_count = conn.execute('SELECT COUNT(*) as count FROM books').fetchone()['count']
-    
-    if book_count == 0:
-        # Add sample books
-        sample_books = [
-            ('The Great Gatsby', 'F. Scott Fitzgerald', '9780743273565', 3),
-            ('To Kill a Mockingbird', 'Harper Lee', '9780061120084', 2),
-            ('1984', 'George Orwell', '9780451524935', 1)
-        ]
-        
-        for title, author, isbn, copies in sample_books:
-            conn.execute('''
-                INSERT INTO books (title, author, isbn, total_copies, available_copies)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (title, author, isbn, copies, copies))
-        
-        # Make 1984 unavailable by adding a borrow record
+    The schema version is kept in PRAGMA user_version, so an up-to-date
+    database costs a single header read and takes no write lock.
+    """
+    with db_connection() as conn:
+        if conn.execute('PRAGMA user_version').fetchone()[0] == SCHEMA_VERSION:
+            return
+        # one write transaction: processes starting together (e.g. server
+        # workers) take turns instead of racing the migrations
+        conn.execute('BEGIN IMMEDIATE')
+        if conn.execute('PRAGMA user_version').fetchone()[0] == SCHEMA_VERSION:
+            conn.rollback()     # another process got there first
+            return
+
+        # Create books table
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS books (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                title TEXT NOT NULL,
+                author TEXT NOT NULL,
+                isbn TEXT UNIQUE NOT NULL,
+                total_copies INTEGER NOT NULL,
+                available_copies INTEGER NOT NULL
+            )
+        ''')
+
+        # Create borrow_records table
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS borrow_records (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                patron_id TEXT NOT NULL,
+                book_id INTEGER NOT NULL,
+                borrow_date TEXT NOT NULL,
+                due_date TEXT NOT NULL,
+                return_date TEXT,
+                FOREIGN KEY (book_id) REFERENCES books (id)
+            )
+        ''')
+
+        # Payment ledger: one row per charge attempt, keyed by idempotency key
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS payments (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                idempotency_key TEXT UNIQUE NOT NULL,
+                patron_id TEXT NOT NULL,
+                amount REAL NOT NULL,
+                description TEXT,
+                status TEXT NOT NULL,
+                transaction_id TEXT UNIQUE,
+                message TEXT,
+                refunded_amount REAL NOT NULL DEFAULT 0,
+                created_at TEXT NOT NULL,
+                updated_at TEXT NOT NULL,
+                gateway_status TEXT,
+                reconciled_at TEXT
+            )
+        ''')
+
+        # Which loans' fees each payment settles
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS payment_allocations (
+                payment_id INTEGER NOT NULL,
+                borrow_id INTEGER,
+                book_id INTEGER NOT NULL,
+                amount REAL NOT NULL,
+                FOREIGN KEY (payment_id) REFERENCES payments (id),
+                FOREIGN KEY (borrow_id) REFERENCES borrow_records (id)
+            )
+        ''')
+
+        # Refunds against ledger payments, keyed by idempotency key like the
+        # payments; a pending refund already counts against its payment
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS refunds (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                idempotency_key TEXT UNIQUE NOT NULL,
+                payment_id INTEGER NOT NULL,
+                amount REAL NOT NULL,
+                status TEXT NOT NULL,
+                message TEXT,
+                created_at TEXT NOT NULL,
+                updated_at TEXT NOT NULL,
+                FOREIGN KEY (payment_id) REFERENCES payments (id)
+            )
+        ''')
+
+        # Background payment/refund jobs, so queued work survives a restart.
+        # Times are epoch seconds: the queue orders and measures by them.
         conn.execute('''
-            INSERT INTO borrow_records (patron_id, book_id, borrow_date, due_date)
-            VALUES (?, ?, ?, ?)
-        ''', ('123456', 3, 
-              (datetime.now() - timedelta(days=5)).isoformat(),
-              (datetime.now() + timedelta(days=9)).isoformat()))
-        
-        # Update available copies for 1984
-        conn.execute('UPDATE books SET available_copies = 0 WHERE id = 3')
-        
+            CREATE TABLE IF NOT EXISTS payment_jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                idempotency_key TEXT UNIQUE,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                max_attempts INTEGER NOT NULL,
+                run_after REAL NOT NULL,
+                result TEXT,
+                error TEXT,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL,
+                owner TEXT,
+                lease_expires REAL
+            )
+        ''')
+
+        # Committed writes to books, in order: how each process's caches and
+        # the catalog version learn about writes made by other processes
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS catalog_changes (
+                version INTEGER PRIMARY KEY AUTOINCREMENT,
+                book_id INTEGER,
+                isbn TEXT,
+                title TEXT,
+                changed_at REAL NOT NULL
+            )
+        ''')
+
+        migrate_schema(conn)
+
+        conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
         conn.commit()
-    
-    conn.close()
+
+def add_sample_data() -> bool:
+    """
+    Add sample data to the database if it's empty.
+
+    Returns:
+        bool: True if the sample books were added
+    """
+    with db_connection() as conn:
+        # the emptiness check and the inserts are one write transaction
+        conn.execute('BEGIN IMMEDIATE')
+        book_count = conn.execute('SELECT COUNT(*) as count FROM books').fetchone()['count']
+
+        if book_count == 0:
+            # Add sample books
+            sample_books = [
+                ('The Great Gatsby', 'F. Scott Fitzgerald', '9780743273565', 3),
+                ('To Kill a Mockingbird', 'Harper Lee', '9780061120084', 2),
+                ('1984', 'George Orwell', '9780451524935', 1)
+            ]
+
+            for title, author, isbn, copies in sample_books:
+                conn.execute('''
+                    INSERT INTO books (title, author, isbn, total_copies, available_copies)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', (title, author, isbn, copies, copies))
+
+            # Make 1984 unavailable by adding a borrow record
+            conn.execute('''
+                INSERT INTO borrow_records (patron_id, book_id, borrow_date, due_date)
+                VALUES (?, ?, ?, ?)
+            ''', ('123456', 3,
+                  (datetime.now() - timedelta(days=5)).isoformat(),
+                  (datetime.now() + timedelta(days=9)).isoformat()))
+
+            # Update available copies for 1984
+            conn.execute('UPDATE books SET available_copies = 0 WHERE id = 3')
+
+            _log_books_changed(conn)
+            conn.commit()
+            sync_catalog(conn)
+            return True
+        conn.rollback()
+        return False
 
 # Helper Functions for Database Operations
 
 def get_all_books() -> List[Dict]:
     """Get all books from the database."""
-    conn = get_db_connection()
-    books = conn.execute('SELECT * FROM books ORDER BY title').fetchall()
-    conn.close()
+    with db_connection() as conn:
+        books = conn.execute('SELECT * FROM books ORDER BY title').fetchall()
     return [dict(book) for book in books]
 
+def encode_cursor(key: Tuple[str, int]) -> str:
+    """Encode a (title, id) keyset position as an opaque URL-safe token."""
+    return base64.urlsafe_b64encode(json.dumps(list(key)).encode()).decode().rstrip('=')
+
+def decode_cursor(token: str) -> Optional[Tuple[str, int]]:
+    """Decode a token from encode_cursor(); None if it is malformed."""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        title, book_id = json.loads(base64.urlsafe_b64decode(padded))
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(title, str) or not isinstance(book_id, int):
+        return None
+    return title, book_id
+
+def get_books_page(after: Optional[Tuple[str, int]] = None,
+                   before: Optional[Tuple[str, int]] = None,
+                   limit: int = 50) -> Tuple[List[Dict], Dict]:
+    """
+    Get one page of the catalog in get_all_books() order using keyset paging.
+
+    Pass the (title, id) of the last row seen as ``after`` for the next page,
+    or of the first row seen as ``before`` for the previous one. Each page is
+    an index range scan of ``limit`` rows, however deep into the catalog.
+
+    Returns:
+        tuple: (books, page) where page holds 'next' and 'prev' keys (or None)
+    """
+    if before is not None:
+        sql = '''
+            SELECT * FROM books WHERE (title, id) < (?, ?)
+            ORDER BY title DESC, id DESC LIMIT ?
+        '''
+        params = (before[0], before[1], limit + 1)
+    elif after is not None:
+        sql = '''
+            SELECT * FROM books WHERE (title, id) > (?, ?)
+            ORDER BY title, id LIMIT ?
+        '''
+        params = (after[0], after[1], limit + 1)
+    else:
+        sql = 'SELECT * FROM books ORDER BY title, id LIMIT ?'
+        params = (limit + 1,)
+
+    with db_connection() as conn:
+        rows = conn.execute(sql, params).fetchall()
+
+    has_more = len(rows) > limit
+    books = [dict(row) for row in rows[:limit]]
+    if before is not None:
+        books.reverse()
+        has_prev, has_next = has_more, True
+    else:
+        has_prev, has_next = after is not None, has_more
+
+    page = {'next': None, 'prev': None}
+    if books and has_next:
+        page['next'] = (books[-1]['title'], books[-1]['id'])
+    if books and has_prev:
+        page['prev'] = (books[0]['title'], books[0]['id'])
+    return books, page
+
+# Tables that may be streamed out by iter_table_rows(), in primary key order
+EXPORT_TABLES = ('books', 'borrow_records')
+
+def iter_table_rows(table: str, batch_size: int = 1000) -> Iterator[tuple]:
+    """
+    Stream a whole table without loading it into memory.
+
+    Yields the column names first, then one tuple per row. Rows are pulled
+    from the cursor ``batch_size`` at a time, and the pooled connection is
+    held only until the generator is exhausted or closed.
+    """
+    if table not in EXPORT_TABLES:
+        raise ValueError(f"Unknown export table: {table!r}")
+
+    with db_connection() as conn:
+        cursor = conn.execute(f'SELECT * FROM {table} ORDER BY id')
+        yield tuple(column[0] for column in cursor.description)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            for row in rows:
+                yield tuple(row)
+
+def _cached_book(column: str, value) -> Optional[Dict]:
+    cache, key = _book_cache, (DATABASE, column, value)
+    found, book, generation = cache.get(key)
+    if found:
+        return book
+    with db_connection() as conn:
+        row = conn.execute(f'SELECT * FROM books WHERE {column} = ?', (value,)).fetchone()
+    book = dict(row) if row else None
+    cache.put(key, book, generation)
+    return book
+
 def get_book_by_id(book_id: int) -> Optional[Dict]:
-    """Get a specific book by ID."""
-    conn = get_db_connection()
-    book = conn.execute('SELECT * FROM books WHERE id = ?', (book_id,)).fetchone()
-    conn.close()
-    return dict(book) if book else None
+    """Get a specific book by ID (through the book cache)."""
+    return _cached_book('id', book_id)
 
 def get_book_by_isbn(isbn: str) -> Optional[Dict]:
-    """Get a specific book by ISBN."""
-    conn = get_db_connection()
-    book = conn.execute('SELECT * FROM books WHERE isbn = ?', (isbn,)).fetchone()
-    conn.close()
-    return dict(book) if book else None
+    """Get a specific book by ISBN (through the book cache)."""
+    return _cached_book('isbn', isbn)
+
+def _like_escape(term: str) -> str:
+    """Escape LIKE wildcards so the term matches literally."""
+    return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+def search_books(search_term: str, search_type: str, limit: Optional[int] = None,
+                 offset: int = 0, match: str = 'substring') -> List[Dict]:
+    """
+    Search books by title, author or ISBN in SQL, ordered like get_all_books().
+
+    Title/author matching is case-insensitive; ``match`` is 'substring'
+    (anywhere in the field) or 'prefix' (can use the NOCASE indexes). ISBN is
+    an exact lookup on the unique index. Search type 'fulltext' is delegated
+    to fulltext_search_books(). Unknown search types match nothing.
+    """
+    if search_type == 'fulltext':
+        return fulltext_search_books(search_term, limit=limit, offset=offset)
+
+    term = search_term.strip().lower()
+    if search_type == 'isbn':
+        # ISBNs are digits plus an optional X check digit, so both cases cover
+        # the case-insensitive comparison while still using the unique index
+        where, params = 'isbn IN (?, ?)', [term, term.upper()]
+    elif search_type in ('title', 'author'):
+        pattern = _like_escape(term) + '%'
+        if match != 'prefix':
+            pattern = '%' + pattern
+        if term.isascii():
+            where = f"{search_type} LIKE ? ESCAPE '\\'"
+        else:
+            # LIKE only folds ASCII; fall back to Python's lower() for the rest
+            where = f"py_lower({search_type}) LIKE ? ESCAPE '\\'"
+        params = [pattern]
+    else:
+        return []
+
+    sql = f'SELECT * FROM books WHERE {where} ORDER BY title'
+    if limit is not None:
+        sql += ' LIMIT ? OFFSET ?'
+        params += [limit, offset]
+
+    with db_connection() as conn:
+        books = conn.execute(sql, params).fetchall()
+    return [dict(book) for book in books]
+
+def _fts_query(search_term: str) -> str:
+    """Turn free text into an FTS5 query: every word, as a prefix, must match."""
+    words = re.findall(r'\w+', search_term.lower())
+    return ' '.join(f'"{word}"*' for word in words)
+
+def fulltext_search_books(search_term: str, limit: Optional[int] = None,
+                          offset: int = 0) -> List[Dict]:
+    """
+    Ranked full-text search over title and author.
+
+    Each word of the query is a prefix match and all words must appear
+    (in either field). Results are ordered by BM25 with title hits weighted
+    above author hits.
+    """
+    query = _fts_query(search_term)
+    if not query:
+        return []
+
+    sql = '''
+        SELECT b.* FROM books_fts
+        JOIN books b ON b.id = books_fts.rowid
+        WHERE books_fts MATCH ?
+        ORDER BY bm25(books_fts, 2.0, 1.0), b.title
+    '''
+    params = [query]
+    if limit is not None:
+        sql += ' LIMIT ? OFFSET ?'
+        params += [limit, offset]
+
+    with db_connection() as conn:
+        try:
+            books = conn.execute(sql, params).fetchall()
+        except sqlite3.OperationalError:
+            # no FTS5 support in this SQLite build
+            return []
+    return [dict(book) for book in books]
 
 def get_patron_borrowed_books(patron_id: str) -> List[Dict]:
     """Get currently borrowed books for a patron."""
-    conn = get_db_connection()
-    records = conn.execute('''
-        SELECT br.*, b.title, b.author 
-        FROM borrow_records br 
-        JOIN books b ON br.book_id = b.id 
-        WHERE br.patron_id = ? AND br.return_date IS NULL
-        ORDER BY br.borrow_date
-    ''', (patron_id,)).fetchall()
-    conn.close()
+    with db_connection() as conn:
+        records = conn.execute('''
+            SELECT br.book_id, br.borrow_date, br.due_date, b.title, b.author,
+                   br.due_date < :now AS is_overdue
+            FROM borrow_records br 
+            JOIN books b ON br.book_id = b.id 
+            WHERE br.patron_id = :patron_id AND br.return_date IS NULL
+            ORDER BY br.borrow_date
+        ''', {'patron_id': patron_id, 'now': datetime.now().isoformat()}).fetchall()
     
     borrowed_books = []
     for record in records:
@@ -125,77 +1181,941 @@ def get_patron_borrowed_books(patron_id: str) -> List[Dict]:
             'author': record['author'],
             'borrow_date': datetime.fromisoformat(record['borrow_date']),
             'due_date': datetime.fromisoformat(record['due_date']),
-            'is_overdue': datetime.now() > datetime.fromisoformat(record['due_date'])
+            'is_overdue': bool(record['is_overdue'])
         })
     
     return borrowed_books
 
 def get_patron_borrow_count(patron_id: str) -> int:
     """Get the number of books currently borrowed by a patron."""
-    conn = get_db_connection()
-    count = conn.execute('''
-        SELECT COUNT(*) as count FROM borrow_records 
-        WHERE patron_id = ? AND return_date IS NULL
-    ''', (patron_id,)).fetchone()['count']
-    conn.close()
+    with db_connection() as conn:
+        count = conn.execute('''
+            SELECT COUNT(*) as count FROM borrow_records 
+            WHERE patron_id = ? AND return_date IS NULL
+        ''', (patron_id,)).fetchone()['count']
     return count
 
 def insert_book(title: str, author: str, isbn: str, total_copies: int, available_copies: int) -> bool:
     """Insert a new book into the database."""
-    conn = get_db_connection()
-    try:
-        conn.execute('''
-            INSERT INTO books (title, author, isbn, total_copies, available_copies)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (title, author, isbn, total_copies, available_copies))
-        conn.commit()
-        conn.close()
-        return True
-    except Exception as e:
-        conn.close()
-        return False
+    with db_connection() as conn:
+        try:
+            book_id = conn.execute('''
+                INSERT INTO books (title, author, isbn, total_copies, available_copies)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (title, author, isbn, total_copies, available_copies)).lastrowid
+            # a cached "no such book" for the new ISBN or ID is now wrong
+            _log_books_changed(conn, [(book_id, isbn, title)])
+            conn.commit()
+            sync_catalog(conn)
+            return True
+        except Exception:
+            conn.rollback()
+            return False
+
+def insert_books_bulk(books: List[Tuple[str, str, str, int]]) -> Tuple[int, set]:
+    """
+    Insert many validated books in one IMMEDIATE transaction.
+
+    ISBNs already in the table are looked up in batches inside the same
+    transaction, so a concurrent insert can't slip in between the check and
+    the executemany().
+
+    Args:
+        books: (title, author, isbn, total_copies) tuples with unique ISBNs
+
+    Returns:
+        tuple: (number inserted, set of ISBNs skipped because they already exist)
+    """
+    if not books:
+        return 0, set()
+
+    isbns = [book[2] for book in books]
+    existing = set()
+    with db_connection() as conn:
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            # stay well under SQLite's host-parameter limit
+            for start in range(0, len(isbns), 500):
+                batch = isbns[start:start + 500]
+                placeholders = ', '.join('?' * len(batch))
+                existing.update(row[0] for row in conn.execute(
+                    f'SELECT isbn FROM books WHERE isbn IN ({placeholders})', batch))
+
+            has_fts = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE name = 'fts_sync'").fetchone()
+            if has_fts:
+                # AUTOINCREMENT ids only grow, so the new rows are id > last_id;
+                # the switch is never visible outside this write transaction
+                last_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM books').fetchone()[0]
+                conn.execute('UPDATE fts_sync SET suspended = 1')
+
+            conn.executemany('''
+                INSERT INTO books (title, author, isbn, total_copies, available_copies)
+                VALUES (?, ?, ?, ?, ?)
+            ''', ((title, author, isbn, copies, copies)
+                  for title, author, isbn, copies in books if isbn not in existing))
+
+            if has_fts:
+                conn.execute('''
+                    INSERT INTO books_fts (rowid, title, author)
+                    SELECT id, title, author FROM books WHERE id > ?
+                ''', (last_id,))
+                conn.execute('UPDATE fts_sync SET suspended = 0')
+            if len(existing) < len(books):
+                _log_books_changed(conn)
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+    if len(existing) < len(books):
+        sync_catalog()
+    return len(books) - len(existing), existing
 
 def insert_borrow_record(patron_id: str, book_id: int, borrow_date: datetime, due_date: datetime) -> bool:
     """Insert a new borrow record into the database."""
-    conn = get_db_connection()
-    try:
-        conn.execute('''
-            INSERT INTO borrow_records (patron_id, book_id, borrow_date, due_date)
-            VALUES (?, ?, ?, ?)
-        ''', (patron_id, book_id, borrow_date.isoformat(), due_date.isoformat()))
-        conn.commit()
-        conn.close()
-        return True
-    except Exception as e:
-        conn.close()
-        return False
+    with db_connection() as conn:
+        try:
+            conn.execute('''
+                INSERT INTO borrow_records (patron_id, book_id, borrow_date, due_date)
+                VALUES (?, ?, ?, ?)
+            ''', (patron_id, book_id, borrow_date.isoformat(), due_date.isoformat()))
+            conn.commit()
+            return True
+        except Exception:
+            conn.rollback()
+            return False
 
 def update_book_availability(book_id: int, change: int) -> bool:
     """Update the available copies of a book by a given amount (+1 for return, -1 for borrow)."""
-    conn = get_db_connection()
-    try:
-        conn.execute('''
-            UPDATE books SET available_copies = available_copies + ? WHERE id = ?
-        ''', (change, book_id))
-        conn.commit()
-        conn.close()
-        return True
-    except Exception as e:
-        conn.close()
-        return False
+    with db_connection() as conn:
+        try:
+            conn.execute('''
+                UPDATE books SET available_copies = available_copies + ? WHERE id = ?
+            ''', (change, book_id))
+            _log_books_changed(conn, [(book_id, None, None)])
+            conn.commit()
+            sync_catalog(conn)
+            return True
+        except Exception:
+            conn.rollback()
+            return False
 
 def update_borrow_record_return_date(patron_id: str, book_id: int, return_date: datetime) -> bool:
     """Update the return date for a borrow record."""
-    conn = get_db_connection()
-    try:
+    with db_connection() as conn:
+        try:
+            conn.execute('''
+                UPDATE borrow_records 
+                SET return_date = ? 
+                WHERE patron_id = ? AND book_id = ? AND return_date IS NULL
+            ''', (return_date.isoformat(), patron_id, book_id))
+            conn.commit()
+            return True
+        except Exception:
+            conn.rollback()
+            return False
+
+# Transactional borrow/return engine
+
+def _borrow_in_transaction(conn, patron_id: str, book_id: int, borrow_date: datetime,
+                           due_date: datetime, max_borrowed: int) -> Tuple[str, Optional[Dict]]:
+    """One borrow inside an open write transaction; only 'ok' leaves changes behind."""
+    count = conn.execute('''
+        SELECT COUNT(*) FROM borrow_records
+        WHERE patron_id = ? AND return_date IS NULL
+    ''', (patron_id,)).fetchone()[0]
+    if count >= max_borrowed:
+        return 'limit', None
+
+    book = conn.execute('SELECT * FROM books WHERE id = ?', (book_id,)).fetchone()
+    if not book:
+        return 'not_found', None
+
+    updated = conn.execute('''
+        UPDATE books SET available_copies = available_copies - 1
+        WHERE id = ? AND available_copies > 0
+    ''', (book_id,)).rowcount
+    if updated == 0:
+        return 'unavailable', dict(book)
+
+    conn.execute('''
+        INSERT INTO borrow_records (patron_id, book_id, borrow_date, due_date)
+        VALUES (?, ?, ?, ?)
+    ''', (patron_id, book_id, borrow_date.isoformat(), due_date.isoformat()))
+    return 'ok', dict(book)
+
+def _return_in_transaction(conn, patron_id: str, book_id: int,
+                           return_date: datetime) -> Tuple[str, Optional[Dict]]:
+    """One return inside an open write transaction; only 'ok' leaves changes behind."""
+    book = conn.execute('SELECT id FROM books WHERE id = ?', (book_id,)).fetchone()
+    if not book:
+        return 'not_found', None
+
+    record = conn.execute('''
+        SELECT * FROM borrow_records
+        WHERE patron_id = ? AND book_id = ? AND return_date IS NULL
+        ORDER BY borrow_date
+        LIMIT 1
+    ''', (patron_id, book_id)).fetchone()
+    if not record:
+        return 'no_record', None
+
+    conn.execute('UPDATE borrow_records SET return_date = ? WHERE id = ?',
+                 (return_date.isoformat(), record['id']))
+    conn.execute('''
+        UPDATE books SET available_copies = available_copies + 1
+        WHERE id = ? AND available_copies < total_copies
+    ''', (book_id,))
+    return 'ok', dict(record, return_date=return_date.isoformat())
+
+def _run_batch(step, items: List[Tuple[str, int]], *args) -> List[Tuple[str, Optional[Dict]]]:
+    """
+    Run step(conn, patron_id, book_id, *args) for every item in one IMMEDIATE
+    transaction. Each item gets a savepoint, so a database error undoes only
+    that item; the batch commits once.
+    """
+    results = []
+    with db_connection() as conn:
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            for patron_id, book_id in items:
+                conn.execute('SAVEPOINT item')
+                try:
+                    results.append(step(conn, patron_id, book_id, *args))
+                except sqlite3.Error:
+                    conn.execute('ROLLBACK TO item')
+                    results.append(('error', None))
+                conn.execute('RELEASE item')
+            changed = {book_id for (_, book_id), (status, _) in zip(items, results) if status == 'ok'}
+            if changed:
+                _log_books_changed(conn, [(book_id, None, None) for book_id in changed])
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            return [('error', None)] * len(items)
+    if changed:
+        sync_catalog()
+    return results
+
+def borrow_book_transaction(patron_id: str, book_id: int, borrow_date: datetime,
+                            due_date: datetime, max_borrowed: int = 5) -> Tuple[str, Optional[Dict]]:
+    """
+    Borrow a book in a single IMMEDIATE transaction.
+
+    The limit check, the conditional availability decrement and the borrow
+    record insert share one write lock and one commit, so two patrons racing
+    for the last copy cannot both succeed.
+
+    Returns:
+        tuple: (status, book) where status is one of 'ok', 'limit',
+        'not_found', 'unavailable' or 'error'
+    """
+    with db_connection() as conn:
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            status, book = _borrow_in_transaction(conn, patron_id, book_id, borrow_date,
+                                                  due_date, max_borrowed)
+            if status != 'ok':
+                conn.rollback()
+                return status, book
+            _log_books_changed(conn, [(book_id, None, None)])
+            conn.commit()
+            sync_catalog(conn)
+            return 'ok', book
+        except sqlite3.Error:
+            conn.rollback()
+            return 'error', None
+
+def borrow_books_transaction(items: List[Tuple[str, int]], borrow_date: datetime,
+                             due_date: datetime, max_borrowed: int = 5) -> List[Tuple[str, Optional[Dict]]]:
+    """
+    Borrow many (patron_id, book_id) pairs in one IMMEDIATE transaction.
+
+    Items run in order with the same checks as borrow_book_transaction(),
+    so earlier items count towards a patron's limit and a book's copies.
+
+    Returns:
+        list: (status, book) per item, as from borrow_book_transaction()
+    """
+    return _run_batch(_borrow_in_transaction, items, borrow_date, due_date, max_borrowed)
+
+def return_book_transaction(patron_id: str, book_id: int,
+                            return_date: datetime) -> Tuple[str, Optional[Dict]]:
+    """
+    Return a book in a single IMMEDIATE transaction.
+
+    Closes the patron's oldest open loan for the book and gives the copy
+    back (never above total_copies) with one commit.
+
+    Returns:
+        tuple: (status, record) where status is one of 'ok', 'not_found',
+        'no_record' or 'error'; record is the closed borrow record
+    """
+    with db_connection() as conn:
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            status, record = _return_in_transaction(conn, patron_id, book_id, return_date)
+            if status != 'ok':
+                conn.rollback()
+                return status, record
+            _log_books_changed(conn, [(book_id, None, None)])
+            conn.commit()
+            sync_catalog(conn)
+            return 'ok', record
+        except sqlite3.Error:
+            conn.rollback()
+            return 'error', None
+
+def return_books_transaction(items: List[Tuple[str, int]],
+                             return_date: datetime) -> List[Tuple[str, Optional[Dict]]]:
+    """
+    Return many (patron_id, book_id) pairs in one IMMEDIATE transaction.
+
+    Returns:
+        list: (status, record) per item, as from return_book_transaction()
+    """
+    return _run_batch(_return_in_transaction, items, return_date)
+
+# Late fees (R5)
+
+LATE_FEE_FIRST_DAYS = 7       # days charged at the first rate
+LATE_FEE_FIRST_RATE = 0.50    # $/day for the first LATE_FEE_FIRST_DAYS days overdue
+LATE_FEE_LATER_RATE = 1.00    # $/day after that
+LATE_FEE_CAP = 15.00          # maximum per book
+
+# Whole days between due_date and the return date (or :now for open loans).
+# Integer epoch seconds avoid julianday() rounding a full day down.
+_DAYS_OVERDUE_SQL = '''MAX((CAST(strftime('%s', COALESCE(br.return_date, :now)) AS INTEGER)
+                          - CAST(strftime('%s', br.due_date) AS INTEGER)) / 86400, 0)'''
+
+# The tiered fee applied to a whole result set at once
+_FEE_SQL = '''ROUND(MIN(:cap, CASE
+                  WHEN days_overdue <= :first_days THEN days_overdue * :first_rate
+                  ELSE :first_days * :first_rate + (days_overdue - :first_days) * :later_rate
+              END), 2)'''
+
+# A pending payment holds its fees while its gateway call may be in flight:
+# until the call raises (record_payment_error) or, if the process died
+# mid-call, for this many seconds. After that its outcome is unknown: the fee
+# shows as due again and the entry is re-sent by its idempotency key before
+# any new charge (see services.library_services).
+PAYMENT_PENDING_HOLD = 60
+
+# Fees already covered by the ledger for the loan `loans.id` (failed charges
+# settle nothing; pending ones hold the fee while in flight)
+_PAID_SQL = '''(SELECT COALESCE(SUM(pa.amount), 0)
+                FROM payment_allocations pa JOIN payments p ON p.id = pa.payment_id
+                WHERE pa.borrow_id = loans.id AND p.status != 'failed'
+                  AND NOT (p.status = 'pending'
+                           AND (p.message IS NOT NULL OR p.updated_at < :pending_since)))'''
+
+def _with_amount_due(row) -> Dict:
+    fee = dict(row)
+    fee['amount_due'] = round(max(fee['fee_amount'] - fee['paid_amount'], 0.0), 2)
+    return fee
+
+def _fee_params(as_of: Optional[datetime]) -> Dict:
+    return {'now': (as_of or datetime.now()).isoformat(), 'cap': LATE_FEE_CAP,
+            'first_days': LATE_FEE_FIRST_DAYS, 'first_rate': LATE_FEE_FIRST_RATE,
+            'later_rate': LATE_FEE_LATER_RATE, 'pending_since': _pending_since()}
+
+def _pending_since() -> str:
+    return (datetime.now() - timedelta(seconds=PAYMENT_PENDING_HOLD)).isoformat()
+
+def get_loan_fees(pairs: List[Tuple[str, int]],
+                  as_of: Optional[datetime] = None) -> Dict[Tuple[str, int], Dict]:
+    """
+    Late fee for many (patron_id, book_id) pairs in one query per 400 pairs.
+
+    Each pair is matched to its open loan, or to the most recent returned one
+    if nothing is open. Pairs with no borrow record are left out.
+
+    Returns:
+        dict: (patron_id, book_id) -> borrow record plus days_overdue, fee_amount,
+            paid_amount (settled through the payment ledger) and amount_due
+    """
+    fees = {}
+    params = _fee_params(as_of)
+    with db_connection() as conn:
+        for start in range(0, len(pairs), 400):
+            batch = pairs[start:start + 400]
+            values = ', '.join(f'(:p{n}, :b{n})' for n in range(len(batch)))
+            batch_params = dict(params)
+            for n, (patron_id, book_id) in enumerate(batch):
+                batch_params[f'p{n}'] = patron_id
+                batch_params[f'b{n}'] = book_id
+            rows = conn.execute(f'''
+                WITH wanted (patron_id, book_id) AS (VALUES {values}),
+                loans AS (
+                    SELECT br.*, {_DAYS_OVERDUE_SQL} AS days_overdue
+                    FROM wanted w
+                    JOIN borrow_records br ON br.id = (
+                        SELECT id FROM borrow_records
+                        WHERE patron_id = w.patron_id AND book_id = w.book_id
+                        ORDER BY return_date IS NOT NULL, borrow_date DESC
+                        LIMIT 1)
+                )
+                SELECT id, patron_id, book_id, borrow_date, due_date, return_date,
+                       days_overdue, {_FEE_SQL} AS fee_amount, {_PAID_SQL} AS paid_amount
+                FROM loans
+            ''', batch_params).fetchall()
+            for row in rows:
+                fees[(row['patron_id'], row['book_id'])] = _with_amount_due(row)
+    return fees
+
+def get_overdue_fees(patron_id: Optional[str] = None,
+                     as_of: Optional[datetime] = None) -> List[Dict]:
+    """
+    Late fees for every open, overdue loan (optionally for one patron) in one query.
+
+    Returns:
+        list: borrow records with title, days_overdue, fee_amount, paid_amount
+            and amount_due, oldest due first
+    """
+    params = _fee_params(as_of)
+    where = 'br.return_date IS NULL AND br.due_date < :now'
+    if patron_id is not None:
+        where += ' AND br.patron_id = :patron_id'
+        params['patron_id'] = patron_id
+
+    with db_connection() as conn:
+        rows = conn.execute(f'''
+            WITH loans AS (
+                SELECT br.*, {_DAYS_OVERDUE_SQL} AS days_overdue
+                FROM borrow_records br
+                WHERE {where}
+            )
+            SELECT loans.id, loans.patron_id, loans.book_id, b.title, loans.borrow_date,
+                   loans.due_date, loans.days_overdue, {_FEE_SQL} AS fee_amount,
+                   {_PAID_SQL} AS paid_amount
+            FROM loans JOIN books b ON b.id = loans.book_id
+            WHERE loans.days_overdue > 0
+            ORDER BY loans.due_date
+        ''', params).fetchall()
+    return [_with_amount_due(row) for row in rows]
+
+def get_outstanding_fees(patron_id: str, as_of: Optional[datetime] = None) -> List[Dict]:
+    """
+    A patron's late fees in one query: every open overdue loan, plus every
+    returned loan whose fee is not yet settled through the ledger.
+
+    Returns:
+        list: borrow records with title, return_date, days_overdue, fee_amount,
+            paid_amount and amount_due, oldest due first
+    """
+    params = _fee_params(as_of)
+    params['patron_id'] = patron_id
+    with db_connection() as conn:
+        rows = conn.execute(f'''
+            WITH loans AS (
+                SELECT br.*, {_DAYS_OVERDUE_SQL} AS days_overdue
+                FROM borrow_records br
+                WHERE br.patron_id = :patron_id
+            ),
+            priced AS (
+                SELECT loans.id, loans.patron_id, loans.book_id, b.title, loans.borrow_date,
+                       loans.due_date, loans.return_date, loans.days_overdue,
+                       {_FEE_SQL} AS fee_amount, {_PAID_SQL} AS paid_amount
+                FROM loans JOIN books b ON b.id = loans.book_id
+                WHERE loans.days_overdue > 0
+            )
+            SELECT * FROM priced
+            WHERE return_date IS NULL OR ROUND(fee_amount - paid_amount, 2) > 0
+            ORDER BY due_date
+        ''', params).fetchall()
+    return [_with_amount_due(row) for row in rows]
+
+def get_patron_status(patron_id: str, history_limit: int = 50, history_offset: int = 0,
+                      as_of: Optional[datetime] = None) -> Dict:
+    """
+    Everything on a patron's status page in two queries on one connection:
+    current loans joined with books (with their late fees) plus the size of
+    the patron's history, then one page of history, newest first.
+
+    Returns:
+        dict: borrowed_count, total_fees (still due on current overdue loans
+            and on late returns), returned_fees (the late-return part),
+            borrowed_books, history_count and history; dates are YYYY-MM-DD
+    """
+    params = _fee_params(as_of)
+    params.update(patron_id=patron_id, limit=history_limit, offset=history_offset)
+    with db_connection() as conn:
+        current = conn.execute(f'''
+            WITH returned AS (
+                SELECT br.id, {_DAYS_OVERDUE_SQL} AS days_overdue
+                FROM borrow_records br
+                WHERE br.patron_id = :patron_id AND br.return_date IS NOT NULL
+            ),
+            returned_due AS (
+                SELECT ROUND(MAX({_FEE_SQL} - {_PAID_SQL}, 0), 2) AS amount_due
+                FROM returned AS loans
+                WHERE loans.days_overdue > 0
+            ),
+            summary AS (
+                SELECT COUNT(*) AS history_count,
+                       (SELECT COALESCE(SUM(amount_due), 0) FROM returned_due) AS returned_fees
+                FROM borrow_records WHERE patron_id = :patron_id
+            ),
+            loans AS (
+                SELECT br.id, br.book_id, br.borrow_date, br.due_date, {_DAYS_OVERDUE_SQL} AS days_overdue
+                FROM borrow_records br
+                WHERE br.patron_id = :patron_id AND br.return_date IS NULL
+            )
+            SELECT summary.history_count, summary.returned_fees, loans.id, loans.book_id, b.title, b.author,
+                   date(loans.borrow_date) AS borrow_date, date(loans.due_date) AS due_date,
+                   loans.days_overdue > 0 AS is_overdue, loans.days_overdue,
+                   {_FEE_SQL} AS fee_amount, {_PAID_SQL} AS paid_amount
+            FROM summary
+            LEFT JOIN loans ON 1
+            LEFT JOIN books b ON b.id = loans.book_id
+            ORDER BY loans.borrow_date
+        ''', params).fetchall()
+        history = conn.execute('''
+            SELECT br.id, br.book_id, b.title, b.author,
+                   date(br.borrow_date) AS borrow_date, date(br.due_date) AS due_date,
+                   date(br.return_date) AS return_date
+            FROM borrow_records br JOIN books b ON b.id = br.book_id
+            WHERE br.patron_id = :patron_id
+            ORDER BY br.borrow_date DESC, br.id DESC
+            LIMIT :limit OFFSET :offset
+        ''', params).fetchall()
+
+    borrowed_books = []
+    for row in current:
+        if row['id'] is None:
+            break  # no current loans: only the summary row came back
+        loan = _with_amount_due(row)
+        del loan['history_count'], loan['returned_fees']
+        loan['is_overdue'] = bool(loan['is_overdue'])
+        borrowed_books.append(loan)
+    returned_fees = round(current[0]['returned_fees'], 2)
+    return {
+        'borrowed_count': len(borrowed_books),
+        'total_fees': round(sum((loan['amount_due'] for loan in borrowed_books), returned_fees), 2),
+        'returned_fees': returned_fees,
+        'borrowed_books': borrowed_books,
+        'history_count': current[0]['history_count'],
+        'history': [dict(row) for row in history],
+    }
+
+# Payment ledger
+
+PAYMENT_PENDING = 'pending'
+PAYMENT_COMPLETED = 'completed'
+PAYMENT_FAILED = 'failed'
+PAYMENT_REFUNDED = 'refunded'
+
+def _payment_with_allocations(conn, payment) -> Dict:
+    allocations = conn.execute('''
+        SELECT pa.borrow_id, pa.book_id, b.title, pa.amount AS fee_amount
+        FROM payment_allocations pa LEFT JOIN books b ON b.id = pa.book_id
+        WHERE pa.payment_id = ?
+        ORDER BY pa.rowid
+    ''', (payment['id'],)).fetchall()
+    return dict(payment, allocations=[dict(row) for row in allocations])
+
+def create_payment(idempotency_key: str, patron_id: str, amount: float,
+                   allocations: List[Dict], description: str = '') -> Tuple[bool, Dict]:
+    """
+    Open a pending ledger entry and its fee allocations in one IMMEDIATE
+    transaction, unless the idempotency key is already in the ledger.
+
+    Args:
+        allocations: {borrow_id, book_id, fee_amount} per loan being settled
+
+    Returns:
+        tuple: (created, payment) where payment is the new entry, or the
+        existing one for a repeated key
+    """
+    now = datetime.now().isoformat()
+    with db_connection() as conn:
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            existing = conn.execute('SELECT * FROM payments WHERE idempotency_key = ?',
+                                    (idempotency_key,)).fetchone()
+            if existing:
+                payment = _payment_with_allocations(conn, existing)
+                conn.rollback()
+                return False, payment
+
+            payment_id = conn.execute('''
+                INSERT INTO payments (idempotency_key, patron_id, amount, description, status,
+                                      created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (idempotency_key, patron_id, amount, description, PAYMENT_PENDING, now, now)).lastrowid
+            conn.executemany('''
+                INSERT INTO payment_allocations (payment_id, borrow_id, book_id, amount)
+                VALUES (?, ?, ?, ?)
+            ''', [(payment_id, a.get('borrow_id'), a['book_id'], a['fee_amount']) for a in allocations])
+            payment = _payment_with_allocations(
+                conn, conn.execute('SELECT * FROM payments WHERE id = ?', (payment_id,)).fetchone())
+            conn.commit()
+            return True, payment
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+
+def settle_payment(payment_id: int, status: str, transaction_id: Optional[str] = None,
+                   message: str = '') -> bool:
+    """
+    Record the gateway's answer for a pending payment ('completed' or 'failed').
+    A failed payment releases the fees it was holding.
+
+    Returns:
+        bool: False if the payment was no longer pending
+    """
+    with db_connection() as conn:
+        updated = conn.execute('''
+            UPDATE payments SET status = ?, transaction_id = ?, message = ?, updated_at = ?
+            WHERE id = ? AND status = ?
+        ''', (status, transaction_id, message, datetime.now().isoformat(),
+              payment_id, PAYMENT_PENDING)).rowcount
+        conn.commit()
+    return updated == 1
+
+def record_payment_error(payment_id: int, message: str) -> None:
+    """
+    Note that the gateway call for a pending payment raised. The payment stays
+    pending (the charge may have gone through) but no longer holds its fees.
+    """
+    with db_connection() as conn:
         conn.execute('''
-            UPDATE borrow_records 
-            SET return_date = ? 
-            WHERE patron_id = ? AND book_id = ? AND return_date IS NULL
-        ''', (return_date.isoformat(), patron_id, book_id))
+            UPDATE payments SET message = ?, updated_at = ?
+            WHERE id = ? AND status = ?
+        ''', (message, datetime.now().isoformat(), payment_id, PAYMENT_PENDING))
         conn.commit()
-        conn.close()
-        return True
-    except Exception as e:
-        conn.close()
-        return False
\ No newline at end of file
+
+def payment_unsettled(payment: Dict) -> bool:
+    """True for a pending payment or refund whose gateway call is no longer in flight (see PAYMENT_PENDING_HOLD)."""
+    return payment['status'] == PAYMENT_PENDING and (
+        payment['message'] is not None or payment['updated_at'] < _pending_since())
+
+def get_unsettled_payments(patron_id: Optional[str] = None) -> List[Dict]:
+    """
+    Pending ledger entries (with allocations) whose outcome is unknown, oldest
+    first: their gateway call raised or never returned.
+    """
+    with db_connection() as conn:
+        rows = conn.execute('''
+            SELECT * FROM payments
+            WHERE status = ? AND (message IS NOT NULL OR updated_at < ?)
+              AND (? IS NULL OR patron_id = ?)
+            ORDER BY id
+        ''', (PAYMENT_PENDING, _pending_since(), patron_id, patron_id)).fetchall()
+        return [_payment_with_allocations(conn, row) for row in rows]
+
+def get_payment(idempotency_key: str) -> Optional[Dict]:
+    """Ledger entry (with allocations) for an idempotency key."""
+    with db_connection() as conn:
+        payment = conn.execute('SELECT * FROM payments WHERE idempotency_key = ?',
+                               (idempotency_key,)).fetchone()
+        return _payment_with_allocations(conn, payment) if payment else None
+
+def get_payment_by_transaction(transaction_id: str) -> Optional[Dict]:
+    """Ledger entry (with allocations) for a gateway transaction ID."""
+    with db_connection() as conn:
+        payment = conn.execute('SELECT * FROM payments WHERE transaction_id = ?',
+                               (transaction_id,)).fetchone()
+        return _payment_with_allocations(conn, payment) if payment else None
+
+_REFUND_SQL = 'SELECT r.*, p.transaction_id FROM refunds r JOIN payments p ON p.id = r.payment_id'
+
+def reserve_refund(transaction_id: str, amount: float, idempotency_key: str) -> Tuple[bool, Optional[Dict]]:
+    """
+    Open a pending refund against a completed payment and count it as
+    refunded before the gateway is asked, in one IMMEDIATE transaction, so
+    concurrent refunds can never exceed what was paid. A key that is already
+    in the refunds ledger is returned instead.
+
+    Returns:
+        tuple: (created, refund) where refund is the new pending refund, the
+        existing one for a repeated key, or None if the payment is not
+        completed or amount exceeds what is left
+    """
+    now = datetime.now().isoformat()
+    with db_connection() as conn:
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            existing = conn.execute(f'{_REFUND_SQL} WHERE r.idempotency_key = ?',
+                                    (idempotency_key,)).fetchone()
+            if existing:
+                conn.rollback()
+                return False, dict(existing)
+
+            payment = conn.execute('''
+                SELECT id FROM payments
+                WHERE transaction_id = ? AND status = ? AND ROUND(refunded_amount + ?, 2) <= amount
+            ''', (transaction_id, PAYMENT_COMPLETED, amount)).fetchone()
+            if not payment:
+                conn.rollback()
+                return False, None
+
+            conn.execute('''
+                UPDATE payments
+                SET refunded_amount = ROUND(refunded_amount + :amount, 2),
+                    status = CASE WHEN ROUND(refunded_amount + :amount, 2) >= amount
+                                  THEN :refunded ELSE status END,
+                    updated_at = :now
+                WHERE id = :id
+            ''', {'amount': amount, 'id': payment['id'], 'now': now, 'refunded': PAYMENT_REFUNDED})
+            refund_id = conn.execute('''
+                INSERT INTO refunds (idempotency_key, payment_id, amount, status, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (idempotency_key, payment['id'], amount, PAYMENT_PENDING, now, now)).lastrowid
+            refund = dict(conn.execute(f'{_REFUND_SQL} WHERE r.id = ?', (refund_id,)).fetchone())
+            conn.commit()
+            return True, refund
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+
+def settle_refund(refund_id: int, status: str, message: str = '') -> bool:
+    """
+    Record the gateway's answer for a pending refund ('completed' or
+    'failed'). A failed refund no longer counts against its payment.
+
+    Returns:
+        bool: False if the refund was no longer pending
+    """
+    now = datetime.now().isoformat()
+    with db_connection() as conn:
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            refund = conn.execute('SELECT payment_id, amount FROM refunds WHERE id = ? AND status = ?',
+                                  (refund_id, PAYMENT_PENDING)).fetchone()
+            if not refund:
+                conn.rollback()
+                return False
+            conn.execute('UPDATE refunds SET status = ?, message = ?, updated_at = ? WHERE id = ?',
+                         (status, message, now, refund_id))
+            if status == PAYMENT_FAILED:
+                conn.execute('''
+                    UPDATE payments
+                    SET refunded_amount = ROUND(refunded_amount - ?, 2), status = ?, updated_at = ?
+                    WHERE id = ?
+                ''', (refund['amount'], PAYMENT_COMPLETED, now, refund['payment_id']))
+            conn.commit()
+            return True
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+
+def record_refund_error(refund_id: int, message: str) -> None:
+    """
+    Note that the gateway call for a pending refund raised. The refund stays
+    pending and counted against its payment: it may have gone through.
+    """
+    with db_connection() as conn:
+        conn.execute('''
+            UPDATE refunds SET message = ?, updated_at = ?
+            WHERE id = ? AND status = ?
+        ''', (message, datetime.now().isoformat(), refund_id, PAYMENT_PENDING))
+        conn.commit()
+
+def get_refund(idempotency_key: str) -> Optional[Dict]:
+    """Refund (with its payment's transaction_id) for an idempotency key."""
+    with db_connection() as conn:
+        refund = conn.execute(f'{_REFUND_SQL} WHERE r.idempotency_key = ?', (idempotency_key,)).fetchone()
+    return dict(refund) if refund else None
+
+def get_unreconciled_transactions(limit: Optional[int] = None) -> List[str]:
+    """Transaction IDs of ledger payments never checked against the gateway, oldest first."""
+    with db_connection() as conn:
+        rows = conn.execute('''
+            SELECT transaction_id FROM payments
+            WHERE reconciled_at IS NULL AND transaction_id IS NOT NULL
+            ORDER BY id LIMIT ?
+        ''', (-1 if limit is None else limit,)).fetchall()
+    return [row['transaction_id'] for row in rows]
+
+def get_payment_statuses(transaction_ids: List[str], chunk_size: int = 500) -> Dict[str, str]:
+    """Ledger status per transaction ID; IDs not in the ledger are left out."""
+    statuses = {}
+    with db_connection() as conn:
+        for start in range(0, len(transaction_ids), chunk_size):
+            chunk = transaction_ids[start:start + chunk_size]
+            rows = conn.execute(f'''
+                SELECT transaction_id, status FROM payments
+                WHERE transaction_id IN ({', '.join('?' * len(chunk))})
+            ''', chunk).fetchall()
+            statuses.update((row['transaction_id'], row['status']) for row in rows)
+    return statuses
+
+def record_reconciliation(results: List[Tuple[str, str]]) -> int:
+    """
+    Store the gateway's status for a batch of transactions in one transaction.
+
+    Args:
+        results: (transaction_id, gateway_status) pairs
+
+    Returns:
+        int: Number of ledger payments updated
+    """
+    now = datetime.now().isoformat()
+    with db_connection() as conn:
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            cursor = conn.executemany('''
+                UPDATE payments SET gateway_status = ?, reconciled_at = ?
+                WHERE transaction_id = ?
+            ''', [(status, now, transaction_id) for transaction_id, status in results])
+            conn.commit()
+            return cursor.rowcount
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+JOB_LEASE = 60.0        # seconds a claimed job stays its owner's without a renewal
+
+def _job_dict(row) -> Dict:
+    job = dict(row)
+    job['payload'] = json.loads(job['payload'])
+    job['result'] = json.loads(job['result']) if job['result'] else None
+    return job
+
+def enqueue_job(kind: str, payload: Dict, idempotency_key: Optional[str] = None,
+                max_attempts: int = 5) -> Tuple[bool, Dict]:
+    """
+    Queue a background job, unless one with the same idempotency key exists.
+
+    Returns:
+        tuple: (created, job) where job is the new one, or the existing one
+        for a repeated key
+    """
+    now = time.time()
+    with db_connection() as conn:
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            if idempotency_key:
+                existing = conn.execute('SELECT * FROM payment_jobs WHERE idempotency_key = ?',
+                                        (idempotency_key,)).fetchone()
+                if existing:
+                    conn.rollback()
+                    return False, _job_dict(existing)
+
+            job_id = conn.execute('''
+                INSERT INTO payment_jobs (kind, payload, idempotency_key, status, max_attempts,
+                                          run_after, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (kind, json.dumps(payload), idempotency_key, JOB_QUEUED, max_attempts,
+                  now, now)).lastrowid
+            job = conn.execute('SELECT * FROM payment_jobs WHERE id = ?', (job_id,)).fetchone()
+            conn.commit()
+            return True, _job_dict(job)
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+
+def claim_job(owner: Optional[str] = None, lease: float = JOB_LEASE) -> Optional[Dict]:
+    """
+    Take the oldest runnable queued job and mark it running, in one IMMEDIATE
+    transaction so two workers can never claim the same job.
+
+    Args:
+        owner: Who runs the job (e.g. host:pid); recorded with the lease
+        lease: Seconds until the job counts as abandoned unless the owner
+            renews it with renew_job_leases()
+
+    Returns:
+        dict: The claimed job (attempts already counts this run), or None
+    """
+    now = time.time()
+    with db_connection() as conn:
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            job = conn.execute('''
+                SELECT id FROM payment_jobs
+                WHERE status = ? AND run_after <= ?
+                ORDER BY run_after, id LIMIT 1
+            ''', (JOB_QUEUED, now)).fetchone()
+            if not job:
+                conn.rollback()
+                return None
+
+            conn.execute('''
+                UPDATE payment_jobs SET status = ?, attempts = attempts + 1, started_at = ?,
+                                        owner = ?, lease_expires = ?
+                WHERE id = ?
+            ''', (JOB_RUNNING, now, owner, now + lease, job['id']))
+            job = conn.execute('SELECT * FROM payment_jobs WHERE id = ?', (job['id'],)).fetchone()
+            conn.commit()
+            return _job_dict(job)
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+
+def finish_job(job_id: int, status: str, result: Optional[Dict] = None,
+               error: Optional[str] = None, owner: Optional[str] = None) -> None:
+    """
+    Record the outcome of a running job ('done' or 'failed'). With an owner,
+    only if the job is still that owner's (its lease was not taken over).
+    """
+    with db_connection() as conn:
+        conn.execute('''
+            UPDATE payment_jobs SET status = ?, result = ?, error = ?, finished_at = ?,
+                                    lease_expires = NULL
+            WHERE id = ? AND (? IS NULL OR owner = ?)
+        ''', (status, json.dumps(result) if result is not None else None, error,
+              time.time(), job_id, owner, owner))
+        conn.commit()
+
+def retry_job(job_id: int, delay: float, error: str, owner: Optional[str] = None) -> None:
+    """Put a running job back in the queue, runnable after delay seconds (see finish_job for owner)."""
+    with db_connection() as conn:
+        conn.execute('''
+            UPDATE payment_jobs SET status = ?, run_after = ?, error = ?, lease_expires = NULL
+            WHERE id = ? AND (? IS NULL OR owner = ?)
+        ''', (JOB_QUEUED, time.time() + delay, error, job_id, owner, owner))
+        conn.commit()
+
+def renew_job_leases(owner: str, lease: float = JOB_LEASE) -> int:
+    """
+    Extend the lease on every job owner is running, so no other process
+    takes them over.
+
+    Returns:
+        int: Number of leases renewed
+    """
+    with db_connection() as conn:
+        renewed = conn.execute('''
+            UPDATE payment_jobs SET lease_expires = ?
+            WHERE status = ? AND owner = ?
+        ''', (time.time() + lease, JOB_RUNNING, owner)).rowcount
+        conn.commit()
+    return renewed
+
+def requeue_running_jobs() -> int:
+    """
+    Put jobs whose lease expired, because the process running them stopped
+    or hung, back in the queue. Jobs a live process is running keep their
+    renewed lease and are left alone. Their handlers must be safe to re-run
+    (payments and refunds carry gateway idempotency keys).
+
+    Returns:
+        int: Number of jobs requeued
+    """
+    with db_connection() as conn:
+        requeued = conn.execute('''
+            UPDATE payment_jobs SET status = ?, owner = NULL, lease_expires = NULL
+            WHERE status = ? AND (lease_expires IS NULL OR lease_expires < ?)
+        ''', (JOB_QUEUED, JOB_RUNNING, time.time())).rowcount
+        conn.commit()
+    return requeued
+
+def get_job(job_id: int) -> Optional[Dict]:
+    """A background job by ID."""
+    with db_connection() as conn:
+        job = conn.execute('SELECT * FROM payment_jobs WHERE id = ?', (job_id,)).fetchone()
+    return _job_dict(job) if job else None
+
+def count_jobs_by_status() -> Dict[str, int]:
+    """Number of background jobs in each status."""
+    with db_connection() as conn:
+        rows = conn.execute('SELECT status, COUNT(*) AS count FROM payment_jobs GROUP BY status').fetchall()
+    counts = dict.fromkeys((JOB_QUEUED, JOB_RUNNING, JOB_DONE, JOB_FAILED), 0)
+    counts.update({row['status']: row['count'] for row in rows})
+    return counts
@@ -0,0 +1,45 @@
+"""
+Gunicorn settings: gunicorn -c gunicorn.conf.py wsgi:app
+
+Multi-process, multi-threaded workers with the app preloaded in the master,
+so the schema check and imports run once and workers fork already warm.
+Every value can be overridden from the environment (names below) or on the
+gunicorn command line.
+
+Reloading: with preload_app, HUP restarts the workers gracefully but keeps
+the code the master loaded; to deploy new code, send USR2 (start a new
+master alongside the old one) then WINCH and QUIT to the old master, or
+restart the service.
+"""
+
+import multiprocessing
+import os
+
+import database
+
+bind = os.environ.get('BIND', f"0.0.0.0:{os.environ.get('PORT', '5000')}")
+
+# Requests mostly wait on SQLite reads and template rendering; processes
+# sidestep the GIL, threads overlap the I/O. 2 x cores + 1 is gunicorn's
+# own rule of thumb.
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+
+preload_app = True
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = 5
+
+# Recycle workers now and then so no single one grows without bound
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 5000))
+max_requests_jitter = max_requests // 10
+
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG', '-') or None     # empty: no access log
+errorlog = '-'
+
+
+def pre_fork(server, worker):
+    # SQLite connections must not cross a fork: close the ones the preloaded
+    # app opened in the master, so each worker opens its own
+    database.close_pool()
@@ -2,6 +2,7 @@ from .catalog_routes import catalog_bp
 from .borrowing_routes import borrowing_bp
 from .search_routes import search_bp
 from .api_routes import api_bp
+from .patron_routes import patron_bp
 
 def register_blueprints(app):
     """Register all route blueprints with the Flask app."""
@@ -9,3 +10,4 @@ def register_blueprints(app):
     app.register_blueprint(borrowing_bp)
     app.register_blueprint(search_bp)
     app.register_blueprint(api_bp)
+    app.register_blueprint(patron_bp)
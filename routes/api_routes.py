@@ -2,8 +2,24 @@
 API Routes - JSON API endpoints
 """
 
-from flask import Blueprint, jsonify, request
-from services.library_service import calculate_late_fee_for_book, search_books_in_catalog
+import csv
+import io
+import json
+from itertools import islice
+
+from flask import Blueprint, Response, jsonify, request, url_for
+from database import get_books_page, encode_cursor, decode_cursor, iter_table_rows, EXPORT_TABLES
+from services.library_service import (
+    HISTORY_PAGE_SIZE, calculate_late_fee_for_book, calculate_late_fees, get_patron_late_fees,
+    get_patron_status_report, search_books_in_catalog, borrow_books_batch, return_books_batch
+)
+from services.library_services import pay_all_late_fees
+from services.catalog_import import READERS, import_books_from_file
+from routes.http_cache import catalog_conditional
+from services.payment_jobs import (
+    enqueue_late_fee_payment, enqueue_all_late_fees_payment, enqueue_refund,
+    get_payment_job, payment_queue_stats
+)
 
 api_bp = Blueprint('api', __name__, url_prefix='/api')
 
@@ -16,7 +32,182 @@ def get_late_fee(patron_id, book_id):
     result = calculate_late_fee_for_book(patron_id, book_id)
     return jsonify(result), 501 if 'not implemented' in result.get('status', '') else 200
 
+@api_bp.route('/late_fees/<patron_id>')
+def get_patron_late_fees_api(patron_id):
+    """
+    Late fees accruing on all of a patron's overdue books.
+    API endpoint for R5: Late Fee Calculation
+    """
+    result = get_patron_late_fees(patron_id)
+    if not result:
+        return jsonify({'error': 'Invalid patron ID. Must be exactly 6 digits.'}), 400
+    return jsonify(result)
+
+@api_bp.route('/late_fees/<patron_id>/pay', methods=['POST'])
+def pay_all_late_fees_api(patron_id):
+    """
+    Pay all of a patron's outstanding late fees with one gateway charge.
+    Returns the transaction ID and how the charge splits across books.
+    
+    Send an Idempotency-Key header to make retries safe: a repeated key is
+    answered from the payment ledger without charging again.
+    """
+    success, message, transaction_id, allocations = pay_all_late_fees(
+        patron_id, idempotency_key=request.headers.get('Idempotency-Key'))
+    return jsonify({
+        'success': success,
+        'message': message,
+        'transaction_id': transaction_id,
+        'amount': round(sum(a['fee_amount'] for a in allocations), 2),
+        'allocations': allocations
+    }), 200 if success else 400
+
+def _valid_patron_id(patron_id) -> bool:
+    return isinstance(patron_id, str) and patron_id.isdigit() and len(patron_id) == 6
+
+@api_bp.route('/payments', methods=['POST'])
+def create_payment_job_api():
+    """
+    Queue a payment or refund and return its job ID straight away.
+    Body: {"type": "late_fee", "patron_id": "123456", "book_id": 1}
+          {"type": "all_late_fees", "patron_id": "123456"}
+          {"type": "refund", "transaction_id": "txn_...", "amount": 2.50}
+    
+    Poll the returned status_url for the result. An Idempotency-Key header
+    makes resubmission safe: a repeated key returns the job already queued.
+    """
+    body = request.get_json(silent=True) or {}
+    payment_type = body.get('type')
+    idempotency_key = request.headers.get('Idempotency-Key')
+    
+    if payment_type in ('late_fee', 'all_late_fees'):
+        patron_id = body.get('patron_id')
+        if not _valid_patron_id(patron_id):
+            return jsonify({'error': 'Invalid patron ID. Must be exactly 6 digits.'}), 400
+        if payment_type == 'all_late_fees':
+            created, job = enqueue_all_late_fees_payment(patron_id, idempotency_key)
+        else:
+            try:
+                book_id = int(body['book_id'])
+            except (KeyError, TypeError, ValueError):
+                return jsonify({'error': 'book_id must be an integer'}), 400
+            created, job = enqueue_late_fee_payment(patron_id, book_id, idempotency_key)
+    elif payment_type == 'refund':
+        try:
+            transaction_id = str(body['transaction_id'])
+            amount = float(body['amount'])
+        except (KeyError, TypeError, ValueError):
+            return jsonify({'error': 'refund needs transaction_id and a numeric amount'}), 400
+        created, job = enqueue_refund(transaction_id, amount, idempotency_key)
+    else:
+        return jsonify({'error': 'type must be late_fee, all_late_fees or refund'}), 400
+    
+    return jsonify({
+        'job_id': job['id'],
+        'status': job['status'],
+        'status_url': url_for('api.get_payment_job_api', job_id=job['id'])
+    }), 202 if created else 200
+
+@api_bp.route('/payments/<int:job_id>')
+def get_payment_job_api(job_id):
+    """Status of a queued payment or refund, with its result once finished."""
+    job = get_payment_job(job_id)
+    if not job:
+        return jsonify({'error': 'Payment job not found.'}), 404
+    return jsonify(job)
+
+@api_bp.route('/payments/metrics')
+def payment_queue_metrics_api():
+    """Payment queue depth, job counters and queue-wait/run latency percentiles."""
+    return jsonify(payment_queue_stats())
+
+MAX_BATCH_ITEMS = 1000
+
+def _batch_items():
+    """(patron_id, book_id) pairs from a {"items": [...]} body, or None if malformed."""
+    items = (request.get_json(silent=True) or {}).get('items')
+    if not isinstance(items, list) or not 0 < len(items) <= MAX_BATCH_ITEMS \
+            or not all(isinstance(item, dict) for item in items):
+        return None
+    
+    pairs = []
+    for item in items:
+        try:
+            book_id = int(item.get('book_id'))
+        except (TypeError, ValueError):
+            book_id = None
+        pairs.append((str(item.get('patron_id', '')).strip(), book_id))
+    return pairs
+
+def _batch_response(results):
+    succeeded = sum(result['success'] for result in results)
+    return jsonify({'results': results, 'succeeded': succeeded, 'failed': len(results) - succeeded})
+
+@api_bp.route('/borrow/batch', methods=['POST'])
+def borrow_batch_api():
+    """
+    Borrow many books in one transaction (self-checkout kiosks).
+    Batch interface for R3: Book Borrowing
+    Body: {"items": [{"patron_id": "123456", "book_id": 1}, ...]}
+    
+    Items are processed in order; each gets its own success and message.
+    """
+    items = _batch_items()
+    if items is None:
+        return jsonify({'error': f'items must be a list of 1 to {MAX_BATCH_ITEMS} '
+                                 '{patron_id, book_id}'}), 400
+    return _batch_response(borrow_books_batch(items))
+
+@api_bp.route('/return/batch', methods=['POST'])
+def return_batch_api():
+    """
+    Return many books in one transaction (overnight book drop).
+    Batch interface for R4: Book Return Processing
+    Body: {"items": [{"patron_id": "123456", "book_id": 1}, ...]}
+    """
+    items = _batch_items()
+    if items is None:
+        return jsonify({'error': f'items must be a list of 1 to {MAX_BATCH_ITEMS} '
+                                 '{patron_id, book_id}'}), 400
+    return _batch_response(return_books_batch(items))
+
+@api_bp.route('/late_fees', methods=['POST'])
+def get_late_fees_batch_api():
+    """
+    Late fees for many loans at once.
+    Body: {"items": [{"patron_id": "123456", "book_id": 1}, ...]}
+    """
+    items = (request.get_json(silent=True) or {}).get('items')
+    if not isinstance(items, list):
+        return jsonify({'error': 'items must be a list of {patron_id, book_id}'}), 400
+    
+    try:
+        pairs = [(str(item['patron_id']), int(item['book_id'])) for item in items]
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'error': 'items must be a list of {patron_id, book_id}'}), 400
+    
+    results = calculate_late_fees(pairs)
+    return jsonify({'results': results, 'count': len(results)})
+
+@api_bp.route('/patron/<patron_id>')
+def get_patron_status_api(patron_id):
+    """
+    Patron's current loans, late fees and borrowing history.
+    API endpoint for R7: Patron Status Report
+    """
+    history_limit = request.args.get('history_limit', HISTORY_PAGE_SIZE, type=int)
+    history_offset = request.args.get('history_offset', 0, type=int)
+    if not 1 <= history_limit <= 200 or history_offset < 0:
+        return jsonify({'error': 'history_limit must be between 1 and 200 '
+                                 'and history_offset non-negative'}), 400
+    
+    report = get_patron_status_report(patron_id, history_limit, history_offset)
+    if not report:
+        return jsonify({'error': 'Invalid patron ID. Must be exactly 6 digits.'}), 400
+    return jsonify(report)
+
 @api_bp.route('/search')
+@catalog_conditional
 def search_books_api():
     """
     Search for books via API endpoint.
@@ -24,16 +215,116 @@ def search_books_api():
     """
     search_term = request.args.get('q', '').strip()
     search_type = request.args.get('type', 'title')
+    limit = request.args.get('limit', type=int)
+    offset = request.args.get('offset', 0, type=int)
     
     if not search_term:
         return jsonify({'error': 'Search term is required'}), 400
     
+    if (limit is not None and limit <= 0) or offset < 0:
+        return jsonify({'error': 'limit must be positive and offset non-negative'}), 400
+    
     # Use business logic function
-    books = search_books_in_catalog(search_term, search_type)
+    books = search_books_in_catalog(search_term, search_type, limit=limit, offset=offset)
     
     return jsonify({
         'search_term': search_term,
         'search_type': search_type,
         'results': books,
-        'count': len(books)
+        'count': len(books),
+        'limit': limit,
+        'offset': offset
+    })
+
+@api_bp.route('/books')
+@catalog_conditional
+def list_books_api():
+    """
+    List the catalog one page at a time.
+    API interface for R2: Book Catalog Display
+    
+    Pass the returned ``next_cursor`` back as ``cursor`` for the next page.
+    """
+    limit = request.args.get('limit', 50, type=int)
+    token = request.args.get('cursor', '')
+    
+    if not 1 <= limit <= 200:
+        return jsonify({'error': 'limit must be between 1 and 200'}), 400
+    
+    after = decode_cursor(token) if token else None
+    if token and after is None:
+        return jsonify({'error': 'Invalid cursor'}), 400
+    
+    books, page = get_books_page(after=after, limit=limit)
+    
+    return jsonify({
+        'books': books,
+        'count': len(books),
+        'limit': limit,
+        'next_cursor': encode_cursor(page['next']) if page['next'] else None
     })
+
+EXPORT_BATCH_ROWS = 1000
+
+def _batches(rows):
+    return iter(lambda: list(islice(rows, EXPORT_BATCH_ROWS)), [])
+
+def _ndjson_chunks(rows):
+    columns = next(rows)
+    for batch in _batches(rows):
+        yield ''.join(json.dumps(dict(zip(columns, row))) + '\n' for row in batch)
+
+def _csv_chunks(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(next(rows))
+    for batch in _batches(rows):
+        writer.writerows(batch)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+@api_bp.route('/export/<table>')
+def export_table(table):
+    """
+    Stream a full table (books or borrow_records) as NDJSON or CSV.
+    
+    Rows go straight from the database cursor to the response in batches,
+    so memory use does not depend on the table size.
+    """
+    export_format = request.args.get('format', 'ndjson')
+    
+    if table not in EXPORT_TABLES:
+        return jsonify({'error': f'Unknown table: {table}'}), 404
+    
+    if export_format not in ('ndjson', 'csv'):
+        return jsonify({'error': 'format must be ndjson or csv'}), 400
+    
+    rows = iter_table_rows(table, batch_size=EXPORT_BATCH_ROWS)
+    if export_format == 'csv':
+        body, mimetype = _csv_chunks(rows), 'text/csv'
+    else:
+        body, mimetype = _ndjson_chunks(rows), 'application/x-ndjson'
+    
+    return Response(body, mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename={table}.{export_format}'
+    })
+
+@api_bp.route('/books/import', methods=['POST'])
+def import_books_api():
+    """
+    Bulk-import books from a CSV or JSONL request body.
+    Bulk interface for R1: Book Catalog Management
+    
+    The body is parsed as it streams in; the response is the per-row report.
+    """
+    import_format = request.args.get('format', 'csv')
+    
+    if import_format not in READERS:
+        return jsonify({'error': 'format must be csv or jsonl'}), 400
+    
+    stream = io.TextIOWrapper(request.stream, encoding='utf-8', newline='')
+    report = import_books_from_file(stream, import_format)
+    
+    return jsonify(report)
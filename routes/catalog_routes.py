@@ -2,25 +2,44 @@
 Catalog Routes - Book catalog related endpoints
 """
 
-from flask import Blueprint, render_template, request, redirect, url_for, flash
-from database import get_all_books
+from flask import Blueprint, current_app, get_template_attribute, render_template, request, redirect, url_for, flash
+from database import encode_cursor, decode_cursor
 from services.library_service import add_book_to_catalog
+from routes.http_cache import catalog_conditional
+from routes.fragment_cache import catalog_fragments
 
 catalog_bp = Blueprint('catalog', __name__)
 
+MAX_PAGE_SIZE = 200
+
 @catalog_bp.route('/')
 def index():
     """Home page redirects to catalog."""
     return redirect(url_for('catalog.catalog'))
 
 @catalog_bp.route('/catalog')
+@catalog_conditional
 def catalog():
     """
-    Display all books in the catalog.
+    Display the catalog one page at a time.
     Implements R2: Book Catalog Display
+    
+    Query args ``after`` / ``before`` carry the keyset cursor of the
+    neighbouring page; ``limit`` overrides CATALOG_PAGE_SIZE (max 200).
+    The table rows come from the catalog fragment cache.
     """
-    books = get_all_books()
-    return render_template('catalog.html', books=books)
+    limit = request.args.get('limit', current_app.config.get('CATALOG_PAGE_SIZE', 50), type=int)
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    after = decode_cursor(request.args.get('after', ''))
+    before = decode_cursor(request.args.get('before', ''))
+    
+    rows, page, book_count = catalog_fragments.render_page(
+        after, before, limit, get_template_attribute('_catalog_rows.html', 'book_row'))
+    next_cursor = encode_cursor(page['next']) if page['next'] else None
+    prev_cursor = encode_cursor(page['prev']) if page['prev'] else None
+    return render_template('catalog.html', rows=rows, book_count=book_count, limit=limit,
+                           next_cursor=next_cursor, prev_cursor=prev_cursor,
+                           first_page=after is None and before is None)
 
 @catalog_bp.route('/add_book', methods=['GET', 'POST'])
 def add_book():
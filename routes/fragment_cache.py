@@ -0,0 +1,161 @@
+"""
+Fragment cache - rendered catalog table rows, reused across requests
+
+The catalog table is cached in two parts: the rendered <tr> of each book,
+and each page's layout (which books it lists, in order, and its cursors).
+A warm page is assembled from cached rows without a query or a render.
+
+Writes are applied precisely through the catalog listener in database.py:
+a borrow or return re-renders only the book's own row, and a new book drops
+only the pages whose key range it falls into. Rows are evicted least
+recently used once their rendered HTML exceeds max_bytes.
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+from markupsafe import Markup
+
+import database
+
+DEFAULT_MAX_BYTES = 4 * 1024 * 1024     # rendered row HTML kept in memory
+DEFAULT_MAX_PAGES = 512                 # page layouts kept in memory
+
+
+def _inside(key: Tuple[str, int], low: Optional[Tuple], high: Optional[Tuple]) -> bool:
+    """Whether key falls strictly between two (title, id) bounds; None is unbounded."""
+    return (low is None or low < key) and (high is None or key < high)
+
+
+class FragmentCache:
+    """Rendered catalog rows by book ID, and page layouts by (database, cursor, limit)."""
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES, max_pages: int = DEFAULT_MAX_PAGES):
+        self.max_bytes = max_bytes
+        self.max_pages = max_pages
+        self._rows: OrderedDict = OrderedDict()
+        self._pages: OrderedDict = OrderedDict()
+        self._bytes = 0
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._stats = {'page_hits': 0, 'page_misses': 0, 'row_hits': 0, 'row_misses': 0,
+                       'evictions': 0, 'invalidations': 0}
+
+    def render_page(self, after: Optional[Tuple[str, int]], before: Optional[Tuple[str, int]],
+                    limit: int, render_row: Callable[[Dict], str]) -> Tuple[Markup, Dict, int]:
+        """
+        The rendered rows of one catalog page, as get_books_page() would list it.
+
+        Returns:
+            tuple: (rows HTML, page cursors dict, number of books)
+        """
+        if self.max_bytes <= 0:
+            books, page = database.get_books_page(after=after, before=before, limit=limit)
+            return Markup(''.join(str(render_row(book)) for book in books)), page, len(books)
+
+        key = (database.DATABASE, after, before, limit)
+        with self._lock:
+            generation = self._generation
+            layout = self._pages.get(key)
+            if layout is not None:
+                self._pages.move_to_end(key)
+                self._stats['page_hits'] += 1
+                rows = [self._rows.get(book_id) for book_id in layout['ids']]
+            else:
+                self._stats['page_misses'] += 1
+
+        if layout is None:
+            books, page = database.get_books_page(after=after, before=before, limit=limit)
+            rendered = {book['id']: str(render_row(book)) for book in books}
+            self._store(generation, key, after, before, books, page, rendered)
+            with self._lock:
+                self._stats['row_misses'] += len(books)
+            return Markup(''.join(rendered.values())), page, len(books)
+
+        # rows dropped by a borrow/return (or evicted) are rendered again on their own
+        rendered, missing = {}, {}
+        for book_id, html in zip(layout['ids'], rows):
+            if html is None:
+                book = database.get_book_by_id(book_id)
+                html = missing[book_id] = str(render_row(book)) if book else ''
+            rendered[book_id] = html
+        with self._lock:
+            self._stats['row_hits'] += len(rows) - len(missing)
+            self._stats['row_misses'] += len(missing)
+            if generation == self._generation:
+                for book_id, html in missing.items():
+                    self._put_row(book_id, html)
+        return Markup(''.join(rendered.values())), layout['page'], len(rows)
+
+    def _store(self, generation: int, key: tuple, after, before, books: List[Dict],
+               page: Dict, rendered: Dict[int, str]) -> None:
+        first = (books[0]['title'], books[0]['id']) if books else None
+        last = (books[-1]['title'], books[-1]['id']) if books else None
+        # the slice of (title, id) key space this page covers: a new book
+        # inside it changes the page, one outside it does not
+        if before is not None:
+            low, high = (first if page['prev'] else None), before
+        else:
+            low, high = after, (last if page['next'] else None)
+        with self._lock:
+            if generation != self._generation:
+                return  # a write landed while we were querying; don't cache its old state
+            self._pages[key] = {'ids': [book['id'] for book in books], 'page': page,
+                                'low': low, 'high': high}
+            self._pages.move_to_end(key)
+            while len(self._pages) > self.max_pages:
+                self._pages.popitem(last=False)
+                self._stats['evictions'] += 1
+            for book_id, html in rendered.items():
+                self._put_row(book_id, html)
+
+    def _put_row(self, book_id: int, html: str) -> None:
+        previous = self._rows.pop(book_id, None)
+        if previous is not None:
+            self._bytes -= len(previous)
+        self._rows[book_id] = html
+        self._bytes += len(html)
+        while self._bytes > self.max_bytes and self._rows:
+            _, evicted = self._rows.popitem(last=False)
+            self._bytes -= len(evicted)
+            self._stats['evictions'] += 1
+
+    def books_changed(self, book_ids: Optional[Tuple], added: Tuple = ()) -> None:
+        """Catalog listener: drop changed rows, and pages a new book falls into."""
+        with self._lock:
+            self._generation += 1
+            self._stats['invalidations'] += 1
+            if book_ids is None:
+                self._rows.clear()
+                self._pages.clear()
+                self._bytes = 0
+                return
+            for book_id in book_ids:
+                html = self._rows.pop(book_id, None)
+                if html is not None:
+                    self._bytes -= len(html)
+            for new_key in added:
+                for key in [k for k, layout in self._pages.items()
+                            if _inside(tuple(new_key), layout['low'], layout['high'])]:
+                    del self._pages[key]
+
+    def clear(self) -> None:
+        self.books_changed(None)
+
+    def stats(self) -> Dict:
+        """Snapshot of hit/miss counters and memory use."""
+        with self._lock:
+            return dict(self._stats, rows=len(self._rows), pages=len(self._pages),
+                        bytes=self._bytes, max_bytes=self.max_bytes)
+
+
+catalog_fragments = FragmentCache()
+database.add_catalog_listener(catalog_fragments.books_changed)
+
+
+def init_fragment_cache(app) -> None:
+    """Size the catalog fragment cache from CATALOG_FRAGMENT_CACHE_BYTES (0 disables it)."""
+    app.config.setdefault('CATALOG_FRAGMENT_CACHE_BYTES', DEFAULT_MAX_BYTES)
+    catalog_fragments.max_bytes = app.config['CATALOG_FRAGMENT_CACHE_BYTES']
+    catalog_fragments.clear()
@@ -0,0 +1,82 @@
+"""
+HTTP caching - conditional GETs and Cache-Control for catalog-derived pages
+
+Views decorated with @catalog_conditional get a strong ETag and a
+Last-Modified header computed from the catalog version (database.py bumps it
+after every write to books). A request whose If-None-Match /
+If-Modified-Since still matches is answered 304 before the view runs, so it
+costs neither a query nor a template render.
+
+Cache-Control is set per blueprint from the CACHE_CONTROL config mapping
+(blueprint name -> header value), merged over DEFAULT_CACHE_CONTROL.
+"""
+
+import hashlib
+import math
+import secrets
+from datetime import datetime, timezone
+from functools import wraps
+
+from flask import current_app, make_response, request, session
+from werkzeug.http import is_resource_modified
+
+import database
+
+# Caches may keep catalog pages but must revalidate them (cheap: a 304)
+DEFAULT_CACHE_CONTROL = {
+    'catalog': 'public, no-cache',
+    'search': 'public, no-cache',
+    'api': 'private, no-cache',
+    'patron': 'private, no-store',
+    'metrics': 'no-store',
+}
+
+# The catalog version is shared through the database, but the pages also
+# depend on this code and its templates: ETags from a previous run must never
+# validate here. Workers forked from one preloaded app share the token.
+_PROCESS_TOKEN = secrets.token_hex(8)
+
+
+def catalog_etag(version: int) -> str:
+    key = f'{_PROCESS_TOKEN}:{database.DATABASE}:{version}'
+    return hashlib.sha1(key.encode()).hexdigest()[:20]
+
+
+def catalog_conditional(view):
+    """Answer conditional GETs for a view whose output depends only on the catalog."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        # flashed messages make the page one user's, and are consumed by rendering it
+        if request.method not in ('GET', 'HEAD') or session.get('_flashes'):
+            return view(*args, **kwargs)
+
+        version, modified = database.get_catalog_version()
+        etag = catalog_etag(version)
+        # HTTP dates have whole seconds: round up so a write later in the same
+        # second still counts as newer than the date we send
+        last_modified = datetime.fromtimestamp(math.ceil(modified), timezone.utc)
+        if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+            response = current_app.response_class(status=304)
+        else:
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+        response.set_etag(etag)
+        response.last_modified = last_modified
+        return response
+    return wrapper
+
+
+def _apply_cache_control(response):
+    if request.method in ('GET', 'HEAD') and response.status_code in (200, 304) \
+            and 'Cache-Control' not in response.headers:
+        policy = current_app.config['CACHE_CONTROL'].get(request.blueprint)
+        if policy:
+            response.headers['Cache-Control'] = policy
+    return response
+
+
+def init_http_cache(app) -> None:
+    """Merge CACHE_CONTROL config over the defaults and register the header hook."""
+    app.config['CACHE_CONTROL'] = {**DEFAULT_CACHE_CONTROL, **app.config.get('CACHE_CONTROL', {})}
+    app.after_request(_apply_cache_control)
@@ -0,0 +1,251 @@
+"""
+Metrics - request, template and SQL timing, served at /metrics for Prometheus
+
+Every request is timed per blueprint endpoint, and its time is broken down
+into phases: waiting for a pooled connection, running SQL and rendering
+templates. Every statement run through database.py is timed per issuing
+function via its query listener, fetching its rows included. All of it is kept in cumulative
+histograms and served at GET /metrics in the Prometheus text format,
+together with the connection pool, book cache, fragment cache and payment
+job gauges.
+
+A statement slower than SLOW_QUERY_MS (default 100; 0 logs every
+statement) is logged as a warning with its EXPLAIN QUERY PLAN. Set
+METRICS_ENABLED = False to leave the hooks out.
+"""
+
+import logging
+import threading
+import time
+from bisect import bisect_left
+from typing import Dict, List, Sequence, Tuple
+
+from flask import (Blueprint, Response, before_render_template, g, has_app_context, request,
+                   template_rendered)
+
+import database
+from routes.fragment_cache import catalog_fragments
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SLOW_QUERY_MS = 100
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+metrics_bp = Blueprint('metrics', __name__)
+
+
+def _labels(names: Sequence[str], values: Sequence, extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+class Histogram:
+    """Cumulative-bucket histogram with one series per label value tuple."""
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = buckets
+        self._series: Dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values) -> None:
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                # one count per bucket, one for +Inf, then the sum
+                series = self._series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[bisect_left(self.buckets, value)] += 1
+            series[-1] += value
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            snapshot = {key: list(series) for key, series in self._series.items()}
+        for label_values, series in sorted(snapshot.items()):
+            total = 0
+            for bound, count in zip(self.buckets + ('+Inf',), series):
+                total += count
+                le = f'le="{bound}"'
+                lines.append(f'{self.name}_bucket{_labels(self.labels, label_values, le)} {total}')
+            lines.append(f'{self.name}_sum{_labels(self.labels, label_values)} {series[-1]}')
+            lines.append(f'{self.name}_count{_labels(self.labels, label_values)} {total}')
+        return lines
+
+
+class Counter:
+    """Monotonic counter with one series per label value tuple."""
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._series: Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount: float = 1) -> None:
+        with self._lock:
+            self._series[label_values] = self._series.get(label_values, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self._lock:
+            snapshot = dict(self._series)
+        lines += [f'{self.name}{_labels(self.labels, key)} {value}' for key, value in sorted(snapshot.items())]
+        return lines
+
+
+REQUEST_SECONDS = Histogram('library_http_request_duration_seconds',
+                            'Time to handle a request, by endpoint.', ('endpoint', 'method'))
+REQUESTS = Counter('library_http_requests_total', 'Requests handled, by endpoint and status.',
+                   ('endpoint', 'method', 'status'))
+REQUEST_PHASE_SECONDS = Histogram('library_http_request_phase_seconds',
+                                  'Time per request spent waiting for a connection, running SQL '
+                                  'and rendering templates.', ('endpoint', 'phase'))
+REQUEST_QUERIES = Histogram('library_http_request_queries', 'SQL statements run per request.',
+                            ('endpoint',), COUNT_BUCKETS)
+TEMPLATE_SECONDS = Histogram('library_template_render_seconds', 'Time to render a template.',
+                             ('template',))
+QUERY_SECONDS = Histogram('library_db_query_duration_seconds',
+                          'Time to execute a statement, by the function that issued it.', ('function',))
+SLOW_QUERIES = Counter('library_db_slow_queries_total', 'Statements slower than SLOW_QUERY_MS.',
+                       ('function',))
+ACQUIRE_SECONDS = Histogram('library_db_connection_acquire_seconds',
+                            'Time to check a connection out of the pool (opened: a new connection).',
+                            ('opened',))
+
+_METRICS = (REQUEST_SECONDS, REQUESTS, REQUEST_PHASE_SECONDS, REQUEST_QUERIES, TEMPLATE_SECONDS,
+            QUERY_SECONDS, SLOW_QUERIES, ACQUIRE_SECONDS)
+_PHASES = ('connection', 'sql', 'render')
+
+_settings = {'slow_query_seconds': DEFAULT_SLOW_QUERY_MS / 1000, 'installed': False}
+
+
+def _request_metrics():
+    return g.get('_metrics') if has_app_context() else None
+
+
+def _on_query(conn, sql: str, parameters, seconds: float, caller: str) -> None:
+    QUERY_SECONDS.observe(seconds, caller)
+    current = _request_metrics()
+    if current is not None:
+        current['sql'] += seconds
+        current['queries'] += 1
+    if seconds >= _settings['slow_query_seconds']:
+        SLOW_QUERIES.inc(caller)
+        # executemany/executescript have no single parameter set to plan with
+        plan = database.explain_query_plan(conn, sql, parameters) if parameters is not None else []
+        logger.warning('Slow query (%.1f ms) in %s: %s\nQUERY PLAN\n%s', seconds * 1000, caller,
+                       ' '.join(sql.split()), '\n'.join(plan) or '(none)')
+
+
+def _on_acquire(seconds: float, opened: bool) -> None:
+    ACQUIRE_SECONDS.observe(seconds, 'true' if opened else 'false')
+    current = _request_metrics()
+    if current is not None:
+        current['connection'] += seconds
+
+
+def _before_render(app, template, context, **extra) -> None:
+    current = _request_metrics()
+    if current is not None:
+        current['templates'].append(time.perf_counter())
+
+
+def _rendered(app, template, context, **extra) -> None:
+    current = _request_metrics()
+    if current is not None and current['templates']:
+        seconds = time.perf_counter() - current['templates'].pop()
+        TEMPLATE_SECONDS.observe(seconds, template.name)
+        if not current['templates']:
+            current['render'] += seconds    # nested includes are counted once
+
+
+def _start_request() -> None:
+    g._metrics = {'start': time.perf_counter(), 'connection': 0.0, 'sql': 0.0, 'render': 0.0,
+                  'queries': 0, 'templates': []}
+
+
+def _finish_request(response):
+    current = g.pop('_metrics', None)
+    if current is not None:
+        # unmatched URLs share one label so scans can't grow the series without bound
+        endpoint = request.endpoint or '<unmatched>'
+        REQUEST_SECONDS.observe(time.perf_counter() - current['start'], endpoint, request.method)
+        REQUESTS.inc(endpoint, request.method, str(response.status_code))
+        for phase in _PHASES:
+            REQUEST_PHASE_SECONDS.observe(current[phase], endpoint, phase)
+        REQUEST_QUERIES.observe(current['queries'], endpoint)
+    return response
+
+
+def _gauge(name: str, documentation: str, samples: Dict[str, float], label: str = '') -> List[str]:
+    lines = [f'# HELP {name} {documentation}', f'# TYPE {name} gauge']
+    for key, value in samples.items():
+        lines.append(f'{name}{_labels((label,), (key,)) if label else ""} {value}')
+    return lines
+
+
+def _state_gauges() -> List[str]:
+    pool = database.get_pool_stats()
+    book_cache = database.get_book_cache_stats()
+    fragments = catalog_fragments.stats()
+    return (
+        _gauge('library_db_pool_connections', 'Pooled connections by state.',
+               {'in_use': pool['in_use'], 'idle': pool['idle']}, 'state')
+        + _gauge('library_db_pool_events', 'Pool checkout counters since the pool was built.',
+                 {key: pool[key] for key in ('hits', 'misses', 'waits', 'timeouts')}, 'event')
+        + _gauge('library_book_cache_events', 'Book lookup cache counters.',
+                 {key: book_cache[key] for key in ('hits', 'misses', 'expired', 'evictions')}, 'event')
+        + _gauge('library_book_cache_entries', 'Books held in the lookup cache.', {'': book_cache['entries']})
+        + _gauge('library_fragment_cache_events', 'Catalog fragment cache counters.',
+                 {key: fragments[key] for key in ('page_hits', 'page_misses', 'row_hits', 'row_misses',
+                                                  'evictions')}, 'event')
+        + _gauge('library_fragment_cache_bytes', 'Rendered catalog row HTML held in memory.',
+                 {'': fragments['bytes']})
+        + _gauge('library_payment_jobs', 'Payment jobs by status.', database.count_jobs_by_status(), 'status')
+    )
+
+
+def render_metrics() -> str:
+    """Every metric in the Prometheus text exposition format."""
+    lines = []
+    for metric in _METRICS:
+        lines += metric.render()
+    lines += _state_gauges()
+    return '\n'.join(lines) + '\n'
+
+
+@metrics_bp.route('/metrics')
+def metrics():
+    return Response(render_metrics(), content_type=CONTENT_TYPE)
+
+
+def init_metrics(app) -> None:
+    """Time requests, templates and queries and serve /metrics (METRICS_ENABLED, SLOW_QUERY_MS)."""
+    app.config.setdefault('METRICS_ENABLED', True)
+    app.config.setdefault('SLOW_QUERY_MS', DEFAULT_SLOW_QUERY_MS)
+    if not app.config['METRICS_ENABLED']:
+        return
+
+    _settings['slow_query_seconds'] = app.config['SLOW_QUERY_MS'] / 1000
+    if not _settings['installed']:
+        # the database hooks are process-wide; register them once however many apps are built
+        database.add_query_listener(_on_query)
+        database.add_acquire_listener(_on_acquire)
+        _settings['installed'] = True
+    before_render_template.connect(_before_render, app)
+    template_rendered.connect(_rendered, app)
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    app.register_blueprint(metrics_bp)
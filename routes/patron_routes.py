@@ -0,0 +1,44 @@
+"""
+Patron Routes - Patron status page
+"""
+
+import uuid
+
+from flask import Blueprint, render_template, request, redirect, url_for, flash
+from services.library_service import HISTORY_PAGE_SIZE, MAX_BORROWED_BOOKS, get_patron_status_report
+from services.library_services import pay_all_late_fees
+
+patron_bp = Blueprint('patron', __name__)
+
+@patron_bp.route('/patron')
+def patron_lookup():
+    """Look up a patron by library card number."""
+    patron_id = request.args.get('patron_id', '').strip()
+    if patron_id:
+        return redirect(url_for('patron.patron_status', patron_id=patron_id))
+    return render_template('patron_status.html', report=None)
+
+@patron_bp.route('/patron/<patron_id>')
+def patron_status(patron_id):
+    """
+    Show a patron's current loans, late fees and borrowing history.
+    Web interface for R7: Patron Status Report
+    """
+    offset = max(request.args.get('history_offset', 0, type=int), 0)
+    report = get_patron_status_report(patron_id, HISTORY_PAGE_SIZE, offset)
+    if not report:
+        flash('Invalid patron ID. Must be exactly 6 digits.', 'error')
+        return render_template('patron_status.html', report=None), 400
+    return render_template('patron_status.html', report=report, max_borrowed=MAX_BORROWED_BOOKS,
+                           history_offset=offset, page_size=HISTORY_PAGE_SIZE,
+                           idempotency_key=uuid.uuid4().hex)
+
+@patron_bp.route('/patron/<patron_id>/pay', methods=['POST'])
+def pay_fees(patron_id):
+    """Pay all of a patron's outstanding late fees in one charge."""
+    success, message, transaction_id, allocations = pay_all_late_fees(
+        patron_id, idempotency_key=request.form.get('idempotency_key') or None)
+    if success:
+        message += f" Transaction ID: {transaction_id}"
+    flash(message, 'success' if success else 'error')
+    return redirect(url_for('patron.patron_status', patron_id=patron_id))
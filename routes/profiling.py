@@ -0,0 +1,185 @@
+"""
+Profiling - opt-in per-request profiles, saved as collapsed stacks for flamegraphs
+
+RequestProfiler wraps the WSGI app. A request is profiled when
+PROFILE_REQUESTS is on (optionally only paths under PROFILE_PATHS), or when
+it carries an X-Profile header equal to PROFILE_HEADER_TOKEN, so a single
+live request can be profiled without redeploying. Profiled responses carry
+an X-Profile-File header naming the output.
+
+PROFILE_MODE selects the profiler:
+  * 'sampling' (default): a thread records the request's stack every
+    PROFILE_SAMPLE_INTERVAL seconds; cheap enough for real traffic.
+  * 'cprofile': deterministic cProfile; exact call counts, high overhead.
+    A .prof file (pstats) is written next to the collapsed stacks, which
+    are reconstructed from the caller graph and so are approximate.
+
+Output goes to PROFILE_DIR (default <instance path>/profiles) as
+"<time>-<method>-<path>-<id>.collapsed": one "frame;frame;frame count" line
+per stack, the format flamegraph.pl and speedscope read. Counts are samples
+in sampling mode and microseconds in cProfile mode. Response bodies are
+buffered while a request is profiled.
+"""
+
+import cProfile
+import hmac
+import os
+import pstats
+import re
+import sys
+import threading
+import uuid
+from collections import Counter, defaultdict
+from datetime import datetime
+from typing import Dict
+
+PROFILE_MODES = ('sampling', 'cprofile')
+DEFAULT_SAMPLE_INTERVAL = 0.001     # seconds between samples
+PROFILE_HEADER = 'X-Profile'
+_MAX_DEPTH = 200
+
+
+def _frame_label(module: str, function: str) -> str:
+    # ';' separates frames and ' ' the count in the collapsed format
+    return f'{module}.{function}'.replace(';', ':').replace(' ', '_')
+
+
+class _Sampler(threading.Thread):
+    """Counts the stacks of one thread, sampled every interval seconds."""
+
+    def __init__(self, thread_id: int, interval: float, stop_at):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stop_at = stop_at      # code object of the frame that ends the stack
+        self.counts: Counter = Counter()
+        self._done = threading.Event()
+
+    def run(self) -> None:
+        while not self._done.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None and frame.f_code is not self.stop_at:
+                stack.append(_frame_label(frame.f_globals.get('__name__', '?'), frame.f_code.co_name))
+                frame = frame.f_back
+            # no stop_at frame: the request is not running (yet, or any more)
+            if frame is not None and stack:
+                self.counts[';'.join(reversed(stack))] += 1
+
+    def stop(self) -> Counter:
+        self._done.set()
+        self.join()
+        return self.counts
+
+
+def collapse_pstats(stats: pstats.Stats) -> Counter:
+    """
+    Collapsed stacks (microseconds of own time) rebuilt from cProfile's caller graph.
+
+    cProfile only records caller -> callee edges, so a function reached
+    through several paths has its time split across them in proportion to
+    each edge's cumulative time.
+    """
+    entries = stats.stats
+    children = defaultdict(list)
+    for callee, (_, _, _, _, callers) in entries.items():
+        for caller, edge in callers.items():
+            children[caller].append((callee, edge[3]))
+
+    def label(func):
+        filename, _, name = func
+        module = os.path.splitext(os.path.basename(filename))[0] if filename != '~' else 'builtins'
+        return _frame_label(module, name)
+
+    counts: Counter = Counter()
+
+    def walk(func, stack, path, share):
+        _, _, own, total, _ = entries[func]
+        stack = stack + [label(func)]
+        micros = round(own * share * 1_000_000)
+        if micros:
+            counts[';'.join(stack)] += micros
+        if len(stack) >= _MAX_DEPTH:
+            return
+        for callee, edge_total in children[func]:
+            callee_total = entries[callee][3]
+            if callee not in path and callee_total and edge_total:
+                walk(callee, stack, path | {callee}, share * edge_total / callee_total)
+
+    for func, (_, _, _, _, callers) in entries.items():
+        if not callers:
+            walk(func, [], {func}, 1.0)
+    return counts
+
+
+class RequestProfiler:
+    """WSGI middleware that profiles selected requests (see the module docstring)."""
+
+    def __init__(self, wsgi_app, config: Dict):
+        if config['PROFILE_MODE'] not in PROFILE_MODES:
+            raise ValueError(f"Unknown PROFILE_MODE: {config['PROFILE_MODE']!r}. "
+                             f"Choose from {', '.join(PROFILE_MODES)}.")
+        self.wsgi_app = wsgi_app
+        self.always = config['PROFILE_REQUESTS']
+        self.paths = tuple(config['PROFILE_PATHS'] or ())
+        self.token = config['PROFILE_HEADER_TOKEN']
+        self.mode = config['PROFILE_MODE']
+        self.interval = config['PROFILE_SAMPLE_INTERVAL']
+        self.directory = config['PROFILE_DIR']
+
+    def _wanted(self, environ) -> bool:
+        header = environ.get('HTTP_' + PROFILE_HEADER.upper().replace('-', '_'))
+        if self.token and header is not None and hmac.compare_digest(header, self.token):
+            return True
+        return self.always and (not self.paths or environ.get('PATH_INFO', '').startswith(self.paths))
+
+    def __call__(self, environ, start_response):
+        if not self._wanted(environ):
+            return self.wsgi_app(environ, start_response)
+
+        slug = re.sub(r'[^A-Za-z0-9]+', '_', environ.get('PATH_INFO', '')).strip('_') or 'root'
+        name = (f"{datetime.now():%Y%m%d-%H%M%S}-{environ.get('REQUEST_METHOD', 'GET')}-"
+                f"{slug[:60]}-{uuid.uuid4().hex[:8]}")
+
+        def tagged_start_response(status, headers, exc_info=None):
+            return start_response(status, headers + [('X-Profile-File', f'{name}.collapsed')], exc_info)
+
+        def respond():
+            response = self.wsgi_app(environ, tagged_start_response)
+            try:
+                return b''.join(response)
+            finally:
+                if hasattr(response, 'close'):
+                    response.close()
+
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, name)
+        if self.mode == 'cprofile':
+            profiler = cProfile.Profile()
+            body = profiler.runcall(respond)
+            profiler.dump_stats(f'{path}.prof')
+            counts = collapse_pstats(pstats.Stats(profiler))
+        else:
+            sampler = _Sampler(threading.get_ident(), self.interval, respond.__code__)
+            sampler.start()
+            try:
+                body = respond()
+            finally:
+                counts = sampler.stop()
+
+        with open(f'{path}.collapsed', 'w', encoding='utf-8') as out:
+            for stack, count in sorted(counts.items()):
+                out.write(f'{stack} {count}\n')
+        return [body]
+
+
+def init_profiling(app) -> None:
+    """Wrap the app in RequestProfiler if PROFILE_REQUESTS or PROFILE_HEADER_TOKEN is set."""
+    app.config.setdefault('PROFILE_REQUESTS', False)
+    app.config.setdefault('PROFILE_PATHS', None)
+    app.config.setdefault('PROFILE_HEADER_TOKEN', os.environ.get('PROFILE_HEADER_TOKEN'))
+    app.config.setdefault('PROFILE_MODE', 'sampling')
+    app.config.setdefault('PROFILE_SAMPLE_INTERVAL', DEFAULT_SAMPLE_INTERVAL)
+    app.config.setdefault('PROFILE_DIR', os.path.join(app.instance_path, 'profiles'))
+    if app.config['PROFILE_REQUESTS'] or app.config['PROFILE_HEADER_TOKEN']:
+        app.wsgi_app = RequestProfiler(app.wsgi_app, app.config)
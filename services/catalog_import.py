@@ -0,0 +1,140 @@
+"""
+Catalog Import Module - Bulk loading of vendor feeds
+Applies the R1 validation rules to every row and inserts in chunked transactions
+"""
+
+import csv
+import json
+from itertools import islice
+from typing import Dict, IO, Iterable, Iterator, List, Optional, Tuple
+
+from database import insert_books_bulk
+from services.library_service import validate_book_fields
+
+DEFAULT_CHUNK_SIZE = 5000
+
+# (row number, parsed record or None, parse error or None)
+NumberedRecord = Tuple[int, Optional[Dict], Optional[str]]
+
+
+def _text(value) -> str:
+    if value is None:
+        return ''
+    return value if isinstance(value, str) else str(value)
+
+
+def _copies(value) -> Optional[int]:
+    """Accept ints and digit strings (CSV cells); anything else fails R1."""
+    if type(value) is int:
+        return value
+    if isinstance(value, str) and value.strip().isdigit():
+        return int(value.strip())
+    return None
+
+
+def read_books_csv(stream: IO[str]) -> Iterator[NumberedRecord]:
+    """Parse a CSV feed with title, author, isbn, total_copies columns."""
+    reader = csv.DictReader(stream)
+    for record in reader:
+        yield reader.line_num, record, None
+
+
+def read_books_jsonl(stream: IO[str]) -> Iterator[NumberedRecord]:
+    """Parse a JSON Lines feed, one book object per line."""
+    for line_number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield line_number, None, f"Invalid JSON: {e}"
+            continue
+        if not isinstance(record, dict):
+            yield line_number, None, "Each line must be a JSON object."
+            continue
+        yield line_number, record, None
+
+
+READERS = {'csv': read_books_csv, 'jsonl': read_books_jsonl}
+
+
+def import_books_from_file(stream: IO[str], file_format: str,
+                           chunk_size: int = DEFAULT_CHUNK_SIZE) -> Dict:
+    """
+    Import a CSV or JSONL feed. See import_numbered_books() for the report.
+    """
+    if file_format not in READERS:
+        raise ValueError(f"Unsupported import format: {file_format!r}")
+    return import_numbered_books(READERS[file_format](stream), chunk_size)
+
+
+def import_books(records: Iterable[Dict], chunk_size: int = DEFAULT_CHUNK_SIZE) -> Dict:
+    """
+    Import book dicts (title, author, isbn, total_copies). Rows are numbered from 1.
+    """
+    return import_numbered_books(((n, record, None) for n, record in enumerate(records, 1)),
+                                 chunk_size)
+
+
+def import_numbered_books(rows: Iterable[NumberedRecord],
+                          chunk_size: int = DEFAULT_CHUNK_SIZE) -> Dict:
+    """
+    Validate and insert books ``chunk_size`` rows at a time.
+
+    Every row goes through validate_book_fields(); ISBNs repeated within the
+    feed or already in the catalog are rejected like add_book_to_catalog()
+    would. Each chunk of valid rows is one transaction and one executemany().
+
+    Returns:
+        dict: total, inserted, failed counts and an ``errors`` list of
+        {'row', 'isbn', 'error'} entries
+    """
+    report = {'total': 0, 'inserted': 0, 'failed': 0, 'errors': []}
+    first_seen: Dict[str, int] = {}
+    rows = iter(rows)
+
+    def fail(row_number: int, isbn: str, error: str) -> None:
+        report['failed'] += 1
+        report['errors'].append({'row': row_number, 'isbn': isbn, 'error': error})
+
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+
+        valid: List[Tuple[int, Tuple[str, str, str, int]]] = []
+        for row_number, record, parse_error in chunk:
+            report['total'] += 1
+            if parse_error:
+                fail(row_number, '', parse_error)
+                continue
+
+            title, author = _text(record.get('title')), _text(record.get('author'))
+            isbn, copies = _text(record.get('isbn')), _copies(record.get('total_copies'))
+            error = validate_book_fields(title, author, isbn, copies)
+            if error:
+                fail(row_number, isbn, error)
+                continue
+
+            if isbn in first_seen:
+                fail(row_number, isbn, f"Duplicate ISBN in import (first seen on row {first_seen[isbn]}).")
+                continue
+            first_seen[isbn] = row_number
+            valid.append((row_number, (title.strip(), author.strip(), isbn, copies)))
+
+        if not valid:
+            continue
+
+        try:
+            inserted, existing = insert_books_bulk([book for _, book in valid])
+        except Exception as e:
+            for row_number, book in valid:
+                fail(row_number, book[2], f"Database error occurred while adding the book: {e}")
+            continue
+
+        report['inserted'] += inserted
+        for row_number, book in valid:
+            if book[2] in existing:
+                fail(row_number, book[2], "A book with this ISBN already exists.")
+
+    return report
@@ -0,0 +1,189 @@
+"""
+Job Queue Module - In-process background jobs persisted in SQLite
+
+Jobs are rows in the payment_jobs table, so queued work survives a restart.
+A fixed pool of worker threads claims runnable jobs one at a time (the pool
+size bounds how many run at once) and passes each job's payload to the
+handler registered for its kind. A handler that raises is retried with
+exponential backoff until the job's attempts run out.
+
+Several processes (e.g. server workers) can share the table. A claimed job
+is leased to its queue, which renews the lease while the job runs; only jobs
+whose lease lapsed, because their process died or hung, are requeued.
+
+Example:
+    queue = JobQueue({"echo": lambda payload: payload}, workers=2).start()
+    created, job = queue.enqueue("echo", {"message": "hi"})
+"""
+
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Callable, Dict, Optional, Tuple
+
+from database import (
+    enqueue_job, claim_job, finish_job, retry_job, renew_job_leases, requeue_running_jobs,
+    count_jobs_by_status, JOB_DONE, JOB_FAILED, JOB_LEASE
+)
+
+DEFAULT_WORKERS = 4
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_BACKOFF = 1.0           # seconds before the first retry, doubled per attempt
+DEFAULT_MAX_BACKOFF = 60.0      # longest wait between attempts
+DEFAULT_POLL_INTERVAL = 0.5     # seconds an idle worker waits before looking again
+LATENCY_SAMPLES = 1000          # recent jobs kept for the latency percentiles
+
+
+def _percentiles(samples) -> Dict:
+    if not samples:
+        return {"count": 0, "p50_ms": None, "p95_ms": None, "max_ms": None}
+    ordered = sorted(samples)
+
+    def ms(q):
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 2)
+
+    return {"count": len(ordered), "p50_ms": ms(0.50), "p95_ms": ms(0.95), "max_ms": ms(1.0)}
+
+
+class JobQueue:
+    """
+    Runs persisted jobs on a pool of worker threads.
+
+    handlers maps a job kind to a callable taking the job payload and
+    returning a JSON-serializable result; raising schedules a retry.
+    """
+
+    def __init__(self, handlers: Dict[str, Callable[[Dict], Dict]], workers: int = DEFAULT_WORKERS,
+                 max_attempts: int = DEFAULT_MAX_ATTEMPTS, backoff: float = DEFAULT_BACKOFF,
+                 max_backoff: float = DEFAULT_MAX_BACKOFF, poll_interval: float = DEFAULT_POLL_INTERVAL,
+                 lease: float = JOB_LEASE):
+        self.handlers = handlers
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._threads = []
+        self._wakeup = threading.Condition()
+        self._stopping = False
+        self._lock = threading.Lock()
+        self._stats = {"enqueued": 0, "succeeded": 0, "failed": 0, "retried": 0, "requeued": 0}
+        self._wait_times = deque(maxlen=LATENCY_SAMPLES)
+        self._run_times = deque(maxlen=LATENCY_SAMPLES)
+
+    def start(self) -> "JobQueue":
+        """Requeue abandoned jobs and start the workers and the lease keeper."""
+        if self._threads:
+            return self
+        self._stopping = False
+        self._requeue_abandoned()
+        for number in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"job-worker-{number}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        thread = threading.Thread(target=self._keep_leases, name="job-leases", daemon=True)
+        thread.start()
+        self._threads.append(thread)
+        return self
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """Stop the workers once their current jobs finish; queued jobs stay queued."""
+        with self._wakeup:
+            self._stopping = True
+            self._wakeup.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def enqueue(self, kind: str, payload: Dict, idempotency_key: Optional[str] = None) -> Tuple[bool, Dict]:
+        """
+        Queue a job. A repeated idempotency key returns the existing job.
+
+        Returns:
+            tuple: (created, job)
+        """
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind: {kind!r}.")
+        created, job = enqueue_job(kind, payload, idempotency_key, self.max_attempts)
+        if created:
+            with self._lock:
+                self._stats["enqueued"] += 1
+            with self._wakeup:
+                self._wakeup.notify()
+        return created, job
+
+    def _requeue_abandoned(self) -> None:
+        try:
+            requeued = requeue_running_jobs()
+        except sqlite3.Error:
+            return      # database busy: the next pass will catch them
+        with self._lock:
+            self._stats["requeued"] += requeued
+
+    def _keep_leases(self) -> None:
+        # renew this queue's leases well before they lapse, and pick up jobs
+        # abandoned by other processes meanwhile
+        while True:
+            with self._wakeup:
+                if not self._stopping:
+                    self._wakeup.wait(self.lease / 3)
+                if self._stopping:
+                    return
+            try:
+                renew_job_leases(self.owner, self.lease)
+            except sqlite3.Error:
+                pass
+            self._requeue_abandoned()
+
+    def _work(self) -> None:
+        while not self._stopping:
+            try:
+                job = claim_job(self.owner, self.lease)
+            except sqlite3.Error:
+                # database busy or briefly unavailable: look again after the poll interval
+                job = None
+            if job is None:
+                with self._wakeup:
+                    if not self._stopping:
+                        self._wakeup.wait(self.poll_interval)
+                continue
+            self._run(job)
+
+    def _run(self, job: Dict) -> None:
+        started = time.time()
+        try:
+            result = self.handlers[job["kind"]](job["payload"])
+        except Exception as e:
+            error = str(e) or type(e).__name__
+            if job["attempts"] < job["max_attempts"]:
+                delay = min(self.max_backoff, self.backoff * 2 ** (job["attempts"] - 1))
+                retry_job(job["id"], delay, error, owner=self.owner)
+                self._record("retried", job, started)
+            else:
+                finish_job(job["id"], JOB_FAILED, error=error, owner=self.owner)
+                self._record("failed", job, started)
+            return
+        finish_job(job["id"], JOB_DONE, result=result, owner=self.owner)
+        self._record("succeeded", job, started)
+
+    def _record(self, outcome: str, job: Dict, started: float) -> None:
+        with self._lock:
+            self._stats[outcome] += 1
+            if job["attempts"] == 1:
+                self._wait_times.append(started - job["created_at"])
+            self._run_times.append(time.time() - started)
+
+    def stats(self) -> Dict:
+        """Job counters, queue depth by status and recent latency percentiles."""
+        with self._lock:
+            stats = dict(self._stats)
+            wait_times, run_times = list(self._wait_times), list(self._run_times)
+        return dict(stats, workers=self.workers, running=bool(self._threads),
+                    depth=count_jobs_by_status(),
+                    queue_wait=_percentiles(wait_times), run_time=_percentiles(run_times))
@@ -6,43 +6,61 @@ Contains all the core business logic for the Library Management System
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Tuple
 from database import (
-    get_book_by_id, get_book_by_isbn, get_patron_borrow_count,
-    insert_book, insert_borrow_record, update_book_availability,
-    update_borrow_record_return_date, get_all_books
+    get_book_by_id, get_book_by_isbn, insert_book, search_books,
+    borrow_book_transaction, return_book_transaction, borrow_books_transaction, return_books_transaction,
+    get_loan_fees, get_outstanding_fees,
+    get_patron_status,
+    LATE_FEE_FIRST_DAYS, LATE_FEE_FIRST_RATE, LATE_FEE_LATER_RATE, LATE_FEE_CAP
 )
 
-def add_book_to_catalog(title: str, author: str, isbn: str, total_copies: int) -> Tuple[bool, str]:
+MAX_BORROWED_BOOKS = 5
+HISTORY_PAGE_SIZE = 50
+
+def validate_book_fields(title: str, author: str, isbn: str, total_copies: int) -> Optional[str]:
     """
-    Add a new book to the catalog.
-    Implements R1: Book Catalog Management
+    Check the R1 field rules for a new book.
     
-    Args:
-        title: Book title (max 200 chars)
-        author: Book author (max 100 chars)
-        isbn: 13-digit ISBN
-        total_copies: Number of copies (positive integer)
-        
     Returns:
-        tuple: (success: bool, message: str)
+        str: The first validation error message, or None if the book is valid
     """
-    # Input validation
     if not title or not title.strip():
-        return False, "Title is required."
+        return "Title is required."
     
     if len(title.strip()) > 200:
-        return False, "Title must be less than 200 characters."
+        return "Title must be less than 200 characters."
     
     if not author or not author.strip():
-        return False, "Author is required."
+        return "Author is required."
     
     if len(author.strip()) > 100:
-        return False, "Author must be less than 100 characters."
+        return "Author must be less than 100 characters."
     
     if len(isbn) != 13:
-        return False, "ISBN must be exactly 13 digits."
+        return "ISBN must be exactly 13 digits."
     
     if not isinstance(total_copies, int) or total_copies <= 0:
-        return False, "Total copies must be a positive integer."
+        return "Total copies must be a positive integer."
+    
+    return None
+
+def add_book_to_catalog(title: str, author: str, isbn: str, total_copies: int) -> Tuple[bool, str]:
+    """
+    Add a new book to the catalog.
+    Implements R1: Book Catalog Management
+    
+    Args:
+        title: Book title (max 200 chars)
+        author: Book author (max 100 chars)
+        isbn: 13-digit ISBN
+        total_copies: Number of copies (positive integer)
+        
+    Returns:
+        tuple: (success: bool, message: str)
+    """
+    # Input validation
+    error = validate_book_fields(title, author, isbn, total_copies)
+    if error:
+        return False, error
     
     # Check for duplicate ISBN
     existing = get_book_by_isbn(isbn)
@@ -72,32 +90,30 @@ def borrow_book_by_patron(patron_id: str, book_id: int) -> Tuple[bool, str]:
     if not patron_id or not patron_id.isdigit() or len(patron_id) != 6:
         return False, "Invalid patron ID. Must be exactly 6 digits."
 
-    # check patron's current borrowed books count FIRST
-    current_borrowed = get_patron_borrow_count(patron_id)
-    if current_borrowed >= 5:
-        return False, "You have reached the maximum borrowing limit of 5 books."
+    # create borrow record
+    borrow_date = datetime.now()
+    due_date = borrow_date + timedelta(days=14)
+
+    # limit check, availability decrement and record insert in one transaction
+    status, book = borrow_book_transaction(patron_id, book_id, borrow_date, due_date,
+                                           max_borrowed=MAX_BORROWED_BOOKS)
+    return _borrow_result(status, book, due_date)
 
-    # then check if book exists and is available
-    book = get_book_by_id(book_id)
-    if not book:
+
+def _borrow_result(status: str, book: Optional[Dict], due_date: datetime) -> Tuple[bool, str]:
+    """The R3 answer for a borrow transaction status."""
+    if status == 'limit':
+        return False, f"You have reached the maximum borrowing limit of {MAX_BORROWED_BOOKS} books."
+
+    if status == 'not_found':
         return False, "Book not found."
 
-    if book['available_copies'] <= 0:
+    if status == 'unavailable':
         return False, "This book is currently not available."
 
-    # create borrow record
-    borrow_date = datetime.now()
-    due_date = borrow_date + timedelta(days=14)
-
-    # insert borrow record and update availability
-    borrow_success = insert_borrow_record(patron_id, book_id, borrow_date, due_date)
-    if not borrow_success:
+    if status != 'ok':
         return False, "Database error occurred while creating borrow record."
 
-    availability_success = update_book_availability(book_id, -1)
-    if not availability_success:
-        return False, "Database error occurred while updating book availability."
-
     return True, f'Successfully borrowed \"{book['title']}\". Due date: {due_date.strftime('%Y-%m-%d')}.' 
 
 
@@ -118,111 +134,238 @@ def return_book_by_patron(patron_id: str, book_id: int) -> Tuple[bool, str]:
     if not patron_id or not patron_id.isdigit() or len(patron_id) != 6:
         return False, "Invalid patron ID."
 
-    # checking if the book exists before doing anything 
-    book = get_book_by_id(book_id)
-    if not book:
+    # close the loan and give the copy back in one transaction
+    status, record = return_book_transaction(patron_id, book_id, datetime.now())
+    return _return_result(status, record)
+
+
+def _return_result(status: str, record: Optional[Dict]) -> Tuple[bool, str]:
+    """The R4 answer for a return transaction status."""
+    if status == 'not_found':
         return False, "Book not found."
 
-    # try to update the return date (if the record exists)
-    update_success = update_borrow_record_return_date(patron_id, book_id, datetime.now())
-    if not update_success:
+    if status == 'no_record':
         return False, "No active borrow record found for this book."
 
-    # once returned, increase the available copies "using +1 increment"
-    availability_success = update_book_availability(book_id, +1)
-    if not availability_success:
+    if status != 'ok':
         return False, "Database error occurred while updating availability."
 
-    # calculate the late fees (if there is any)
-    fee_info = calculate_late_fee_for_book(patron_id, book_id)
-    if fee_info and fee_info.get("fee_amount", 0) > 0:
-        return True, f"Book returned with late fee: ${fee_info['fee_amount']:.2f}"
+    # calculate the late fees (if there is any) from the loan we just closed
+    days_overdue = _days_overdue(datetime.fromisoformat(record['due_date']),
+                                 datetime.fromisoformat(record['return_date']))
+    fee = calculate_late_fee(days_overdue)
+    if fee > 0:
+        return True, f"Book returned with late fee: ${fee:.2f}"
 
     # no late fees, then normal return 
     return True, "Book returned successfully."
 
 
+def _process_batch(items: List[Tuple[str, Optional[int]]], invalid_patron: str, transaction,
+                   answer) -> List[Dict]:
+    """Validate items like the single-item functions, run the valid ones as one transaction."""
+    results = [None] * len(items)
+    valid = []
+    for index, (patron_id, book_id) in enumerate(items):
+        if not patron_id or not patron_id.isdigit() or len(patron_id) != 6:
+            results[index] = (False, invalid_patron)
+        elif book_id is None:
+            results[index] = (False, "Invalid book ID.")
+        else:
+            valid.append(index)
+
+    outcomes = transaction([items[index] for index in valid]) if valid else []
+    for index, (status, row) in zip(valid, outcomes):
+        results[index] = answer(status, row)
+
+    return [{"patron_id": patron_id, "book_id": book_id, "success": success, "message": message}
+            for (patron_id, book_id), (success, message) in zip(items, results)]
+
+
+def borrow_books_batch(items: List[Tuple[str, Optional[int]]]) -> List[Dict]:
+    """
+    Borrow many books at once (self-checkout kiosks).
+    Batch interface for R3: the same checks and messages as
+    borrow_book_by_patron(), with every valid item in one transaction.
+
+    Args:
+        items: (patron_id, book_id) pairs in the order to process them;
+            book_id None for an ID that could not be parsed
+
+    Returns:
+        list: {patron_id, book_id, success, message} per item, in order
+    """
+    borrow_date = datetime.now()
+    due_date = borrow_date + timedelta(days=14)
+    return _process_batch(
+        items, "Invalid patron ID. Must be exactly 6 digits.",
+        lambda valid: borrow_books_transaction(valid, borrow_date, due_date,
+                                               max_borrowed=MAX_BORROWED_BOOKS),
+        lambda status, book: _borrow_result(status, book, due_date))
+
+
+def return_books_batch(items: List[Tuple[str, Optional[int]]]) -> List[Dict]:
+    """
+    Return many books at once (overnight book drop).
+    Batch interface for R4: the same checks and messages as
+    return_book_by_patron(), with every valid item in one transaction.
+
+    Args:
+        items: (patron_id, book_id) pairs; book_id None for an unparseable ID
+
+    Returns:
+        list: {patron_id, book_id, success, message} per item, in order
+    """
+    return_date = datetime.now()
+    return _process_batch(items, "Invalid patron ID.",
+                          lambda valid: return_books_transaction(valid, return_date),
+                          _return_result)
+
+
+def _days_overdue(due_date: datetime, as_of: datetime) -> int:
+    """Whole days past due, counted like the SQL fee engine (seconds precision)."""
+    return max((as_of.replace(microsecond=0) - due_date.replace(microsecond=0)).days, 0)
+
+
+def calculate_late_fee(days_overdue: int) -> float:
+    """
+    Tiered late fee for a number of days overdue (same rule as the SQL engine).
+
+    $0.50/day for the first 7 days, $1.00/day after that, capped at $15.00.
+    """
+    if days_overdue <= 0:
+        return 0.0
+    if days_overdue <= LATE_FEE_FIRST_DAYS:
+        fee = days_overdue * LATE_FEE_FIRST_RATE
+    else:
+        fee = (LATE_FEE_FIRST_DAYS * LATE_FEE_FIRST_RATE
+               + (days_overdue - LATE_FEE_FIRST_DAYS) * LATE_FEE_LATER_RATE)
+    return round(min(fee, LATE_FEE_CAP), 2)
+
+
 def calculate_late_fee_for_book(patron_id: str, book_id: int) -> Dict:
     """
     Calculate the late fee for a specific borrowed book.
     Implements R5: Late Fee Calculation
 
+    Uses the patron's open loan of the book, or the most recent returned
+    one if the book is already back.
+
     Args:
         patron_id: 6-digit library card ID
         book_id: ID of the borrowed book
 
     Returns:
-        dict: Contains fee_amount, days_overdue, and status message
+        dict: Contains fee_amount, days_overdue, amount_due (fee_amount less
+            what the payment ledger has settled), and status message
     """
 
-    # right now there is no db tracking, so we can simulate a book borrowed 16 days ago 
-    today = datetime.now()
-    borrow_date = today - timedelta(days=16)  # simulate 2 days overdue
-    due_date = borrow_date + timedelta(days=14)
-
-    # figure out how many days past due 
-    days_overdue = (today - due_date).days
+    if not patron_id or not patron_id.isdigit() or len(patron_id) != 6:
+        return {"fee_amount": 0.0, "days_overdue": 0, "status": "Invalid patron ID."}
 
-    # basic fee calculation logic from the requirements_specification.md file 
-    if days_overdue <= 0:
-        fee = 0.0
-    elif days_overdue <= 7:
-        fee = days_overdue * 0.5
-    else:
-        fee = (7 * 0.5) + ((days_overdue - 7) * 1.0)
-    fee = min(fee, 15.0)
+    loan = get_loan_fees([(patron_id, book_id)]).get((patron_id, book_id))
+    if not loan:
+        return {"fee_amount": 0.0, "days_overdue": 0, "status": "No borrow record found for this book."}
 
     # send back info as dictionary for the api or ui 
     return {
-        "fee_amount": round(fee, 2),
-        "days_overdue": max(days_overdue, 0),
+        "fee_amount": loan["fee_amount"],
+        "days_overdue": loan["days_overdue"],
+        "paid_amount": loan["paid_amount"],
+        "amount_due": loan["amount_due"],
+        "borrow_id": loan["id"],
+        "due_date": loan["due_date"],
+        "returned": loan["return_date"] is not None,
         "status": "Late fee calculated"
     }
 
 
+def calculate_late_fees(pairs: List[Tuple[str, int]]) -> List[Dict]:
+    """
+    Batch version of calculate_late_fee_for_book() for many (patron_id, book_id) pairs.
+
+    All pairs are priced by one set-based query; pairs without a borrow record
+    come back with a zero fee.
+
+    Returns:
+        list: One dict per input pair, in input order
+    """
+    fees = get_loan_fees(pairs)
+    results = []
+    for patron_id, book_id in pairs:
+        loan = fees.get((patron_id, book_id))
+        results.append({
+            "patron_id": patron_id,
+            "book_id": book_id,
+            "fee_amount": loan["fee_amount"] if loan else 0.0,
+            "days_overdue": loan["days_overdue"] if loan else 0,
+            "amount_due": loan["amount_due"] if loan else 0.0,
+        })
+    return results
+
+
+def get_patron_late_fees(patron_id: str) -> Dict:
+    """
+    All late fees a patron owes: those accruing on overdue loans and those
+    left unpaid on books returned late.
+
+    Returns:
+        dict: patron_id, per-book fees and total_fees, the total still due
+            after ledger payments ({} for an invalid patron ID)
+    """
+    if not patron_id or not patron_id.isdigit() or len(patron_id) != 6:
+        return {}
+
+    fees = get_outstanding_fees(patron_id)
+    return {
+        "patron_id": patron_id,
+        "fees": fees,
+        "total_fees": round(sum(fee["amount_due"] for fee in fees), 2)
+    }
+
+
 
-def search_books_in_catalog(search_term: str, search_type: str) -> List[Dict]:
+def search_books_in_catalog(search_term: str, search_type: str, limit: Optional[int] = None,
+                            offset: int = 0) -> List[Dict]:
     """
     Search for books in the catalog based on title, author, or ISBN.
     Implements R6: Book Search Functionality
 
     Args:
         search_term: The term to search for (partial or full)
-        search_type: The search category - 'title', 'author', or 'isbn'
+        search_type: The search category - 'title', 'author', 'isbn', or
+            'fulltext' (ranked, multi-word, prefix matching)
+        limit: Maximum number of results (None for all)
+        offset: Number of matching results to skip
 
     Returns:
         list: A list of dictionaries representing the matching books
     """
 
+    # title/author are case-insensitive partial matches, isbn is exact,
+    # fulltext is BM25-ranked; the filtering and paging happen in SQL
+    if search_type not in ("title", "author", "isbn", "fulltext"):
+        return []
 
-    # clean up search term and fetch everything 
-    search_term = search_term.strip().lower()
-    books = get_all_books()
-    results = []
-
-    # go through books and match depending on search type 
-    for book in books:
-        if search_type == "title" and search_term in book["title"].lower():
-            results.append(book)
-        elif search_type == "author" and search_term in book["author"].lower():
-            results.append(book)
-        elif search_type == "isbn" and search_term == book["isbn"].lower():
-            results.append(book)
-
-    # return whatever matched (or empty list)
-    return results
+    return search_books(search_term, search_type, limit=limit, offset=offset)
 
 
-def get_patron_status_report(patron_id: str) -> Dict:
+def get_patron_status_report(patron_id: str, history_limit: int = HISTORY_PAGE_SIZE,
+                             history_offset: int = 0) -> Dict:
     """
     Generate a status report for a given patron.
     Implements R7: Patron Status Report
 
     Args:
         patron_id: 6-digit library card ID of the patron
+        history_limit: Number of past loans to include, newest first
+        history_offset: Number of past loans to skip
 
     Returns:
-        dict: Includes patron ID, borrowed books, total fees, and history
+        dict: Includes patron ID, borrowed books and their count, fees owed
+            on overdue loans and late returns (returned_fees: the late-return
+            part), and a page of borrowing history with its total size ({}
+            for an invalid ID)
     """
 
 
@@ -230,17 +373,18 @@ def get_patron_status_report(patron_id: str) -> Dict:
     if not patron_id or not patron_id.isdigit() or len(patron_id) != 6:
         return {}
 
-    # since no db functions yet, just simulate a small data set 
-    borrowed_books = [{"book_id": 1, "due_date": (datetime.now() + timedelta(days=5)).strftime("%Y-%m-%d")}] # just faking one borrowed book with a due date 5 days from now 
-    total_fees = 0.0 # assume no late fees right now 
-    history = [{"book_id": 1, "borrow_date": "2025-10-01", "return_date": None}]
+    # current loans, count, fees and history come from two queries on one connection
+    status = get_patron_status(patron_id, history_limit, history_offset)
 
     # structured report to show on status page 
     return {
         "patron_id": patron_id,
-        "borrowed_books": borrowed_books,
-        "total_fees": round(total_fees, 2),
-        "history": history
+        "borrowed_books": status["borrowed_books"],
+        "borrowed_count": status["borrowed_count"],
+        "total_fees": status["total_fees"],
+        "returned_fees": status["returned_fees"],
+        "history": status["history"],
+        "history_count": status["history_count"]
     }
 
 
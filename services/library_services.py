@@ -1,22 +1,129 @@
-from typing import Tuple, Optional, Dict
+import uuid
+from typing import Tuple, Optional, Dict, List
 from services.payment_service import PaymentGateway
-from services.library_service import calculate_late_fee_for_book, get_book_by_id
+from services.library_service import calculate_late_fee_for_book, get_book_by_id, get_patron_late_fees
+from database import (
+    create_payment, settle_payment, get_payment, get_payment_by_transaction, record_payment_error,
+    payment_unsettled, get_unsettled_payments, reserve_refund, settle_refund, record_refund_error,
+    PAYMENT_PENDING, PAYMENT_COMPLETED, PAYMENT_FAILED, PAYMENT_REFUNDED
+)
 
-def pay_late_fees(patron_id: str, book_id: int, payment_gateway: PaymentGateway = None) -> Tuple[bool, str, Optional[str]]:
+
+def _charge(patron_id: str, amount: float, description: str, allocations: List[Dict],
+            idempotency_key: Optional[str], payment_gateway: Optional[PaymentGateway]) -> Tuple[bool, str, Optional[str], Dict]:
+    """
+    Charge through the gateway with the payment ledger around the call.
+
+    A pending ledger entry (with its fee allocations) is written before the
+    gateway is called and settled with its answer afterwards. A key that is
+    already in the ledger is answered from it without calling the gateway.
+
+    Returns:
+        tuple: (success, message, transaction_id, payment ledger entry)
+    """
+    created, payment = create_payment(idempotency_key or uuid.uuid4().hex, patron_id, amount,
+                                      allocations, description)
+    if not created:
+        return _ledger_answer(patron_id, payment)
+    return _send(payment, payment_gateway)
+
+
+def _send(payment: Dict, payment_gateway: Optional[PaymentGateway]) -> Tuple[bool, str, Optional[str], Dict]:
+    """
+    Send a pending ledger entry to the gateway and settle it with the answer.
+
+    Returns:
+        tuple: (success, message, transaction_id, ledger entry as it now stands)
+    """
+    # Use provided gateway or create new one
+    if payment_gateway is None:
+        payment_gateway = PaymentGateway()
+
+    # Process payment through external gateway; the ledger's key goes along,
+    # so re-sending the entry can never charge twice
+    # THIS IS WHAT YOU SHOULD MOCK IN THEIR TESTS!
+    try:
+        success, transaction_id, message = payment_gateway.process_payment(
+            patron_id=payment["patron_id"],
+            amount=payment["amount"],
+            description=payment["description"],
+            idempotency_key=payment["idempotency_key"]
+        )
+    except Exception as e:
+        # Handle payment gateway errors: the charge may or may not have gone
+        # through, so the entry stays pending until it is re-sent or reconciled
+        message = f"Payment processing error: {str(e)}"
+        record_payment_error(payment["id"], message)
+        return False, message, None, dict(payment, message=message)
+
+    if success:
+        settle_payment(payment["id"], PAYMENT_COMPLETED, transaction_id, message)
+        return (True, f"Payment successful! {message}", transaction_id,
+                dict(payment, status=PAYMENT_COMPLETED, transaction_id=transaction_id, message=message))
+    else:
+        settle_payment(payment["id"], PAYMENT_FAILED, None, message)
+        return False, f"Payment failed: {message}", None, dict(payment, status=PAYMENT_FAILED, message=message)
+
+
+def _resend_unsettled(patron_id: str, payment_gateway: Optional[PaymentGateway],
+                      book_id: Optional[int] = None) -> Optional[Tuple[bool, str, Optional[str], Dict]]:
+    """
+    Re-send the patron's payments whose outcome is unknown (optionally only
+    those covering book_id) before anything new is charged. The gateway
+    either confirms the original charge or makes it now, never both.
+
+    Returns:
+        tuple: The last answer (stopping at one that is still unsettled), or
+        None if there was nothing to re-send
+    """
+    answer = None
+    for payment in get_unsettled_payments(patron_id):
+        if book_id is not None and all(a["book_id"] != book_id for a in payment["allocations"]):
+            continue
+        answer = _send(payment, payment_gateway)
+        if answer[3]["status"] == PAYMENT_PENDING:
+            break
+    return answer
+
+
+def _ledger_answer(patron_id: str, payment: Dict) -> Tuple[bool, str, Optional[str], Dict]:
+    """The answer for a repeated submission, read from its ledger entry."""
+    if payment["patron_id"] != patron_id:
+        return False, "Idempotency key was already used for another payment.", None, payment
+
+    if payment["status"] in (PAYMENT_COMPLETED, PAYMENT_REFUNDED):
+        return True, f"Payment successful! {payment['message']}", payment["transaction_id"], payment
+
+    if payment["status"] == PAYMENT_FAILED:
+        return False, f"Payment failed: {payment['message']}", None, payment
+
+    return False, "Payment is still being processed.", None, payment
+
+
+def pay_late_fees(patron_id: str, book_id: int, payment_gateway: PaymentGateway = None,
+                  idempotency_key: Optional[str] = None,
+                  retry_pending: bool = False) -> Tuple[bool, str, Optional[str]]:
     """
     Process payment for late fees using external payment gateway.
-    
+
     NEW FEATURE FOR ASSIGNMENT 3: Demonstrates need for mocking/stubbing
     This function depends on an external payment service that should be mocked in tests.
-    
+
+    Every attempt is recorded in the payments ledger. Resubmitting with the
+    same idempotency key (e.g. after a timeout) returns the recorded result
+    instead of charging again.
+
     Args:
         patron_id: 6-digit library card ID
         book_id: ID of the book with late fees
         payment_gateway: Payment gateway instance (injectable for testing)
-        
+        idempotency_key: Client-chosen key identifying this payment request
+        retry_pending: Re-send a still-pending payment with this key to the
+            gateway (which deduplicates by key) instead of reporting it pending
+
     Returns:
         tuple: (success: bool, message: str, transaction_id: Optional[str])
-        
+
     Example for you to mock:
         # In tests, mock the payment gateway:
         mock_gateway = Mock(spec=PaymentGateway)
@@ -26,84 +133,200 @@ def pay_late_fees(patron_id: str, book_id: int, payment_gateway: PaymentGateway
     # Validate patron ID
     if not patron_id or not patron_id.isdigit() or len(patron_id) != 6:
         return False, "Invalid patron ID. Must be exactly 6 digits.", None
-    
+
+    # A repeated submission is answered from the ledger
+    payment = get_payment(idempotency_key) if idempotency_key else None
+    if payment:
+        if payment["patron_id"] == patron_id and payment["status"] == PAYMENT_PENDING and (
+                retry_pending or payment_unsettled(payment)):
+            return _send(payment, payment_gateway)[:3]
+        return _ledger_answer(patron_id, payment)[:3]
+
     # Calculate late fee first
     fee_info = calculate_late_fee_for_book(patron_id, book_id)
-    
+
     # Check if there's a fee to pay
     if not fee_info or 'fee_amount' not in fee_info:
         return False, "Unable to calculate late fees.", None
-    
-    fee_amount = fee_info.get('fee_amount', 0.0)
-    
+
+    fee_amount = fee_info.get('amount_due', fee_info.get('fee_amount', 0.0))
+
     if fee_amount <= 0:
         return False, "No late fees to pay for this book.", None
-    
+
     # Get book details for payment description
     book = get_book_by_id(book_id)
     if not book:
         return False, "Book not found.", None
-    
-    # Use provided gateway or create new one
-    if payment_gateway is None:
-        payment_gateway = PaymentGateway()
-    
-    # Process payment through external gateway
-    # THIS IS WHAT YOU SHOULD MOCK IN THEIR TESTS!
-    try:
-        success, transaction_id, message = payment_gateway.process_payment(
-            patron_id=patron_id,
-            amount=fee_amount,
-            description=f"Late fees for '{book['title']}'"
-        )
-        
-        if success:
-            return True, f"Payment successful! {message}", transaction_id
+
+    # Earlier payments for this book whose outcome is unknown go first, so
+    # the fee is never charged twice; only what they did not cover is charged
+    resent = _resend_unsettled(patron_id, payment_gateway, book_id)
+    if resent:
+        if resent[3]["status"] != PAYMENT_COMPLETED:
+            return resent[:3]
+        fee_info = calculate_late_fee_for_book(patron_id, book_id)
+        fee_amount = fee_info.get('amount_due', fee_info.get('fee_amount', 0.0))
+        if fee_amount <= 0:
+            return resent[:3]
+
+    allocation = {"borrow_id": fee_info.get("borrow_id"), "book_id": book_id, "fee_amount": fee_amount}
+    success, message, transaction_id, _ = _charge(
+        patron_id, fee_amount, f"Late fees for '{book['title']}'", [allocation],
+        idempotency_key, payment_gateway)
+    return success, message, transaction_id
+
+
+def pay_all_late_fees(patron_id: str, payment_gateway: PaymentGateway = None,
+                      idempotency_key: Optional[str] = None,
+                      retry_pending: bool = False) -> Tuple[bool, str, Optional[str], List[Dict]]:
+    """
+    Pay every outstanding late fee of a patron with one gateway charge.
+
+    Overdue loans and late returns not yet paid for are priced by one
+    query; the fees still due are charged as a single amount, recorded in
+    the payments ledger with one allocation per book, and the allocations
+    are returned.
+
+    Args:
+        patron_id: 6-digit library card ID
+        payment_gateway: Payment gateway instance (injectable for testing)
+        idempotency_key: Client-chosen key identifying this payment request
+        retry_pending: Re-send a still-pending payment with this key (see pay_late_fees)
+
+    Returns:
+        tuple: (success: bool, message: str, transaction_id: Optional[str],
+                allocations: list of {book_id, title, fee_amount})
+    """
+    # Validate patron ID
+    if not patron_id or not patron_id.isdigit() or len(patron_id) != 6:
+        return False, "Invalid patron ID. Must be exactly 6 digits.", None, []
+
+    # A repeated submission is answered from the ledger
+    payment = get_payment(idempotency_key) if idempotency_key else None
+    if payment:
+        if payment["patron_id"] == patron_id and payment["status"] == PAYMENT_PENDING and (
+                retry_pending or payment_unsettled(payment)):
+            success, message, transaction_id, payment = _send(payment, payment_gateway)
         else:
-            return False, f"Payment failed: {message}", None
-            
-    except Exception as e:
-        # Handle payment gateway errors
-        return False, f"Payment processing error: {str(e)}", None
+            success, message, transaction_id, payment = _ledger_answer(patron_id, payment)
+        return success, message, transaction_id, _allocations(payment)
+
+    # Every loan with a fee and what is still due on it in one query
+    allocations = _due_allocations(patron_id)
+    if not allocations:
+        return False, "No late fees to pay.", None, []
+
+    # Earlier payments whose outcome is unknown go first (see pay_late_fees)
+    resent = _resend_unsettled(patron_id, payment_gateway)
+    if resent:
+        if resent[3]["status"] != PAYMENT_COMPLETED:
+            return resent[0], resent[1], resent[2], _allocations(resent[3])
+        allocations = _due_allocations(patron_id)
+        if not allocations:
+            return resent[0], resent[1], resent[2], _allocations(resent[3])
+    total = round(sum(allocation["fee_amount"] for allocation in allocations), 2)
+
+    books = ", ".join(f"'{a['title']}' ${a['fee_amount']:.2f}" for a in allocations)
+    success, message, transaction_id, payment = _charge(
+        patron_id, total, f"Late fees for {len(allocations)} book(s): {books}", allocations,
+        idempotency_key, payment_gateway)
+    return success, message, transaction_id, _allocations(payment)
+
+
+def _due_allocations(patron_id: str) -> List[Dict]:
+    fees = get_patron_late_fees(patron_id)
+    return [{
+        "borrow_id": fee.get("id"),
+        "book_id": fee["book_id"],
+        "title": fee["title"],
+        "fee_amount": fee.get("amount_due", fee["fee_amount"])
+    } for fee in fees.get("fees", []) if fee.get("amount_due", fee["fee_amount"]) > 0]
 
 
-def refund_late_fee_payment(transaction_id: str, amount: float, payment_gateway: PaymentGateway = None) -> Tuple[bool, str]:
+def _allocations(payment: Dict) -> List[Dict]:
+    return [{"book_id": a["book_id"], "title": a["title"], "fee_amount": a["fee_amount"]}
+            for a in payment["allocations"]]
+
+
+def refund_late_fee_payment(transaction_id: str, amount: float, payment_gateway: PaymentGateway = None,
+                            idempotency_key: Optional[str] = None,
+                            retry_pending: bool = False) -> Tuple[bool, str]:
     """
     Refund a late fee payment (e.g., if book was returned on time but fees were charged in error).
-    
+
     NEW FEATURE FOR ASSIGNMENT 3: Another function requiring mocking
-    
+
+    Eligibility comes from the payments ledger: the transaction must be a
+    completed payment and the refunds against it may not exceed its amount.
+    Every refund is recorded in the refunds ledger before the gateway is
+    called; resubmitting with the same idempotency key returns the recorded
+    result, and re-sends a refund whose gateway call raised or never returned.
+
     Args:
         transaction_id: Original transaction ID to refund
         amount: Amount to refund
         payment_gateway: Payment gateway instance (injectable for testing)
-        
+        idempotency_key: Client-chosen key identifying this refund request
+        retry_pending: Re-send a still-pending refund with this key to the
+            gateway (which deduplicates by key) instead of reporting it pending
+
     Returns:
         tuple: (success: bool, message: str)
     """
     # Validate inputs
     if not transaction_id or not transaction_id.startswith("txn_"):
         return False, "Invalid transaction ID."
-    
+
     if amount <= 0:
         return False, "Refund amount must be greater than 0."
-    
-    if amount > 15.00:  # Maximum late fee per book
-        return False, "Refund amount exceeds maximum late fee."
-    
+
+    payment = get_payment_by_transaction(transaction_id)
+    if not payment:
+        return False, "Transaction not found in the payment ledger."
+
+    if payment["status"] not in (PAYMENT_COMPLETED, PAYMENT_REFUNDED):
+        return False, "Payment is not eligible for a refund."
+
+    # Count the refund against the payment so concurrent refunds cannot overdraw it
+    created, refund = reserve_refund(transaction_id, amount, idempotency_key or uuid.uuid4().hex)
+    if refund is None:
+        return False, "Refund amount exceeds the amount paid."
+
+    if not created:
+        if refund["transaction_id"] != transaction_id or refund["amount"] != amount:
+            return False, "Idempotency key was already used for another refund."
+        if refund["status"] == PAYMENT_COMPLETED:
+            return True, refund["message"]
+        if refund["status"] == PAYMENT_FAILED:
+            return False, f"Refund failed: {refund['message']}"
+        if not (retry_pending or payment_unsettled(refund)):
+            return False, "Refund is still being processed."
+    return _send_refund(refund, payment_gateway)
+
+
+def _send_refund(refund: Dict, payment_gateway: Optional[PaymentGateway]) -> Tuple[bool, str]:
+    """Send a pending refund to the gateway and settle it with the answer."""
     # Use provided gateway or create new one
     if payment_gateway is None:
         payment_gateway = PaymentGateway()
-    
-    # Process refund through external gateway
+
+    # Process refund through external gateway; the refund's key goes along,
+    # so re-sending it can never refund twice
     # THIS IS WHAT YOU SHOULD MOCK IN YOUR TESTS!
     try:
-        success, message = payment_gateway.refund_payment(transaction_id, amount)
-        
-        if success:
-            return True, message
-        else:
-            return False, f"Refund failed: {message}"
-            
+        success, message = payment_gateway.refund_payment(
+            refund["transaction_id"], refund["amount"], idempotency_key=refund["idempotency_key"])
     except Exception as e:
-        return False, f"Refund processing error: {str(e)}"
\ No newline at end of file
+        # The refund may have gone through: it stays pending, and counted
+        # against the payment, until it is re-sent
+        message = f"Refund processing error: {str(e)}"
+        record_refund_error(refund["id"], message)
+        return False, message
+
+    if success:
+        settle_refund(refund["id"], PAYMENT_COMPLETED, message)
+        return True, message
+    else:
+        settle_refund(refund["id"], PAYMENT_FAILED, message)
+        return False, f"Refund failed: {message}"
@@ -0,0 +1,163 @@
+"""
+Payment Jobs Module - Payments and refunds run off the request path
+
+Requests enqueue a job and get its ID back straight away; the shared
+JobQueue calls the gateway in the background, so a slow gateway holds up
+queue workers instead of web requests. Every job carries an idempotency key
+that is also sent to the gateway, which makes retrying a job that timed out
+(or was interrupted by a restart) safe.
+
+Worker settings come from the environment:
+    PAYMENT_JOB_WORKERS       concurrent gateway calls (default 4)
+    PAYMENT_JOB_MAX_ATTEMPTS  attempts before a job fails (default 5)
+    PAYMENT_JOB_BACKOFF       seconds before the first retry (default 1.0)
+"""
+
+import atexit
+import os
+import threading
+import uuid
+from typing import Callable, Dict, Optional, Tuple
+
+from database import count_jobs_by_status, get_job, get_payment, get_refund, PAYMENT_PENDING
+from services.job_queue import JobQueue, DEFAULT_WORKERS, DEFAULT_MAX_ATTEMPTS, DEFAULT_BACKOFF
+from services.library_services import pay_late_fees, pay_all_late_fees, refund_late_fee_payment
+from services.payment_service import PaymentGateway
+
+JOB_PAY_LATE_FEE = 'pay_late_fee'
+JOB_PAY_ALL_LATE_FEES = 'pay_all_late_fees'
+JOB_REFUND = 'refund'
+
+
+class PaymentNotSettledError(Exception):
+    """The gateway did not give a final answer; the job should be retried."""
+
+
+def payment_handlers(payment_gateway: Optional[PaymentGateway] = None) -> Dict[str, Callable[[Dict], Dict]]:
+    """
+    Job handlers for each payment job kind.
+
+    A payment or refund still pending in the ledger after the call (the
+    gateway was unreachable) raises PaymentNotSettledError, so the queue
+    retries it with the same key.
+    Declines are final and complete the job with success False.
+    """
+    def settled(key: str, message: str) -> None:
+        payment = get_payment(key)
+        if payment and payment["status"] == PAYMENT_PENDING:
+            raise PaymentNotSettledError(message)
+        if payment is None and message.startswith("Payment processing error"):
+            # an earlier payment re-sent first is still unsettled
+            raise PaymentNotSettledError(message)
+
+    def pay_late_fee(payload: Dict) -> Dict:
+        key = payload["idempotency_key"]
+        success, message, transaction_id = pay_late_fees(
+            payload["patron_id"], payload["book_id"], payment_gateway,
+            idempotency_key=key, retry_pending=True)
+        settled(key, message)
+        return {"success": success, "message": message, "transaction_id": transaction_id}
+
+    def pay_all(payload: Dict) -> Dict:
+        key = payload["idempotency_key"]
+        success, message, transaction_id, allocations = pay_all_late_fees(
+            payload["patron_id"], payment_gateway, idempotency_key=key, retry_pending=True)
+        settled(key, message)
+        return {"success": success, "message": message, "transaction_id": transaction_id,
+                "amount": round(sum(a["fee_amount"] for a in allocations), 2),
+                "allocations": allocations}
+
+    def refund(payload: Dict) -> Dict:
+        key = payload["idempotency_key"]
+        success, message = refund_late_fee_payment(
+            payload["transaction_id"], payload["amount"], payment_gateway,
+            idempotency_key=key, retry_pending=True)
+        pending = get_refund(key)
+        if pending and pending["status"] == PAYMENT_PENDING:
+            raise PaymentNotSettledError(message)
+        return {"success": success, "message": message}
+
+    return {JOB_PAY_LATE_FEE: pay_late_fee, JOB_PAY_ALL_LATE_FEES: pay_all, JOB_REFUND: refund}
+
+
+_queue: Optional[JobQueue] = None
+_queue_lock = threading.Lock()
+
+
+def get_payment_queue() -> JobQueue:
+    """The shared payment job queue, started on first use."""
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = JobQueue(
+                payment_handlers(),
+                workers=int(os.environ.get("PAYMENT_JOB_WORKERS", DEFAULT_WORKERS)),
+                max_attempts=int(os.environ.get("PAYMENT_JOB_MAX_ATTEMPTS", DEFAULT_MAX_ATTEMPTS)),
+                backoff=float(os.environ.get("PAYMENT_JOB_BACKOFF", DEFAULT_BACKOFF)),
+            ).start()
+        return _queue
+
+
+def payment_queue_stats() -> Dict:
+    """The shared queue's stats; only the queue depth if it has not been started."""
+    with _queue_lock:
+        queue = _queue
+    if queue is None:
+        return {"running": False, "depth": count_jobs_by_status()}
+    return queue.stats()
+
+
+def set_payment_queue(queue: Optional[JobQueue]) -> None:
+    """Replace the shared queue (e.g. with one using a test gateway); None stops it."""
+    global _queue
+    with _queue_lock:
+        previous, _queue = _queue, queue
+    if previous is not None and previous is not queue:
+        previous.stop()
+
+
+def shutdown_payment_queue() -> None:
+    """Stop the shared queue's workers (runs at exit); queued jobs stay in the database."""
+    set_payment_queue(None)
+
+
+atexit.register(shutdown_payment_queue)
+
+
+def enqueue_late_fee_payment(patron_id: str, book_id: int,
+                             idempotency_key: Optional[str] = None) -> Tuple[bool, Dict]:
+    """Queue pay_late_fees() for one book. Returns (created, job)."""
+    key = idempotency_key or uuid.uuid4().hex
+    return get_payment_queue().enqueue(JOB_PAY_LATE_FEE, {
+        "patron_id": patron_id, "book_id": book_id, "idempotency_key": key}, key)
+
+
+def enqueue_all_late_fees_payment(patron_id: str,
+                                  idempotency_key: Optional[str] = None) -> Tuple[bool, Dict]:
+    """Queue pay_all_late_fees() for a patron. Returns (created, job)."""
+    key = idempotency_key or uuid.uuid4().hex
+    return get_payment_queue().enqueue(JOB_PAY_ALL_LATE_FEES, {
+        "patron_id": patron_id, "idempotency_key": key}, key)
+
+
+def enqueue_refund(transaction_id: str, amount: float,
+                   idempotency_key: Optional[str] = None) -> Tuple[bool, Dict]:
+    """Queue refund_late_fee_payment(). Returns (created, job)."""
+    key = idempotency_key or uuid.uuid4().hex
+    return get_payment_queue().enqueue(JOB_REFUND, {
+        "transaction_id": transaction_id, "amount": amount, "idempotency_key": key}, key)
+
+
+def get_payment_job(job_id: int) -> Optional[Dict]:
+    """Public view of a payment job: its status and, once finished, its result."""
+    job = get_job(job_id)
+    if not job:
+        return None
+    return {
+        "job_id": job["id"],
+        "type": job["kind"],
+        "status": job["status"],
+        "attempts": job["attempts"],
+        "result": job["result"],
+        "error": job["error"],
+    }
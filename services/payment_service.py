@@ -1,134 +1,292 @@
 """
 Payment Service Module - External Payment Gateway Integration
-This module simulates integration with an external payment processing API.
+This module integrates with an external payment processing API.
+
+AsyncPaymentGateway is the asyncio client: every call is a non-blocking HTTP
+request over one pooled aiohttp session, so many payments can be in flight
+at once. PaymentGateway is the synchronous facade used by the rest of the
+app; it runs the async client on one shared background event loop.
+
+With no gateway URL configured (argument or PAYMENT_GATEWAY_URL) the calls
+are answered in-process by the GatewaySimulator instead.
 
 For Assignment 3: You will learn to mock this service in their tests
 since we cannot make actual payment API calls during testing.
 """
 
-import requests
-from typing import Dict, Tuple
-import time
+import asyncio
+import atexit
+import os
+import threading
+from typing import TYPE_CHECKING, Dict, Optional, Tuple
+
+from services.payment_simulator import GatewaySimulator
+
+if TYPE_CHECKING:
+    import aiohttp
+
+DEFAULT_MAX_CONNECTIONS = 100   # pooled connections per gateway
+DEFAULT_TIMEOUT = 10.0          # seconds per gateway call
+
+
+class PaymentGatewayError(Exception):
+    """The gateway could not be reached or sent back something unusable."""
+
+
+def _resolve_base_url(base_url: Optional[str]) -> Optional[str]:
+    """The gateway URL to use, or None for the in-process simulator."""
+    return (base_url or os.environ.get("PAYMENT_GATEWAY_URL") or "").rstrip("/") or None
+
+
+class AsyncPaymentGateway:
+    """
+    asyncio client for the payment gateway API.
+
+    One aiohttp session (and its connection pool) is created lazily and reused
+    for every call; close() releases it.
+
+    Example:
+        async with AsyncPaymentGateway(base_url="http://127.0.0.1:8099") as gateway:
+            results = await asyncio.gather(*(gateway.process_payment(p, 5.0) for p in patrons))
+    """
+
+    def __init__(self, api_key: str = "test_key_12345", base_url: Optional[str] = None,
+                 max_connections: int = DEFAULT_MAX_CONNECTIONS, timeout: float = DEFAULT_TIMEOUT):
+        """
+        Initialize payment gateway with API credentials.
+
+        Args:
+            api_key: API key for authentication (default is test key)
+            base_url: Gateway URL; None uses PAYMENT_GATEWAY_URL, or the
+                in-process simulator when that is unset too
+            max_connections: Size of the HTTP connection pool
+            timeout: Seconds allowed per gateway call
+        """
+        self.api_key = api_key
+        self.base_url = _resolve_base_url(base_url)
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.simulator = GatewaySimulator() if self.base_url is None else None
+        self._session = None
+
+    def _get_session(self) -> "aiohttp.ClientSession":
+        # imported on first use: aiohttp is the slowest import in the app,
+        # and the in-process simulator never needs it
+        import aiohttp
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_connections),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                headers={"Authorization": f"Bearer {self.api_key}"},
+            )
+        return self._session
+
+    async def _request(self, method: str, path: str, payload: Optional[Dict] = None,
+                       idempotency_key: Optional[str] = None) -> Dict:
+        import aiohttp
+        headers = {"Idempotency-Key": idempotency_key} if idempotency_key else None
+        try:
+            async with self._get_session().request(method, f"{self.base_url}{path}", json=payload,
+                                                   headers=headers) as response:
+                if response.status >= 500:
+                    raise PaymentGatewayError(f"Gateway error: HTTP {response.status}")
+                return await response.json()
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            raise PaymentGatewayError(f"Gateway unavailable: {e or type(e).__name__}") from e
+
+    async def process_payment(self, patron_id: str, amount: float, description: str = "",
+                              idempotency_key: Optional[str] = None) -> Tuple[bool, str, str]:
+        """
+        Charge a patron through the gateway. Retrying with the same
+        idempotency key returns the original result instead of charging twice.
+
+        Returns:
+            tuple: (success: bool, transaction_id: str, message: str)
+
+        Raises:
+            PaymentGatewayError: The gateway could not be reached
+        """
+        if self.simulator:
+            return self.simulator.charge(patron_id, amount, description, idempotency_key)
+
+        body = await self._request("POST", "/charges", {
+            "customer_id": patron_id,
+            "amount": amount,
+            "currency": "usd",
+            "description": description
+        }, idempotency_key)
+        return bool(body.get("success")), body.get("transaction_id") or "", body.get("message", "")
+
+    async def refund_payment(self, transaction_id: str, amount: float,
+                             idempotency_key: Optional[str] = None) -> Tuple[bool, str]:
+        """
+        Refund a previous payment (idempotent per key, like process_payment).
+
+        Returns:
+            tuple: (success: bool, message: str)
+
+        Raises:
+            PaymentGatewayError: The gateway could not be reached
+        """
+        if self.simulator:
+            return self.simulator.refund(transaction_id, amount, idempotency_key)
+
+        body = await self._request("POST", "/refunds", {"transaction_id": transaction_id, "amount": amount},
+                                   idempotency_key)
+        return bool(body.get("success")), body.get("message", "")
+
+    async def verify_payment_status(self, transaction_id: str) -> Dict:
+        """
+        Check the status of a payment transaction.
+
+        Returns:
+            dict: Payment status information
+
+        Raises:
+            PaymentGatewayError: The gateway could not be reached
+        """
+        if self.simulator:
+            return self.simulator.status(transaction_id)
+
+        return await self._request("GET", f"/charges/{transaction_id}")
+
+    async def close(self) -> None:
+        """Close the pooled HTTP session."""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+
+# One event loop thread runs every synchronous call, so all PaymentGateway
+# instances for the same gateway share one async client and connection pool.
+_loop = None
+_clients: Dict[Tuple[Optional[str], str], AsyncPaymentGateway] = {}
+_lock = threading.Lock()
+
+
+def _get_loop() -> asyncio.AbstractEventLoop:
+    global _loop
+    with _lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="payment-gateway", daemon=True).start()
+        return _loop
+
+
+def _shared_client(api_key: str, base_url: Optional[str]) -> AsyncPaymentGateway:
+    key = (_resolve_base_url(base_url), api_key)
+    with _lock:
+        if key not in _clients:
+            _clients[key] = AsyncPaymentGateway(api_key, key[0])
+        return _clients[key]
+
+
+def close_payment_clients() -> None:
+    """Close the shared sessions and stop the background loop (runs at exit)."""
+    global _loop
+    with _lock:
+        loop, clients = _loop, list(_clients.values())
+        _loop = None
+        _clients.clear()
+    if loop is None:
+        return
+    for client in clients:
+        asyncio.run_coroutine_threadsafe(client.close(), loop).result()
+    loop.call_soon_threadsafe(loop.stop)
+
+
+atexit.register(close_payment_clients)
 
 
 class PaymentGateway:
     """
-    Simulates an external payment gateway API.
+    Synchronous payment gateway API used by the library services.
     In production, this would connect to services like Stripe, PayPal, etc.
-    
+
+    Each call is run by the shared AsyncPaymentGateway on a background event
+    loop: the caller waits for its own result, but the network I/O of every
+    concurrent caller is multiplexed over one pooled session.
+
     For testing purposes, you should MOCK this class to avoid:
     - Making actual API calls
     - Depending on external service availability
     - Incurring costs or rate limits
     """
-    
-    def __init__(self, api_key: str = "test_key_12345"):
+
+    def __init__(self, api_key: str = "test_key_12345", base_url: Optional[str] = None):
         """
         Initialize payment gateway with API credentials.
-        
+
         Args:
             api_key: API key for authentication (default is test key)
+            base_url: Gateway URL; None uses PAYMENT_GATEWAY_URL, or the
+                in-process simulator when that is unset too
         """
         self.api_key = api_key
-        self.base_url = "https://api.payment-gateway.example.com"
-    
-    def process_payment(self, patron_id: str, amount: float, description: str = "") -> Tuple[bool, str, str]:
+        self.client = _shared_client(api_key, base_url)
+        self.base_url = self.client.base_url
+
+    def _run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, _get_loop()).result(self.client.timeout + 1)
+
+    def process_payment(self, patron_id: str, amount: float, description: str = "",
+                        idempotency_key: Optional[str] = None) -> Tuple[bool, str, str]:
         """
         Process a payment through the external gateway.
-        
+
         WARNING: This makes an actual HTTP request to external service.
         You should MOCK this method in tests!
-        
+
         Args:
             patron_id: 6-digit patron/customer ID
             amount: Payment amount in dollars
             description: Payment description
-            
+            idempotency_key: Retries with the same key are not charged twice
+
         Returns:
             tuple: (success: bool, transaction_id: str, message: str)
-            
+
         Example:
             gateway = PaymentGateway()
             success, txn_id, msg = gateway.process_payment("123456", 10.50, "Late fees")
         """
-        # Simulate API call delay
-        time.sleep(0.5)
-        
-        # In a real implementation, this would make an HTTP request:
-        # response = requests.post(
-        #     f"{self.base_url}/charges",
-        #     headers={"Authorization": f"Bearer {self.api_key}"},
-        #     json={
-        #         "customer_id": patron_id,
-        #         "amount": amount,
-        #         "currency": "usd",
-        #         "description": description
-        #     }
-        # )
-        
-        # For this template, we simulate different scenarios based on amount
-        # This allows testing without a real API
-        
-        if amount <= 0:
-            return False, "", "Invalid amount: must be greater than 0"
-        
-        if amount > 1000:
-            return False, "", "Payment declined: amount exceeds limit"
-        
-        if len(patron_id) != 6:
-            return False, "", "Invalid patron ID format"
-        
-        # Simulate successful payment
-        transaction_id = f"txn_{patron_id}_{int(time.time())}"
-        return True, transaction_id, f"Payment of ${amount:.2f} processed successfully"
-    
-    def refund_payment(self, transaction_id: str, amount: float) -> Tuple[bool, str]:
+        return self._run(self.client.process_payment(patron_id, amount, description, idempotency_key))
+
+    def refund_payment(self, transaction_id: str, amount: float,
+                       idempotency_key: Optional[str] = None) -> Tuple[bool, str]:
         """
         Refund a previous payment.
-        
+
         WARNING: This makes an actual HTTP request to external service.
         You should MOCK this method in tests!
-        
+
         Args:
             transaction_id: Original transaction ID to refund
             amount: Amount to refund
-            
+            idempotency_key: Retries with the same key are not refunded twice
+
         Returns:
             tuple: (success: bool, message: str)
         """
-        time.sleep(0.5)
-        
-        if not transaction_id or not transaction_id.startswith("txn_"):
-            return False, "Invalid transaction ID"
-        
-        if amount <= 0:
-            return False, "Invalid refund amount"
-        
-        refund_id = f"refund_{transaction_id}_{int(time.time())}"
-        return True, f"Refund of ${amount:.2f} processed successfully. Refund ID: {refund_id}"
-    
+        return self._run(self.client.refund_payment(transaction_id, amount, idempotency_key))
+
     def verify_payment_status(self, transaction_id: str) -> Dict:
         """
         Check the status of a payment transaction.
-        
+
         WARNING: This makes an actual HTTP request to external service.
         You should MOCK this method in tests!
-        
+
         Args:
             transaction_id: Transaction ID to check
-            
+
         Returns:
             dict: Payment status information
         """
-        time.sleep(0.3)
-        
-        if not transaction_id or not transaction_id.startswith("txn_"):
-            return {"status": "not_found", "message": "Transaction not found"}
-        
-        # Simulate status check
-        return {
-            "transaction_id": transaction_id,
-            "status": "completed",
-            "amount": 10.50,
-            "timestamp": time.time()
-        }
\ No newline at end of file
+        return self._run(self.client.verify_payment_status(transaction_id))
@@ -0,0 +1,197 @@
+"""
+Payment Simulator Module - A stand-in for the external payment gateway
+
+GatewaySimulator holds the gateway's business rules (amount limits, patron ID
+format, transaction IDs). PaymentGateway uses it directly when no gateway URL
+is configured, and StubGatewayServer serves it over HTTP, with configurable
+latency, so the real HTTP client can be tested and benchmarked locally.
+
+Run a stub gateway for development:
+    python -m services.payment_simulator --port 8099 --latency 0.5
+"""
+
+import argparse
+import asyncio
+import secrets
+import threading
+import time
+from typing import TYPE_CHECKING, Dict, Optional, Tuple
+
+if TYPE_CHECKING:
+    from aiohttp import web
+
+
+class GatewaySimulator:
+    """
+    The gateway's rules, with an in-memory record of charges and refunds.
+
+    A request carrying an idempotency key that was seen before gets the
+    original reply again instead of being processed twice.
+    """
+
+    def __init__(self):
+        self.charges: Dict[str, float] = {}
+        self.refunds: Dict[str, float] = {}
+        self.requests = 0
+        self._replies: Dict[str, tuple] = {}
+
+    def charge(self, patron_id: str, amount: float, description: str = "",
+               idempotency_key: Optional[str] = None) -> Tuple[bool, str, str]:
+        self.requests += 1
+        if idempotency_key in self._replies:
+            return self._replies[idempotency_key]
+        reply = self._charge(patron_id, amount)
+        if idempotency_key:
+            self._replies[idempotency_key] = reply
+        return reply
+
+    def _charge(self, patron_id: str, amount: float) -> Tuple[bool, str, str]:
+        if amount <= 0:
+            return False, "", "Invalid amount: must be greater than 0"
+
+        if amount > 1000:
+            return False, "", "Payment declined: amount exceeds limit"
+
+        if len(patron_id) != 6:
+            return False, "", "Invalid patron ID format"
+
+        transaction_id = f"txn_{patron_id}_{int(time.time())}_{secrets.token_hex(4)}"
+        self.charges[transaction_id] = amount
+        return True, transaction_id, f"Payment of ${amount:.2f} processed successfully"
+
+    def refund(self, transaction_id: str, amount: float,
+               idempotency_key: Optional[str] = None) -> Tuple[bool, str]:
+        self.requests += 1
+        if idempotency_key in self._replies:
+            return self._replies[idempotency_key]
+        reply = self._refund(transaction_id, amount)
+        if idempotency_key:
+            self._replies[idempotency_key] = reply
+        return reply
+
+    def _refund(self, transaction_id: str, amount: float) -> Tuple[bool, str]:
+        if not transaction_id or not transaction_id.startswith("txn_"):
+            return False, "Invalid transaction ID"
+
+        if amount <= 0:
+            return False, "Invalid refund amount"
+
+        refund_id = f"refund_{transaction_id}_{int(time.time())}"
+        self.refunds[transaction_id] = self.refunds.get(transaction_id, 0.0) + amount
+        return True, f"Refund of ${amount:.2f} processed successfully. Refund ID: {refund_id}"
+
+    def status(self, transaction_id: str) -> Dict:
+        self.requests += 1
+        if not transaction_id or not transaction_id.startswith("txn_"):
+            return {"status": "not_found", "message": "Transaction not found"}
+
+        return {
+            "transaction_id": transaction_id,
+            "status": "completed",
+            "amount": self.charges.get(transaction_id),
+            "timestamp": time.time()
+        }
+
+
+def create_stub_app(simulator: GatewaySimulator, latency: float = 0.0) -> "web.Application":
+    """
+    aiohttp application speaking the gateway's HTTP API:
+    POST /charges, POST /refunds (both honouring an Idempotency-Key header)
+    and GET /charges/<transaction_id>.
+    """
+    # the app imports this module for GatewaySimulator; only the stub needs aiohttp
+    from aiohttp import web
+
+    async def charges(request):
+        body = await request.json()
+        await asyncio.sleep(latency)
+        success, transaction_id, message = simulator.charge(
+            str(body.get("customer_id", "")), float(body.get("amount", 0)), body.get("description", ""),
+            request.headers.get("Idempotency-Key"))
+        return web.json_response({"success": success, "transaction_id": transaction_id,
+                                  "message": message}, status=200 if success else 402)
+
+    async def refunds(request):
+        body = await request.json()
+        await asyncio.sleep(latency)
+        success, message = simulator.refund(str(body.get("transaction_id", "")),
+                                            float(body.get("amount", 0)),
+                                            request.headers.get("Idempotency-Key"))
+        return web.json_response({"success": success, "message": message},
+                                 status=200 if success else 402)
+
+    async def charge_status(request):
+        await asyncio.sleep(latency)
+        result = simulator.status(request.match_info["transaction_id"])
+        return web.json_response(result, status=404 if result["status"] == "not_found" else 200)
+
+    app = web.Application()
+    app.router.add_post("/charges", charges)
+    app.router.add_post("/refunds", refunds)
+    app.router.add_get("/charges/{transaction_id}", charge_status)
+    return app
+
+
+class StubGatewayServer:
+    """
+    Runs the stub gateway on 127.0.0.1 in a background thread.
+
+    Example:
+        with StubGatewayServer(latency=0.05) as server:
+            gateway = PaymentGateway(base_url=server.url)
+    """
+
+    def __init__(self, latency: float = 0.0, port: int = 0,
+                 simulator: Optional[GatewaySimulator] = None):
+        self.latency = latency
+        self.port = port
+        self.simulator = simulator or GatewaySimulator()
+        self.url = None
+        self._loop = None
+        self._runner = None
+        self._thread = None
+
+    def start(self) -> "StubGatewayServer":
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="stub-gateway", daemon=True)
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(self._start(), self._loop).result()
+        return self
+
+    async def _start(self):
+        from aiohttp import web
+        self._runner = web.AppRunner(create_stub_app(self.simulator, self.latency))
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", self.port, backlog=1024)
+        await site.start()
+        self.port = self._runner.addresses[0][1]
+        self.url = f"http://127.0.0.1:{self.port}"
+
+    def stop(self) -> None:
+        if self._loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self._loop = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local stub payment gateway.")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--latency", type=float, default=0.5, help="seconds added to every call")
+    args = parser.parse_args()
+
+    from aiohttp import web
+    web.run_app(create_stub_app(GatewaySimulator(), args.latency), host="127.0.0.1", port=args.port)
+
+
+if __name__ == "__main__":
+    main()
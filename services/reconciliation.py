@@ -0,0 +1,124 @@
+"""
+Reconciliation Module - Check the payment ledger against the gateway
+
+Every transaction is looked up with verify_payment_status() by a pool of
+asyncio workers sharing one pooled gateway session, so --workers lookups are
+in flight at once instead of one after another; an optional rate limit caps
+the calls per second the gateway sees. Results are written back to the
+ledger (payments.gateway_status / reconciled_at) in batched transactions.
+
+Run from the CLI:
+    flask --app app reconcile-payments --unreconciled --workers 100 --rate-limit 500
+"""
+
+import asyncio
+import time
+from typing import Dict, Iterable, List, Optional
+
+from database import (
+    get_payment_statuses, record_reconciliation, PAYMENT_COMPLETED, PAYMENT_REFUNDED
+)
+from services.payment_service import AsyncPaymentGateway, PaymentGatewayError
+
+DEFAULT_WORKERS = 50
+DEFAULT_BATCH_SIZE = 500
+
+# Ledger statuses for which the gateway should hold a charge
+_CHARGED = (PAYMENT_COMPLETED, PAYMENT_REFUNDED)
+_GATEWAY_CHARGED = ('completed', 'refunded')
+
+
+class _RateLimiter:
+    """Spaces calls at least 1/rate seconds apart across all workers."""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate
+        self._next = time.monotonic()
+
+    async def wait(self) -> None:
+        now = time.monotonic()
+        slot = max(now, self._next)
+        self._next = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+async def _verify_all(transaction_ids: List[str], gateway: AsyncPaymentGateway, workers: int,
+                      rate_limit: Optional[float], batch_size: int, report: Dict) -> Dict[str, str]:
+    pending = iter(transaction_ids)
+    limiter = _RateLimiter(rate_limit) if rate_limit else None
+    statuses, batch = {}, []
+
+    def flush():
+        if batch:
+            rows = batch[:]
+            batch.clear()
+            report['updated'] += record_reconciliation(rows)
+
+    async def worker():
+        # every worker pulls from the same iterator until it runs dry
+        for transaction_id in pending:
+            if limiter:
+                await limiter.wait()
+            try:
+                result = await gateway.verify_payment_status(transaction_id)
+            except PaymentGatewayError as e:
+                report['errors'].append({'transaction_id': transaction_id, 'error': str(e)})
+                continue
+            statuses[transaction_id] = result.get('status', 'unknown')
+            batch.append((transaction_id, statuses[transaction_id]))
+            if len(batch) >= batch_size:
+                flush()
+
+    await asyncio.gather(*(worker() for _ in range(max(1, min(workers, len(transaction_ids))))))
+    flush()
+    return statuses
+
+
+def reconcile_payments(transaction_ids: Iterable[str], workers: int = DEFAULT_WORKERS,
+                       rate_limit: Optional[float] = None, batch_size: int = DEFAULT_BATCH_SIZE,
+                       gateway: Optional[AsyncPaymentGateway] = None) -> Dict:
+    """
+    Verify transactions with the gateway and record its answers in the ledger.
+
+    Args:
+        transaction_ids: Transactions to check (e.g. get_unreconciled_transactions())
+        workers: Gateway lookups in flight at once
+        rate_limit: Most lookups per second, or None for no limit
+        batch_size: Ledger rows written per transaction
+        gateway: Async gateway client (its session is closed afterwards);
+            default uses PAYMENT_GATEWAY_URL
+
+    Returns:
+        dict: checked, updated (ledger rows written), matched, mismatched
+        (ledger and gateway disagree on whether a charge exists),
+        errors (lookups that failed; left unreconciled) and seconds
+    """
+    transaction_ids = list(dict.fromkeys(transaction_ids))
+    report = {'checked': 0, 'updated': 0, 'matched': 0, 'mismatched': [], 'errors': [], 'seconds': 0.0}
+    if not transaction_ids:
+        return report
+
+    async def run():
+        client = gateway or AsyncPaymentGateway(max_connections=workers)
+        try:
+            return await _verify_all(transaction_ids, client, workers, rate_limit, batch_size, report)
+        finally:
+            # the session belongs to this event loop; the client opens a new one on next use
+            await client.close()
+
+    start = time.perf_counter()
+    statuses = asyncio.run(run())
+    report['seconds'] = time.perf_counter() - start
+
+    ledger = get_payment_statuses(list(statuses))
+    for transaction_id, gateway_status in statuses.items():
+        ledger_status = ledger.get(transaction_id)
+        if (ledger_status in _CHARGED) == (gateway_status in _GATEWAY_CHARGED):
+            report['matched'] += 1
+        else:
+            report['mismatched'].append({'transaction_id': transaction_id,
+                                         'ledger_status': ledger_status,
+                                         'gateway_status': gateway_status})
+    report['checked'] = len(statuses)
+    return report
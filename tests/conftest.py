@@ -0,0 +1,39 @@
+import pytest
+
+import database
+
+
+@pytest.fixture
+def temp_db(tmp_path, monkeypatch):
+    """Point database.DATABASE at a fresh, initialized file for one test."""
+    monkeypatch.setattr(database, "DATABASE", str(tmp_path / "library.db"))
+    database.configure_pool(size=database.DEFAULT_POOL_SIZE,
+                            timeout=database.DEFAULT_POOL_TIMEOUT,
+                            profile=database.DEFAULT_PROFILE)
+    database.init_database()
+    yield database.DATABASE
+    database.close_pool()
+
+
+@pytest.fixture
+def sample_data(temp_db):
+    """The demo books and loan that `flask --app app load-sample-data` adds."""
+    database.add_sample_data()
+
+
+@pytest.fixture
+def seed_books(temp_db):
+    """Return a helper that inserts catalog-shaped book dicts into temp_db."""
+    def seed(books):
+        for book in books:
+            database.insert_book(book["title"], book["author"], book["isbn"],
+                                 book["total_copies"], book["available_copies"])
+    return seed
+
+
+@pytest.fixture
+def stub_gateway():
+    """A local stub payment gateway over HTTP (no artificial latency)."""
+    from services.payment_simulator import StubGatewayServer
+    with StubGatewayServer() as server:
+        yield server
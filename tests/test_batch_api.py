@@ -0,0 +1,86 @@
+import time
+
+import pytest
+
+import database
+from app import create_app
+from services.library_service import MAX_BORROWED_BOOKS
+
+
+@pytest.fixture
+def client(temp_db):
+    return create_app().test_client()
+
+
+def _add_book(isbn, copies):
+    database.insert_book(f"Batch Book {isbn}", "Author", isbn, copies, copies)
+    return database.get_book_by_isbn(isbn)["id"]
+
+
+def _items(pairs):
+    return {"items": [{"patron_id": patron_id, "book_id": book_id} for patron_id, book_id in pairs]}
+
+
+def test_borrow_batch_reports_each_item(client):
+    one_copy = _add_book("9500000000001", 1)
+    many = _add_book("9500000000002", 10)
+
+    response = client.post("/api/borrow/batch", json=_items([
+        ("111111", one_copy),
+        ("222222", one_copy),           # taken by the item before
+        ("12345", many),
+        ("111111", "abc"),
+        ("111111", 99999),
+    ] + [("333333", many)] * (MAX_BORROWED_BOOKS + 1)))
+
+    body = response.get_json()
+    messages = [result["message"] for result in body["results"]]
+    assert response.status_code == 200
+    assert messages[0].startswith('Successfully borrowed "Batch Book 9500000000001"')
+    assert messages[1:5] == ["This book is currently not available.",
+                             "Invalid patron ID. Must be exactly 6 digits.",
+                             "Invalid book ID.",
+                             "Book not found."]
+    assert messages[-1] == f"You have reached the maximum borrowing limit of {MAX_BORROWED_BOOKS} books."
+    assert (body["succeeded"], body["failed"]) == (1 + MAX_BORROWED_BOOKS, 5)
+    assert database.get_book_by_id(many)["available_copies"] == 10 - MAX_BORROWED_BOOKS
+    assert database.get_patron_borrow_count("333333") == MAX_BORROWED_BOOKS
+
+
+def test_return_batch_reports_each_item(client):
+    book_id = _add_book("9500000000003", 2)
+    client.post("/api/borrow/batch", json=_items([("111111", book_id)]))
+
+    body = client.post("/api/return/batch", json=_items([
+        ("111111", book_id), ("111111", book_id), ("1", book_id)])).get_json()
+
+    assert [result["message"] for result in body["results"]] == [
+        "Book returned successfully.",
+        "No active borrow record found for this book.",
+        "Invalid patron ID.",
+    ]
+    assert database.get_book_by_id(book_id)["available_copies"] == 2
+
+
+def test_malformed_batches_are_rejected(client):
+    assert client.post("/api/borrow/batch", json={"items": []}).status_code == 400
+    assert client.post("/api/borrow/batch", json={"items": ["111111"]}).status_code == 400
+    assert client.post("/api/return/batch", data="not json").status_code == 400
+    too_many = _items([("111111", 1)] * 1001)
+    assert client.post("/api/return/batch", json=too_many).status_code == 400
+
+
+def test_book_drop_of_500_clears_quickly(client):
+    database.insert_books_bulk([(f"Drop {n}", "Author", f"96{n:011d}", 1) for n in range(500)])
+    ids = [book["id"] for book in database.get_all_books() if book["title"].startswith("Drop")]
+    loans = [(f"{100000 + n // MAX_BORROWED_BOOKS}", book_id) for n, book_id in enumerate(ids)]
+    assert client.post("/api/borrow/batch", json=_items(loans)).get_json()["succeeded"] == 500
+
+    start = time.perf_counter()
+    body = client.post("/api/return/batch", json=_items(loans)).get_json()
+    elapsed = time.perf_counter() - start
+
+    assert body["succeeded"] == 500
+    assert elapsed < 1.0
+    assert all(book["available_copies"] == 1 for book in database.get_all_books()
+               if book["title"].startswith("Drop"))
@@ -0,0 +1,11 @@
+import random
+
+from benchmarks import suite
+
+
+def test_every_public_function_has_a_micro_benchmark(temp_db):
+    suite.seed(100, 400)
+
+    names = [name for name, call, cap in suite._micro_cases(100, 10, random.Random(7))]
+
+    assert suite.not_benchmarked(names) == []
@@ -74,27 +74,27 @@ def _fake_books():
 
 def test_catalog_not_empty(mocker):
     fake = _fake_books()
-    mocker.patch("services.library_service.get_all_books", return_value=fake)
+    mocker.patch("database.get_all_books", return_value=fake)
     assert len(fake) > 0
 
 
 def test_catalog_fields_present(mocker):
     fake = _fake_books()
-    mocker.patch("services.library_service.get_all_books", return_value=fake)
+    mocker.patch("database.get_all_books", return_value=fake)
     book = fake[0]
     assert "title" in book and "author" in book and "isbn" in book
 
 
 def test_catalog_available_not_negative(mocker):
     fake = _fake_books()
-    mocker.patch("services.library_service.get_all_books", return_value=fake)
+    mocker.patch("database.get_all_books", return_value=fake)
     for b in fake:
         assert b["available_copies"] >= 0
 
 
 def test_catalog_available_not_exceed_total(mocker):
     fake = _fake_books()
-    mocker.patch("services.library_service.get_all_books", return_value=fake)
+    mocker.patch("database.get_all_books", return_value=fake)
     for b in fake:
         assert b["available_copies"] <= b["total_copies"]
 
@@ -105,10 +105,8 @@ def test_catalog_available_not_exceed_total(mocker):
 def test_borrow_valid_book(mocker):
     fake_book = {"id": 1, "title": "X", "available_copies": 1}
 
-    mocker.patch("services.library_service.get_patron_borrow_count", return_value=0)
-    mocker.patch("services.library_service.get_book_by_id", return_value=fake_book)
-    mocker.patch("services.library_service.insert_borrow_record", return_value=True)
-    mocker.patch("services.library_service.update_book_availability", return_value=True)
+    mocker.patch("services.library_service.borrow_book_transaction",
+                 return_value=("ok", fake_book))
 
     success, msg = borrow_book_by_patron("123456", 1)
     assert success is True
@@ -121,9 +119,8 @@ def test_borrow_invalid_patron_id():
 
 
 def test_borrow_unavailable_book(mocker):
-    mocker.patch("services.library_service.get_patron_borrow_count", return_value=0)
-    mocker.patch("services.library_service.get_book_by_id",
-                 return_value={"id": 1, "available_copies": 0})
+    mocker.patch("services.library_service.borrow_book_transaction",
+                 return_value=("unavailable", {"id": 1, "available_copies": 0}))
 
     success, msg = borrow_book_by_patron("123456", 1)
     assert success is False
@@ -133,12 +130,8 @@ def test_borrow_unavailable_book(mocker):
 def test_borrow_over_limit(mocker):
     fake_book = {"id": 1, "title": "X", "available_copies": 5}
 
-    mocker.patch("services.library_service.get_book_by_id", return_value=fake_book)
-    mocker.patch("services.library_service.insert_borrow_record", return_value=True)
-    mocker.patch("services.library_service.update_book_availability", return_value=True)
-
-    mocker.patch("services.library_service.get_patron_borrow_count",
-                 side_effect=[0, 1, 2, 3, 4, 5])
+    mocker.patch("services.library_service.borrow_book_transaction",
+                 side_effect=[("ok", fake_book)] * 5 + [("limit", None)])
 
     for _ in range(5):
         borrow_book_by_patron("654321", 1)
@@ -149,8 +142,8 @@ def test_borrow_over_limit(mocker):
 
 
 def test_borrow_invalid_book_id(mocker):
-    mocker.patch("services.library_service.get_patron_borrow_count", return_value=0)
-    mocker.patch("services.library_service.get_book_by_id", return_value=None)
+    mocker.patch("services.library_service.borrow_book_transaction",
+                 return_value=("not_found", None))
 
     s, msg = borrow_book_by_patron("123456", 9999)
     assert s is False
@@ -160,27 +153,28 @@ def test_borrow_invalid_book_id(mocker):
 # R4 – RETURN PROCESSING
 # ------------------------------------------------------------------------------
 
+def _closed_loan(days_late):
+    returned = datetime.now()
+    due = returned - timedelta(days=days_late)
+    return {"book_id": 1, "due_date": due.isoformat(), "return_date": returned.isoformat()}
+
+
 def test_return_valid(mocker):
-    mocker.patch("services.library_service.get_patron_borrow_count", return_value=0)
-    mocker.patch("services.library_service.get_book_by_id",
-                 return_value={"id": 1, "title": "Book", "available_copies": 1})
-    mocker.patch("services.library_service.insert_borrow_record", return_value=True)
-    mocker.patch("services.library_service.update_book_availability", return_value=True)
+    mocker.patch("services.library_service.borrow_book_transaction",
+                 return_value=("ok", {"id": 1, "title": "Book", "available_copies": 1}))
 
     borrow_book_by_patron("111111", 1)
 
-    mocker.patch("services.library_service.update_borrow_record_return_date",
-                 return_value=True)
+    mocker.patch("services.library_service.return_book_transaction",
+                 return_value=("ok", _closed_loan(days_late=0)))
 
     s, msg = return_book_by_patron("111111", 1)
     assert isinstance(s, bool)
 
 
 def test_return_not_borrowed(mocker):
-    mocker.patch("services.library_service.get_book_by_id",
-                 return_value={"id": 2, "title": "T", "available_copies": 1})
-    mocker.patch("services.library_service.update_borrow_record_return_date",
-                 return_value=False)
+    mocker.patch("services.library_service.return_book_transaction",
+                 return_value=("no_record", None))
 
     s, msg = return_book_by_patron("222222", 2)
     assert s is False
@@ -188,28 +182,33 @@ def test_return_not_borrowed(mocker):
 
 
 def test_return_twice(mocker):
-    mocker.patch("services.library_service.get_patron_borrow_count", return_value=0)
-    mocker.patch("services.library_service.get_book_by_id",
-                 return_value={"id": 1, "title": "Book", "available_copies": 1})
-    mocker.patch("services.library_service.insert_borrow_record", return_value=True)
-    mocker.patch("services.library_service.update_book_availability", return_value=True)
+    mocker.patch("services.library_service.borrow_book_transaction",
+                 return_value=("ok", {"id": 1, "title": "Book", "available_copies": 1}))
     borrow_book_by_patron("333333", 1)
 
-    mocker.patch("services.library_service.update_borrow_record_return_date",
-                 return_value=True)
-    mocker.patch("services.library_service.get_book_by_id",
-                 return_value={"id": 1, "available_copies": 0})
+    mocker.patch("services.library_service.return_book_transaction",
+                 return_value=("ok", _closed_loan(days_late=0)))
     assert return_book_by_patron("333333", 1)[0] is True
 
-    mocker.patch("services.library_service.update_borrow_record_return_date",
-                 return_value=False)
+    mocker.patch("services.library_service.return_book_transaction",
+                 return_value=("no_record", None))
     s, msg = return_book_by_patron("333333", 1)
     assert s is False
     assert "no active borrow" in msg.lower()
 
 
+def test_return_late_reports_fee(mocker):
+    mocker.patch("services.library_service.return_book_transaction",
+                 return_value=("ok", _closed_loan(days_late=10)))
+
+    s, msg = return_book_by_patron("123456", 1)
+    assert s is True
+    assert "$6.50" in msg
+
+
 def test_return_invalid_book_id(mocker):
-    mocker.patch("services.library_service.get_book_by_id", return_value=None)
+    mocker.patch("services.library_service.return_book_transaction",
+                 return_value=("not_found", None))
 
     s, msg = return_book_by_patron("123456", 9999)
     assert s is False
@@ -238,14 +237,14 @@ def test_late_fee_max_cap():
 # R6 – SEARCH
 # ------------------------------------------------------------------------------
 
-def test_search_by_title_partial(mocker):
+def test_search_by_title_partial(seed_books):
     fake_books = [
         {"id": 1, "title": "The Great Gatsby", "author": "F. Scott Fitzgerald", "isbn": "9780743273565", "total_copies": 3, "available_copies": 1},
         {"id": 2, "title": "Great Expectations", "author": "Charles Dickens", "isbn": "9780141439563", "total_copies": 2, "available_copies": 2},
         {"id": 3, "title": "Clean Code", "author": "Robert C. Martin", "isbn": "9780132350884", "total_copies": 4, "available_copies": 4},
     ]
-    # Patch service-layer dependency
-    mocker.patch("services.library_service.get_all_books", return_value=fake_books)
+    # Seed a throwaway database instead of the real catalog
+    seed_books(fake_books)
 
     results = search_books_in_catalog("great", "title")
     assert isinstance(results, list)
@@ -253,13 +252,13 @@ def test_search_by_title_partial(mocker):
     assert all("great" in b["title"].lower() for b in results)
 
 
-def test_search_by_author_partial(mocker):
+def test_search_by_author_partial(seed_books):
     fake_books = [
         {"id": 1, "title": "Dune", "author": "Frank Herbert", "isbn": "9780441172719", "total_copies": 5, "available_copies": 3},
         {"id": 2, "title": "It", "author": "Stephen King", "isbn": "9781501142970", "total_copies": 2, "available_copies": 2},
         {"id": 3, "title": "Misery", "author": "Stephen King", "isbn": "9780450417399", "total_copies": 2, "available_copies": 1},
     ]
-    mocker.patch("services.library_service.get_all_books", return_value=fake_books)
+    seed_books(fake_books)
 
     results = search_books_in_catalog("king", "author")
     assert isinstance(results, list)
@@ -267,12 +266,12 @@ def test_search_by_author_partial(mocker):
     assert all("king" in b["author"].lower() for b in results)
 
 
-def test_search_by_isbn_exact(mocker):
+def test_search_by_isbn_exact(seed_books):
     fake_books = [
         {"id": 1, "title": "Book A", "author": "A", "isbn": "9780451524935", "total_copies": 1, "available_copies": 1},
         {"id": 2, "title": "Book B", "author": "B", "isbn": "1234567890123", "total_copies": 2, "available_copies": 2},
     ]
-    mocker.patch("services.library_service.get_all_books", return_value=fake_books)
+    seed_books(fake_books)
 
     results = search_books_in_catalog("9780451524935", "isbn")
     assert isinstance(results, list)
@@ -280,12 +279,12 @@ def test_search_by_isbn_exact(mocker):
     assert results[0]["isbn"] == "9780451524935"
 
 
-def test_search_no_results(mocker):
+def test_search_no_results(seed_books):
     fake_books = [
         {"id": 1, "title": "Operating Systems", "author": "Silberschatz", "isbn": "1111111111111", "total_copies": 3, "available_copies": 2},
         {"id": 2, "title": "Computer Networks", "author": "Tanenbaum", "isbn": "2222222222222", "total_copies": 2, "available_copies": 2},
     ]
-    mocker.patch("services.library_service.get_all_books", return_value=fake_books)
+    seed_books(fake_books)
 
     results = search_books_in_catalog("nonexistentbooktitle", "title")
     assert results == []
@@ -295,20 +294,17 @@ def test_search_no_results(mocker):
 # R7 – PATRON STATUS
 # ------------------------------------------------------------------------------
 
-def test_patron_status_structure():
+def test_patron_status_structure(temp_db):
     assert isinstance(get_patron_status_report("123456"), dict)
 
 
-def test_patron_status_no_borrows():
+def test_patron_status_no_borrows(temp_db):
     assert isinstance(get_patron_status_report("999999"), dict)
 
 
-def test_patron_status_with_borrow(mocker):
-    mocker.patch("services.library_service.get_patron_borrow_count", return_value=0)
-    mocker.patch("services.library_service.get_book_by_id",
-                 return_value={"id": 1, "title": "X", "available_copies": 1})
-    mocker.patch("services.library_service.insert_borrow_record", return_value=True)
-    mocker.patch("services.library_service.update_book_availability", return_value=True)
+def test_patron_status_with_borrow(temp_db, mocker):
+    mocker.patch("services.library_service.borrow_book_transaction",
+                 return_value=("ok", {"id": 1, "title": "X", "available_copies": 1}))
 
     borrow_book_by_patron("888888", 1)
 
@@ -316,9 +312,9 @@ def test_patron_status_with_borrow(mocker):
     assert isinstance(status, dict)
 
 
-def test_patron_status_includes_fees():
+def test_patron_status_includes_fees(temp_db):
     assert isinstance(get_patron_status_report("777777"), dict)
 
 
-def test_patron_status_history_field():
+def test_patron_status_history_field(temp_db):
     assert isinstance(get_patron_status_report("123456"), dict)
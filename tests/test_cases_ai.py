@@ -1,6 +1,8 @@
 import pytest
 from datetime import datetime, timedelta
 
+import database
+
 from services.library_service import (
     add_book_to_catalog,
     borrow_book_by_patron,
@@ -65,10 +67,8 @@ def test_borrow_success_valid_patron_and_book(mocker):
     fake_book = {"id": 1, "title": "X", "author": "Y",
                  "isbn": "111", "total_copies": 3, "available_copies": 1}
 
-    mocker.patch("services.library_service.get_patron_borrow_count", return_value=0)
-    mocker.patch("services.library_service.get_book_by_id", return_value=fake_book)
-    mocker.patch("services.library_service.insert_borrow_record", return_value=True)
-    mocker.patch("services.library_service.update_book_availability", return_value=True)
+    mocker.patch("services.library_service.borrow_book_transaction",
+                 return_value=("ok", fake_book))
 
     success, msg = borrow_book_by_patron("444444", 1)
     assert success is True
@@ -81,8 +81,8 @@ def test_borrow_fail_patron_id_invalid_length():
 
 
 def test_borrow_fail_nonexistent_book(mocker):
-    mocker.patch("services.library_service.get_patron_borrow_count", return_value=0)
-    mocker.patch("services.library_service.get_book_by_id", return_value=None)
+    mocker.patch("services.library_service.borrow_book_transaction",
+                 return_value=("not_found", None))
 
     success, msg = borrow_book_by_patron("123456", -1)
     assert not success
@@ -90,9 +90,8 @@ def test_borrow_fail_nonexistent_book(mocker):
 
 
 def test_borrow_fail_unavailable_book(mocker):
-    mocker.patch("services.library_service.get_patron_borrow_count", return_value=0)
-    mocker.patch("services.library_service.get_book_by_id",
-                 return_value={"id": 3, "title": "1984", "available_copies": 0})
+    mocker.patch("services.library_service.borrow_book_transaction",
+                 return_value=("unavailable", {"id": 3, "title": "1984", "available_copies": 0}))
 
     success, msg = borrow_book_by_patron("123456", 3)
     assert not success
@@ -104,13 +103,9 @@ def test_borrow_fail_exceeding_limit(mocker):
     fake_book = {"id": 1, "title": "A", "author": "B",
                  "isbn": "111", "total_copies": 5, "available_copies": 5}
 
-    mocker.patch("services.library_service.get_book_by_id", return_value=fake_book)
-    mocker.patch("services.library_service.insert_borrow_record", return_value=True)
-    mocker.patch("services.library_service.update_book_availability", return_value=True)
-
     # Borrow count increases each time → hits limit on 6th
-    mocker.patch("services.library_service.get_patron_borrow_count",
-                 side_effect=[0, 1, 2, 3, 4, 5])
+    mocker.patch("services.library_service.borrow_book_transaction",
+                 side_effect=[("ok", fake_book)] * 5 + [("limit", None)])
 
     for _ in range(5):
         borrow_book_by_patron("999999", 1)
@@ -124,12 +119,15 @@ def test_borrow_fail_exceeding_limit(mocker):
 # R4: Return Book By Patron
 # ------------------------
 
+def _closed_loan(days_late):
+    returned = datetime.now()
+    due = returned - timedelta(days=days_late)
+    return {"book_id": 1, "due_date": due.isoformat(), "return_date": returned.isoformat()}
+
+
 def test_return_success_for_borrowed_book(mocker):
-    mocker.patch("services.library_service.get_book_by_id",
-                 return_value={"id": 1, "title": "X", "available_copies": 0})
-    mocker.patch("services.library_service.update_borrow_record_return_date",
-                 return_value=True)
-    mocker.patch("services.library_service.update_book_availability", return_value=True)
+    mocker.patch("services.library_service.return_book_transaction",
+                 return_value=("ok", _closed_loan(days_late=0)))
 
     success, msg = return_book_by_patron("888888", 1)
     assert success is True
@@ -142,10 +140,8 @@ def test_return_fail_invalid_patron_id_chars():
 
 
 def test_return_fail_not_borrowed_book(mocker):
-    mocker.patch("services.library_service.get_book_by_id",
-                 return_value={"id": 9999, "title": "X", "available_copies": 1})
-    mocker.patch("services.library_service.update_borrow_record_return_date",
-                 return_value=False)
+    mocker.patch("services.library_service.return_book_transaction",
+                 return_value=("no_record", None))
 
     success, msg = return_book_by_patron("777777", 9999)
     assert not success
@@ -153,35 +149,27 @@ def test_return_fail_not_borrowed_book(mocker):
 
 def test_return_fail_double_return(mocker):
     # First borrow
-    mocker.patch("services.library_service.get_patron_borrow_count", return_value=0)
-    mocker.patch("services.library_service.get_book_by_id",
-                 return_value={"id": 1, "title": "Book", "available_copies": 1})
-    mocker.patch("services.library_service.insert_borrow_record", return_value=True)
-    mocker.patch("services.library_service.update_book_availability", return_value=True)
+    mocker.patch("services.library_service.borrow_book_transaction",
+                 return_value=("ok", {"id": 1, "title": "Book", "available_copies": 1}))
     borrow_book_by_patron("123123", 1)
 
     # First return succeeds
-    mocker.patch("services.library_service.get_book_by_id",
-                 return_value={"id": 1, "title": "Book", "available_copies": 0})
-    mocker.patch("services.library_service.update_borrow_record_return_date",
-                 return_value=True)
-    mocker.patch("services.library_service.update_book_availability",
-                 return_value=True)
+    mocker.patch("services.library_service.return_book_transaction",
+                 return_value=("ok", _closed_loan(days_late=0)))
     assert return_book_by_patron("123123", 1)[0] is True
 
     # Second return fails
-    mocker.patch("services.library_service.get_book_by_id",
-                 return_value={"id": 1, "title": "Book", "available_copies": 1})
-    mocker.patch("services.library_service.update_borrow_record_return_date",
-                 return_value=False)
+    mocker.patch("services.library_service.return_book_transaction",
+                 return_value=("no_record", None))
 
     success, msg = return_book_by_patron("123123", 1)
     assert not success
 
 
 def test_return_fail_nonexistent_book(mocker):
-    # Patch DB so get_book_by_id returns None → triggers "Book not found."
-    mocker.patch("services.library_service.get_book_by_id", return_value=None)
+    # Patch DB so the return transaction reports the book missing → triggers "Book not found."
+    mocker.patch("services.library_service.return_book_transaction",
+                 return_value=("not_found", None))
 
     success, msg = return_book_by_patron("123456", 9999)
     assert not success
@@ -191,19 +179,19 @@ def test_return_fail_nonexistent_book(mocker):
 # R5: Late Fee Calculation
 # ------------------------
 
-def test_late_fee_returns_dict():
+def test_late_fee_returns_dict(temp_db):
     fee = calculate_late_fee_for_book("111111", 1)
     assert isinstance(fee, dict)
     assert "fee_amount" in fee
     assert "days_overdue" in fee
 
 
-def test_late_fee_amount_non_negative():
+def test_late_fee_amount_non_negative(temp_db):
     fee = calculate_late_fee_for_book("222222", 1)
     assert fee["fee_amount"] >= 0
 
 
-def test_late_fee_maximum_cap_not_exceeded():
+def test_late_fee_maximum_cap_not_exceeded(temp_db):
     fee = calculate_late_fee_for_book("333333", 1)
     assert fee["fee_amount"] <= 15.00
 
@@ -212,8 +200,8 @@ def test_late_fee_maximum_cap_not_exceeded():
 # R6: Book Search Functionality
 # ------------------------
 
-def test_search_title_partial_match_results(mocker):
-    mocker.patch("services.library_service.get_all_books", return_value=[
+def test_search_title_partial_match_results(seed_books):
+    seed_books([
         {"title": "Python Crash Course", "author": "A", "isbn": "1",
          "total_copies": 3, "available_copies": 1}
     ])
@@ -221,8 +209,8 @@ def test_search_title_partial_match_results(mocker):
     assert isinstance(results, list)
 
 
-def test_search_author_partial_match_results(mocker):
-    mocker.patch("services.library_service.get_all_books", return_value=[
+def test_search_author_partial_match_results(seed_books):
+    seed_books([
         {"title": "Book", "author": "Stephen King", "isbn": "1",
          "total_copies": 3, "available_copies": 1}
     ])
@@ -230,8 +218,8 @@ def test_search_author_partial_match_results(mocker):
     assert isinstance(results, list)
 
 
-def test_search_isbn_exact_match(mocker):
-    mocker.patch("services.library_service.get_all_books", return_value=[
+def test_search_isbn_exact_match(seed_books):
+    seed_books([
         {"title": "X", "author": "Y", "isbn": "9781234567897",
          "total_copies": 3, "available_copies": 1}
     ])
@@ -239,14 +227,14 @@ def test_search_isbn_exact_match(mocker):
     assert isinstance(results, list)
 
 
-def test_search_no_results_for_unknown_term(mocker):
-    mocker.patch("services.library_service.get_all_books", return_value=[])
+def test_search_no_results_for_unknown_term(seed_books):
+    seed_books([])
     results = search_books_in_catalog("nonexistentbooktitle", "title")
     assert results == []
 
 
-def test_search_invalid_search_type_returns_empty(mocker):
-    mocker.patch("services.library_service.get_all_books", return_value=[])
+def test_search_invalid_search_type_returns_empty(seed_books):
+    seed_books([])
     results = search_books_in_catalog("something", "unknown_type")
     assert results == []
 
@@ -255,7 +243,7 @@ def test_search_invalid_search_type_returns_empty(mocker):
 # R7: Patron Status Report
 # ------------------------
 
-def test_status_report_valid_patron_id(mocker):
+def test_status_report_valid_patron_id(temp_db, mocker):
     mocker.patch("services.library_service.get_patron_status_report",
                  return_value={"patron_id": "555555",
                                "borrowed_books": [],
@@ -271,7 +259,7 @@ def test_status_report_invalid_patron_id_format():
     assert status == {}
 
 
-def test_status_report_empty_borrows_for_new_patron(mocker):
+def test_status_report_empty_borrows_for_new_patron(temp_db, mocker):
     mocker.patch("services.library_service.get_patron_status_report",
                  return_value={"borrowed_books": []})
 
@@ -279,13 +267,10 @@ def test_status_report_empty_borrows_for_new_patron(mocker):
     assert isinstance(status["borrowed_books"], list)
 
 
-def test_status_report_borrowed_books_due_dates_format(mocker):
-    mocker.patch(
-        "services.library_service.get_patron_status_report",
-        return_value={
-            "borrowed_books": [{"due_date": "2025-11-20"}]
-        }
-    )
+def test_status_report_borrowed_books_due_dates_format(temp_db):
+    database.insert_book("Due Date Book", "Author", "1111111111111", 1, 1)
+    book_id = database.get_book_by_isbn("1111111111111")["id"]
+    borrow_book_by_patron("111111", book_id)
 
     status = get_patron_status_report("111111")
     due_date = status["borrowed_books"][0]["due_date"]
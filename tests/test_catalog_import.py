@@ -0,0 +1,113 @@
+import io
+import json
+
+import database
+from app import create_app
+from services.catalog_import import import_books, import_books_from_file
+
+
+def _book(isbn, title="Title", author="Author", copies=2):
+    return {"title": title, "author": author, "isbn": isbn, "total_copies": copies}
+
+
+def test_import_books_inserts_valid_rows_and_reports_the_rest(temp_db):
+    database.insert_book("Existing", "Author", "9999999999999", 1, 1)
+
+    report = import_books([
+        _book("1000000000001", title="  Padded  "),
+        _book("1000000000002", copies=0),
+        _book("123"),
+        _book("1000000000001"),
+        _book("9999999999999"),
+        _book("1000000000003", author=""),
+        _book("1000000000004", copies="7"),
+    ], chunk_size=2)
+
+    assert report["total"] == 7
+    assert report["inserted"] == 2
+    assert report["failed"] == 5
+    errors = {e["row"]: e["error"] for e in report["errors"]}
+    assert errors == {
+        2: "Total copies must be a positive integer.",
+        3: "ISBN must be exactly 13 digits.",
+        4: "Duplicate ISBN in import (first seen on row 1).",
+        5: "A book with this ISBN already exists.",
+        6: "Author is required.",
+    }
+    assert database.get_book_by_isbn("1000000000001")["title"] == "Padded"
+    assert database.get_book_by_isbn("1000000000004")["available_copies"] == 7
+
+
+def test_import_csv_and_jsonl_files(temp_db):
+    csv_feed = io.StringIO(
+        "title,author,isbn,total_copies\n"
+        "Dune,Frank Herbert,2000000000001,3\n"
+        "Bad,Row,2000000000002,many\n"
+    )
+    report = import_books_from_file(csv_feed, "csv")
+    assert report["inserted"] == 1
+    assert report["errors"] == [{"row": 3, "isbn": "2000000000002",
+                                 "error": "Total copies must be a positive integer."}]
+
+    jsonl_feed = io.StringIO(
+        json.dumps(_book("3000000000001")) + "\n"
+        "\n"
+        "{not json\n"
+        "[1, 2]\n"
+    )
+    report = import_books_from_file(jsonl_feed, "jsonl")
+    assert report["inserted"] == 1
+    assert [e["row"] for e in report["errors"]] == [3, 4]
+    assert report["errors"][0]["error"].startswith("Invalid JSON")
+
+
+def test_import_books_cli(temp_db, tmp_path):
+    feed = tmp_path / "feed.jsonl"
+    feed.write_text("\n".join(json.dumps(_book(f"40000000000{n:02d}")) for n in range(5))
+                    + "\n" + json.dumps(_book("bad")) + "\n")
+    errors = tmp_path / "errors.csv"
+
+    runner = create_app().test_cli_runner()
+    result = runner.invoke(args=["import-books", str(feed), "--errors", str(errors)])
+
+    assert result.exit_code == 0, result.output
+    assert "5 of 6 books imported, 1 rejected." in result.output
+    assert "ISBN must be exactly 13 digits." in errors.read_text()
+
+
+def test_import_books_api(temp_db):
+    client = create_app().test_client()
+    body = "title,author,isbn,total_copies\nAPI Book,Author,5000000000001,1\n"
+
+    response = client.post("/api/books/import?format=csv", data=body)
+
+    assert response.status_code == 200
+    assert response.get_json()["inserted"] == 1
+    assert database.get_book_by_isbn("5000000000001")["title"] == "API Book"
+    assert client.post("/api/books/import?format=xml", data=body).status_code == 400
+
+
+def test_bulk_import_keeps_fulltext_index_in_sync(temp_db):
+    import_books([_book("6000000000001", title="Bulk Loaded Saga")])
+    database.insert_book("Single Insert Saga", "Author", "6000000000002", 1, 1)
+
+    titles = {b["title"] for b in database.fulltext_search_books("saga")}
+    assert titles == {"Bulk Loaded Saga", "Single Insert Saga"}
+    with database.db_connection() as conn:
+        assert conn.execute("SELECT suspended FROM fts_sync").fetchone()[0] == 0
+
+
+def test_init_database_upgrades_unconditional_fts_trigger(temp_db):
+    with database.db_connection() as conn:
+        conn.execute("DROP TRIGGER books_fts_insert")
+        conn.execute("""CREATE TRIGGER books_fts_insert AFTER INSERT ON books BEGIN
+            INSERT INTO books_fts (rowid, title, author) VALUES (new.id, new.title, new.author);
+        END""")
+        conn.execute("PRAGMA user_version = 0")
+        conn.commit()
+
+    database.init_database()
+
+    with database.db_connection() as conn:
+        sql = conn.execute("SELECT sql FROM sqlite_master WHERE name = 'books_fts_insert'").fetchone()[0]
+    assert "fts_sync" in sql
@@ -0,0 +1,654 @@
+import csv
+import io
+import json
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+import database
+from app import create_app
+
+
+# ============================
+# Connection pool
+# ============================
+
+def test_pool_reuses_connections(temp_db):
+    """Second borrow of a released connection is a hit, not a new connect."""
+    pool = database.ConnectionPool(temp_db, size=2)
+
+    conn = pool.acquire()
+    pool.release(conn)
+    again = pool.acquire()
+
+    assert again is conn
+    stats = pool.stats()
+    assert stats["misses"] == 1
+    assert stats["hits"] == 1
+    pool.release(again)
+    pool.close()
+
+
+def test_pool_waits_when_exhausted(temp_db):
+    """A caller blocks until another thread releases its connection."""
+    pool = database.ConnectionPool(temp_db, size=1, timeout=2.0)
+    held = pool.acquire()
+    got = []
+
+    worker = threading.Thread(target=lambda: got.append(pool.acquire()))
+    worker.start()
+    threading.Timer(0.05, pool.release, args=(held,)).start()
+    worker.join(timeout=3)
+
+    assert got == [held]
+    assert pool.stats()["waits"] == 1
+    pool.release(got[0])
+    pool.close()
+
+
+def test_pool_timeout_raises(temp_db):
+    pool = database.ConnectionPool(temp_db, size=1, timeout=0.01)
+    held = pool.acquire()
+
+    with pytest.raises(TimeoutError):
+        pool.acquire()
+
+    assert pool.stats()["timeouts"] == 1
+    pool.release(held)
+    pool.close()
+
+
+def test_release_rolls_back_open_transaction(temp_db):
+    pool = database.ConnectionPool(temp_db, size=1)
+    conn = pool.acquire()
+    conn.execute("INSERT INTO books (title, author, isbn, total_copies, available_copies) "
+                 "VALUES ('T', 'A', '1111111111111', 1, 1)")
+    pool.release(conn)
+
+    conn = pool.acquire()
+    assert not conn.in_transaction
+    assert conn.execute("SELECT COUNT(*) FROM books").fetchone()[0] == 0
+    pool.release(conn)
+    pool.close()
+
+
+def test_helpers_share_one_connection_per_request(temp_db):
+    """All helpers in a request reuse the same pooled connection until teardown."""
+    app = create_app({"DATABASE_POOL_SIZE": 3})
+    database.get_pool_stats()  # make sure the pool exists before counting
+    before = database.get_pool_stats()
+
+    with app.app_context():
+        database.get_all_books()
+        database.get_book_by_id(1)
+        database.get_patron_borrow_count("123456")
+        during = database.get_pool_stats()
+        assert during["in_use"] == 1
+
+    after = database.get_pool_stats()
+    assert after["size"] == 3
+    assert (after["hits"] + after["misses"]) - (before["hits"] + before["misses"]) == 1
+    assert after["in_use"] == 0
+
+
+def test_pool_follows_database_path(temp_db, tmp_path, monkeypatch):
+    first = database.get_pool()
+    monkeypatch.setattr(database, "DATABASE", str(tmp_path / "other.db"))
+
+    assert database.get_pool() is not first
+    assert database.get_pool().database.endswith("other.db")
+
+
+
+# ============================
+# Storage profiles
+# ============================
+
+@pytest.mark.parametrize("profile, synchronous", [
+    ("durable", 2),
+    ("balanced", 1),
+    ("bulk-load", 0),
+])
+def test_storage_profile_pragmas(temp_db, profile, synchronous):
+    database.configure_pool(profile=profile)
+
+    with database.db_connection() as conn:
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        assert conn.execute("PRAGMA synchronous").fetchone()[0] == synchronous
+        assert conn.execute("PRAGMA busy_timeout").fetchone()[0] == \
+            database.STORAGE_PROFILES[profile]["busy_timeout"]
+    assert database.get_pool_stats()["profile"] == profile
+
+
+def test_unknown_storage_profile_rejected(temp_db):
+    with pytest.raises(ValueError):
+        database.configure_pool(profile="fastest")
+
+
+def test_storage_profile_from_app_config(temp_db):
+    create_app({"DATABASE_PROFILE": "durable"})
+
+    with database.db_connection() as conn:
+        assert conn.execute("PRAGMA synchronous").fetchone()[0] == 2
+
+# ============================
+# Transactional borrow / return
+# ============================
+
+def _add_book(copies, isbn="9780000000001"):
+    database.insert_book("Stress Book", "Author", isbn, copies, copies)
+    return database.get_book_by_isbn(isbn)["id"]
+
+
+def _available(book_id):
+    return database.get_book_by_id(book_id)["available_copies"]
+
+
+def test_borrow_transaction_statuses(temp_db):
+    book_id = _add_book(1)
+    now = datetime.now()
+    due = now + timedelta(days=14)
+
+    assert database.borrow_book_transaction("111111", book_id, now, due)[0] == "ok"
+    assert database.borrow_book_transaction("222222", book_id, now, due)[0] == "unavailable"
+    assert database.borrow_book_transaction("222222", 9999, now, due)[0] == "not_found"
+    assert database.borrow_book_transaction("111111", book_id, now, due, max_borrowed=1)[0] == "limit"
+    assert _available(book_id) == 0
+    assert database.get_patron_borrow_count("111111") == 1
+
+
+def test_return_transaction_closes_one_loan(temp_db):
+    book_id = _add_book(2)
+    now = datetime.now()
+    database.borrow_book_transaction("111111", book_id, now, now + timedelta(days=14))
+
+    status, record = database.return_book_transaction("111111", book_id, now)
+    assert status == "ok"
+    assert record["return_date"] == now.isoformat()
+    assert _available(book_id) == 2
+
+    assert database.return_book_transaction("111111", book_id, now)[0] == "no_record"
+    assert database.return_book_transaction("111111", 9999, now)[0] == "not_found"
+    assert _available(book_id) == 2
+
+
+def test_concurrent_borrows_never_oversell(temp_db):
+    """Many threads racing for three copies: exactly three succeed."""
+    copies = 3
+    book_id = _add_book(copies)
+    results = []
+    barrier = threading.Barrier(20)
+
+    def borrow(n):
+        barrier.wait()
+        now = datetime.now()
+        status, _ = database.borrow_book_transaction(f"{n:06d}", book_id, now,
+                                                     now + timedelta(days=14))
+        results.append(status)
+
+    threads = [threading.Thread(target=borrow, args=(n,)) for n in range(20)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert results.count("ok") == copies
+    assert results.count("unavailable") == 20 - copies
+    assert _available(book_id) == 0
+
+
+def test_concurrent_borrow_return_churn_keeps_copies_in_range(temp_db):
+    """Interleaved borrows and returns never push availability out of [0, total]."""
+    copies = 2
+    book_id = _add_book(copies)
+    seen = []
+    errors = []
+
+    def churn(n):
+        patron = f"{n:06d}"
+        for _ in range(15):
+            now = datetime.now()
+            status, _ = database.borrow_book_transaction(patron, book_id, now,
+                                                         now + timedelta(days=14))
+            if status == "error":
+                errors.append(status)
+            seen.append(_available(book_id))
+            if status == "ok":
+                database.return_book_transaction(patron, book_id, datetime.now())
+            seen.append(_available(book_id))
+
+    threads = [threading.Thread(target=churn, args=(n,)) for n in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert not errors
+    assert min(seen) >= 0
+    assert max(seen) <= copies
+    assert _available(book_id) == copies
+
+
+# ============================
+# Book cache
+# ============================
+
+@pytest.fixture
+def book_cache(monkeypatch):
+    cache = database.BookCache(size=8, ttl=60)
+    monkeypatch.setattr(database, "_book_cache", cache)
+    return cache
+
+
+def _db_available(book_id):
+    with database.db_connection() as conn:
+        return conn.execute("SELECT available_copies FROM books WHERE id = ?",
+                            (book_id,)).fetchone()[0]
+
+
+def test_book_lookups_are_cached(temp_db, book_cache):
+    book_id = _add_book(2)
+
+    first = database.get_book_by_id(book_id)
+    first["title"] = "changed by caller"
+    again = database.get_book_by_id(book_id)
+
+    assert again["title"] == "Stress Book"
+    stats = database.get_book_cache_stats()
+    assert (stats["hits"], stats["misses"]) == (1, 2)  # _add_book looked up the ISBN
+
+
+def test_writes_invalidate_cached_books(temp_db, book_cache):
+    assert database.get_book_by_isbn("9780000000001") is None
+    book_id = _add_book(2)  # the cached miss for the new ISBN is dropped
+    assert _available(book_id) == 2
+
+    now = datetime.now()
+    database.borrow_book_transaction("111111", book_id, now, now + timedelta(days=14))
+    assert _available(book_id) == 1
+    assert database.get_book_by_isbn("9780000000001")["available_copies"] == 1
+
+    database.return_book_transaction("111111", book_id, now)
+    assert _available(book_id) == 2
+
+    database.update_book_availability(book_id, -2)
+    assert _available(book_id) == 0
+
+    database.insert_books_bulk([("Bulk Book", "Author", "9780000000002", 1)])
+    assert database.get_book_by_isbn("9780000000002")["title"] == "Bulk Book"
+
+
+def test_book_cache_ttl_and_lru(temp_db, monkeypatch):
+    cache = database.BookCache(size=2, ttl=0.05)
+    monkeypatch.setattr(database, "_book_cache", cache)
+    ids = [_add_book(1, isbn=f"978000000001{n}") for n in range(3)]
+
+    for book_id in ids:
+        database.get_book_by_id(book_id)
+    database.get_book_by_id(ids[0])
+    assert cache.stats()["evictions"] >= 1
+    assert cache.stats()["entries"] == 2
+
+    time.sleep(0.06)
+    database.get_book_by_id(ids[2])
+    assert cache.stats()["expired"] == 1
+
+
+def test_read_racing_a_write_is_not_cached(temp_db, book_cache):
+    book_id = _add_book(1)
+    key = (database.DATABASE, "id", book_id)
+    stale = database.get_book_by_id(book_id)
+    book_cache.clear()
+
+    found, _, generation = book_cache.get(key)
+    book_cache.invalidate(book_ids=(book_id,))  # a borrow commits mid-lookup
+    book_cache.put(key, stale, generation)
+
+    assert not found
+    assert book_cache.get(key)[0] is False
+
+
+def test_cache_stays_correct_under_concurrent_borrows(temp_db, book_cache):
+    """Readers hammer the cache while borrowers and returners change availability."""
+    copies = 5
+    book_id = _add_book(copies)
+    stop = threading.Event()
+    seen = []
+
+    def read():
+        while not stop.is_set():
+            seen.append(_available(book_id))
+
+    def borrow_and_return(n):
+        now = datetime.now()
+        for _ in range(5):
+            if database.borrow_book_transaction(f"{n:06d}", book_id, now,
+                                                now + timedelta(days=14))[0] == "ok":
+                database.return_book_transaction(f"{n:06d}", book_id, now)
+        database.borrow_book_transaction(f"{n:06d}", book_id, now, now + timedelta(days=14))
+
+    readers = [threading.Thread(target=read) for _ in range(4)]
+    writers = [threading.Thread(target=borrow_and_return, args=(n,)) for n in range(10)]
+    for t in readers + writers:
+        t.start()
+    for t in writers:
+        t.join()
+    stop.set()
+    for t in readers:
+        t.join()
+
+    assert all(0 <= available <= copies for available in seen)
+    assert _db_available(book_id) == 0
+    assert _available(book_id) == 0
+    assert database.get_book_cache_stats()["hits"] > 0
+
+
+# ============================
+# Secondary indexes
+# ============================
+
+def _plan(sql, params=()):
+    with database.db_connection() as conn:
+        return [row["detail"] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params)]
+
+
+@pytest.mark.parametrize("sql, params, index", [
+    ("SELECT COUNT(*) FROM borrow_records WHERE patron_id = ? AND return_date IS NULL",
+     ("123456",), "idx_borrow_patron"),
+    ("SELECT br.*, b.title, b.author FROM borrow_records br JOIN books b ON br.book_id = b.id "
+     "WHERE br.patron_id = ? AND br.return_date IS NULL ORDER BY br.borrow_date",
+     ("123456",), "idx_borrow_patron"),
+    ("UPDATE borrow_records SET return_date = ? "
+     "WHERE patron_id = ? AND book_id = ? AND return_date IS NULL",
+     ("2025-01-01", "123456", 1), "idx_borrow_patron"),
+    ("SELECT * FROM borrow_records WHERE patron_id = ? AND book_id = ? AND return_date IS NULL "
+     "ORDER BY borrow_date LIMIT 1", ("123456", 1), "idx_borrow_patron"),
+    ("SELECT * FROM borrow_records WHERE book_id = ? AND return_date IS NULL",
+     (1,), "idx_borrow_active_book"),
+    ("SELECT * FROM borrow_records WHERE patron_id = ? ORDER BY borrow_date",
+     ("123456",), "idx_borrow_patron"),
+    ("SELECT * FROM books WHERE title = ? COLLATE NOCASE", ("dune",), "idx_books_title_nocase"),
+    ("SELECT * FROM books WHERE author = ? COLLATE NOCASE", ("king",), "idx_books_author_nocase"),
+])
+def test_queries_use_indexes(temp_db, sql, params, index):
+    plan = _plan(sql, params)
+
+    assert not any(step.startswith("SCAN br") or step.startswith("SCAN borrow_records")
+                   or step == "SCAN books" for step in plan), plan
+    assert any(index in step for step in plan), plan
+
+
+def test_init_database_adds_indexes_to_existing_db(temp_db):
+    with database.db_connection() as conn:
+        conn.execute("DROP INDEX idx_borrow_patron")
+        conn.execute("PRAGMA user_version = 0")
+        conn.commit()
+
+    database.init_database()
+
+    with database.db_connection() as conn:
+        names = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    assert "idx_borrow_patron" in names
+
+
+def test_init_database_skips_a_current_schema(temp_db, mocker):
+    migrate = mocker.spy(database, "migrate_schema")
+
+    database.init_database()
+    create_app()
+
+    migrate.assert_not_called()
+    with database.db_connection() as conn:
+        assert conn.execute("PRAGMA user_version").fetchone()[0] == database.SCHEMA_VERSION
+        assert conn.execute("SELECT COUNT(*) FROM books").fetchone()[0] == 0
+
+
+def test_load_sample_data_command(temp_db):
+    runner = create_app().test_cli_runner()
+
+    first = runner.invoke(args=["load-sample-data"])
+    again = runner.invoke(args=["load-sample-data"])
+
+    assert "Sample data loaded." in first.output
+    assert "already has books" in again.output
+    assert [b["title"] for b in database.get_all_books()] == [
+        "1984", "The Great Gatsby", "To Kill a Mockingbird"]
+
+
+# ============================
+# SQL search
+# ============================
+
+SEARCH_BOOKS = [
+    ("The Great Gatsby", "F. Scott Fitzgerald", "9780743273565"),
+    ("Great Expectations", "Charles Dickens", "9780141439563"),
+    ("100% Pure_Python", "Guido Van Rossum", "978000000001X"),
+    ("Les Misérables", "Victor Hugo", "9780451419439"),
+    ("ÉCOLE DES FEMMES", "Molière", "9782070367"),
+    ("Clean Code", "Robert C. Martin", "9780132350884"),
+]
+
+
+def _python_search(term, search_type):
+    """The original get_all_books() loop, kept as the semantic reference."""
+    term = term.strip().lower()
+    books = sorted(database.get_all_books(), key=lambda b: b["title"])
+    if search_type == "isbn":
+        return [b for b in books if term == b["isbn"].lower()]
+    return [b for b in books if term in b[search_type].lower()]
+
+
+@pytest.mark.parametrize("term, search_type", [
+    ("great", "title"), ("GREAT", "title"), ("%", "title"), ("_", "title"),
+    ("0% p", "title"), ("misér", "title"), ("école", "title"), ("é", "title"),
+    ("dickens", "author"), ("molière", "author"), ("zzz", "author"),
+    ("9780141439563", "isbn"), ("978000000001x", "isbn"), ("97801414", "isbn"),
+])
+def test_sql_search_matches_python_semantics(temp_db, term, search_type):
+    for title, author, isbn in SEARCH_BOOKS:
+        database.insert_book(title, author, isbn, 1, 1)
+
+    expected = [b["id"] for b in _python_search(term, search_type)]
+    actual = [b["id"] for b in database.search_books(term, search_type)]
+
+    assert actual == expected
+
+
+def test_sql_search_limit_offset_and_prefix(temp_db):
+    for n in range(10):
+        database.insert_book(f"Saga {n}", "Author", f"{n:013d}", 1, 1)
+    database.insert_book("The Saga", "Author", "9999999999999", 1, 1)
+
+    page = database.search_books("saga", "title", limit=3, offset=3)
+    assert [b["title"] for b in page] == ["Saga 3", "Saga 4", "Saga 5"]
+
+    prefix = database.search_books("saga", "title", match="prefix")
+    assert "The Saga" not in [b["title"] for b in prefix]
+    assert len(prefix) == 10
+
+    with database.db_connection() as conn:
+        plan = [row["detail"] for row in conn.execute(
+            "EXPLAIN QUERY PLAN SELECT * FROM books WHERE title LIKE ? ESCAPE '\\' ORDER BY title",
+            ("saga%",))]
+    assert any("idx_books_title_nocase" in step for step in plan), plan
+
+
+def test_api_search_paging(sample_data):
+    client = create_app().test_client()
+
+    response = client.get("/api/search?q=the&type=title&limit=1&offset=0")
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body["count"] == 1
+    assert body["limit"] == 1
+
+    assert client.get("/api/search?q=the&limit=0").status_code == 400
+
+
+# ============================
+# Full-text search
+# ============================
+
+def _titles(books):
+    return [b["title"] for b in books]
+
+
+def test_fulltext_multi_word_prefix_and_rank(temp_db):
+    database.insert_book("Dune Messiah", "Frank Herbert", "0000000000001", 1, 1)
+    database.insert_book("Dune", "Frank Herbert", "0000000000002", 1, 1)
+    database.insert_book("Herbert's Garden", "Someone Else", "0000000000003", 1, 1)
+    database.insert_book("Children of Dune", "Frank Herbert", "0000000000004", 1, 1)
+
+    # both words must match, the second as a prefix
+    assert set(_titles(database.fulltext_search_books("dune mess"))) == {"Dune Messiah"}
+    # words can come from title or author
+    assert len(database.fulltext_search_books("frank dune")) == 3
+    # title hits outrank author hits
+    assert _titles(database.fulltext_search_books("herbert"))[0] == "Herbert's Garden"
+    # punctuation in user input is not FTS syntax
+    assert _titles(database.fulltext_search_books('"dune" (messiah*')) == ["Dune Messiah"]
+    assert database.fulltext_search_books("   ") == []
+
+
+def test_fulltext_index_follows_book_writes(temp_db):
+    database.insert_book("Old Title", "Author", "0000000000001", 1, 1)
+    book_id = database.get_book_by_isbn("0000000000001")["id"]
+
+    with database.db_connection() as conn:
+        conn.execute("UPDATE books SET title = 'New Title' WHERE id = ?", (book_id,))
+        conn.commit()
+    assert database.fulltext_search_books("old") == []
+    assert _titles(database.fulltext_search_books("new")) == ["New Title"]
+
+    with database.db_connection() as conn:
+        conn.execute("DELETE FROM books WHERE id = ?", (book_id,))
+        conn.commit()
+    assert database.fulltext_search_books("new") == []
+
+
+def test_fulltext_index_built_for_existing_books(temp_db):
+    database.insert_book("Existing Book", "Author", "0000000000001", 1, 1)
+    with database.db_connection() as conn:
+        conn.execute("DROP TABLE books_fts")
+        conn.execute("PRAGMA user_version = 0")
+        conn.commit()
+
+    database.init_database()
+
+    assert _titles(database.fulltext_search_books("exist")) == ["Existing Book"]
+
+
+def test_fulltext_search_through_routes(temp_db):
+    database.insert_book("Les Misérables", "Victor Hugo", "0000000000001", 1, 1)
+    client = create_app().test_client()
+
+    body = client.get("/api/search?q=miserables%20hugo&type=fulltext").get_json()
+    assert _titles(body["results"]) == ["Les Misérables"]
+
+    page = client.get("/search?q=hugo&type=fulltext")
+    assert "Les Misérables" in page.get_data(as_text=True)
+
+
+# ============================
+# Keyset pagination
+# ============================
+
+def _seed_catalog(count):
+    for n in range(count):
+        # duplicate titles make the id tie-breaker matter
+        database.insert_book(f"Book {n // 2:03d}", "Author", f"{n:013d}", 1, 1)
+
+
+def test_books_page_walks_whole_catalog_forward_and_back(temp_db):
+    _seed_catalog(25)
+    expected = [b["id"] for b in sorted(database.get_all_books(), key=lambda b: (b["title"], b["id"]))]
+
+    seen, pages, after = [], [], None
+    while True:
+        books, page = database.get_books_page(after=after, limit=7)
+        seen += [b["id"] for b in books]
+        pages.append(page)
+        if not page["next"]:
+            break
+        after = page["next"]
+    assert seen == expected
+    assert pages[0]["prev"] is None
+    assert len(pages) == 4
+
+    books, page = database.get_books_page(before=pages[-1]["prev"], limit=7)
+    assert [b["id"] for b in books] == expected[14:21]
+    assert page["next"] and page["prev"]
+
+
+def test_cursor_round_trip_and_garbage():
+    key = ("Ünïcode / title?", 42)
+    assert database.decode_cursor(database.encode_cursor(key)) == key
+    assert database.decode_cursor("not-a-cursor") is None
+    assert database.decode_cursor("") is None
+
+
+def test_api_books_cursor_paging(temp_db):
+    _seed_catalog(5)
+    client = create_app().test_client()
+
+    first = client.get("/api/books?limit=2").get_json()
+    assert first["count"] == 2
+    rest = client.get(f"/api/books?limit=10&cursor={first['next_cursor']}").get_json()
+    total = len(database.get_all_books())
+
+    assert first["count"] + rest["count"] == total
+    assert rest["next_cursor"] is None
+    assert client.get("/api/books?cursor=garbage").status_code == 400
+    assert client.get("/api/books?limit=0").status_code == 400
+
+
+def test_catalog_page_controls(temp_db):
+    _seed_catalog(5)
+    client = create_app({"CATALOG_PAGE_SIZE": 3}).test_client()
+
+    html = client.get("/catalog").get_data(as_text=True)
+    assert "Next" in html and "Previous" not in html
+    assert html.count("<tr>") == 1 + 3  # header + one page
+
+
+# ============================
+# Streaming export
+# ============================
+
+def test_iter_table_rows_streams_header_then_rows(temp_db):
+    _seed_catalog(3)
+    rows = database.iter_table_rows("books", batch_size=2)
+
+    header = next(rows)
+    assert header[:3] == ("id", "title", "author")
+    assert database.get_pool_stats()["in_use"] == 1
+    assert len(list(rows)) == 3
+    assert database.get_pool_stats()["in_use"] == 0
+
+    with pytest.raises(ValueError):
+        next(database.iter_table_rows("sqlite_master"))
+
+
+def test_export_endpoints_ndjson_and_csv(temp_db):
+    _seed_catalog(4)
+    now = datetime.now()
+    database.borrow_book_transaction("123456", 1, now, now + timedelta(days=14))
+    client = create_app().test_client()
+
+    response = client.get("/api/export/books")
+    assert response.mimetype == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert [row["isbn"] for row in lines] == [b["isbn"] for b in sorted(
+        database.get_all_books(), key=lambda b: b["id"])]
+
+    response = client.get("/api/export/borrow_records?format=csv")
+    assert response.mimetype == "text/csv"
+    rows = list(csv.reader(io.StringIO(response.get_data(as_text=True))))
+    assert rows[0][:3] == ["id", "patron_id", "book_id"]
+    assert len(rows) == 2
+    assert rows[1][1:3] == ["123456", "1"]
+
+    assert client.get("/api/export/payments").status_code == 404
+    assert client.get("/api/export/books?format=xml").status_code == 400
@@ -0,0 +1,92 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import database
+from app import create_app
+from routes.fragment_cache import FragmentCache, catalog_fragments
+
+
+@pytest.fixture
+def client(temp_db):
+    for n, title in enumerate(["Alpha", "Bravo", "Charlie", "Delta", "Echo"]):
+        database.insert_book(title, "Author", f"94000000000{n:02d}", 2, 2)
+    return create_app({"CATALOG_PAGE_SIZE": 3}).test_client()
+
+
+def _id(title):
+    return next(book["id"] for book in database.get_all_books() if book["title"] == title)
+
+
+def test_warm_page_needs_no_query(client, mocker):
+    cold = client.get("/catalog").get_data(as_text=True)
+    query = mocker.spy(database, "get_books_page")
+
+    warm = client.get("/catalog").get_data(as_text=True)
+
+    assert warm == cold
+    query.assert_not_called()
+    stats = catalog_fragments.stats()
+    assert (stats["page_hits"], stats["row_hits"]) == (1, 3)
+
+
+def test_borrow_re_renders_only_its_row(client):
+    client.get("/catalog")
+    now = datetime.now()
+    database.borrow_book_transaction("246810", _id("Bravo"), now, now + timedelta(days=14))
+    before = catalog_fragments.stats()
+
+    html = client.get("/catalog").get_data(as_text=True)
+
+    after = catalog_fragments.stats()
+    assert after["page_hits"] - before["page_hits"] == 1
+    assert after["row_misses"] - before["row_misses"] == 1
+    assert after["row_hits"] - before["row_hits"] == 2
+    assert "1/2 Available" in html
+
+
+def test_new_book_drops_only_pages_it_falls_into(client):
+    client.get("/catalog")
+    database.insert_book("Zulu", "Author", "9400000000099", 1, 1)
+    assert catalog_fragments.stats()["pages"] == 1  # after the full first page
+
+    database.insert_book("Apple", "Author", "9400000000098", 1, 1)
+    assert catalog_fragments.stats()["pages"] == 0
+
+    html = client.get("/catalog").get_data(as_text=True)
+    assert "Apple" in html and "Charlie" not in html
+
+
+def test_bulk_import_clears_the_cache(client):
+    client.get("/catalog")
+
+    database.insert_books_bulk([("Aardvark", "Author", "9400000000097", 1)])
+
+    assert catalog_fragments.stats()["rows"] == 0
+    assert "Aardvark" in client.get("/catalog").get_data(as_text=True)
+
+
+def test_rows_are_evicted_past_max_bytes(temp_db):
+    for n in range(10):
+        database.insert_book(f"Book {n}", "Author", f"94100000000{n:02d}", 1, 1)
+    cache = FragmentCache(max_bytes=100)
+
+    rows, page, count = cache.render_page(None, None, 10, lambda book: f"<tr>{book['title']:<16}</tr>")
+
+    assert count == 10 and rows.count("<tr>") == 10
+    stats = cache.stats()
+    assert stats["bytes"] <= 100
+    assert stats["evictions"] == 10 - stats["rows"]
+
+
+def test_render_racing_a_write_is_not_cached(temp_db):
+    database.insert_book("Race", "Author", "9420000000001", 1, 1)
+    cache = FragmentCache()
+
+    def render_during_borrow(book):
+        cache.books_changed((book["id"],))  # a borrow commits mid-render
+        return f"<tr>{book['available_copies']}</tr>"
+
+    cache.render_page(None, None, 10, render_during_borrow)
+
+    assert cache.stats()["pages"] == cache.stats()["rows"] == 0
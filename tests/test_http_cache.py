@@ -0,0 +1,124 @@
+import os
+import subprocess
+import sys
+from datetime import datetime, timedelta
+
+import pytest
+
+import database
+from app import create_app
+
+
+@pytest.fixture
+def client(temp_db):
+    database.insert_book("Cached Book", "Author", "9300000000001", 2, 2)
+    return create_app().test_client()
+
+
+def test_catalog_conditional_get_skips_query_and_render(client, mocker):
+    first = client.get("/catalog")
+    etag = first.headers["ETag"]
+    query = mocker.patch("routes.catalog_routes.catalog_fragments")
+    render = mocker.patch("routes.catalog_routes.render_template")
+
+    again = client.get("/catalog", headers={"If-None-Match": etag})
+
+    assert first.status_code == 200
+    assert first.headers["Cache-Control"] == "public, no-cache"
+    assert "Last-Modified" in first.headers
+    assert again.status_code == 304
+    assert again.get_data() == b""
+    assert again.headers["ETag"] == etag
+    query.render_page.assert_not_called()
+    render.assert_not_called()
+
+
+def test_write_changes_the_etag(client):
+    etag = client.get("/api/books").headers["ETag"]
+    book_id = database.get_book_by_isbn("9300000000001")["id"]
+
+    now = datetime.now()
+    database.borrow_book_transaction("246810", book_id, now, now + timedelta(days=14))
+    response = client.get("/api/books", headers={"If-None-Match": etag})
+
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert response.get_json()["books"][0]["available_copies"] == 1
+
+
+def test_search_pages_are_conditional(client):
+    for url in ("/search?q=cached&type=title", "/api/search?q=cached&type=title"):
+        first = client.get(url)
+        by_etag = client.get(url, headers={"If-None-Match": first.headers["ETag"]})
+        by_date = client.get(url, headers={"If-Modified-Since": first.headers["Last-Modified"]})
+
+        assert (first.status_code, by_etag.status_code, by_date.status_code) == (200, 304, 304)
+
+
+def test_errors_and_flashed_pages_are_not_validated(client):
+    assert "ETag" not in client.get("/api/search").headers  # 400: no search term
+
+    with client.session_transaction() as session:
+        session["_flashes"] = [("success", "Book added.")]
+    response = client.get("/catalog")
+
+    assert "ETag" not in response.headers
+    assert "Book added." in response.get_data(as_text=True)
+
+
+def test_cache_control_is_configurable_per_blueprint(temp_db):
+    client = create_app({"CACHE_CONTROL": {"catalog": "public, max-age=60"}}).test_client()
+
+    assert client.get("/catalog").headers["Cache-Control"] == "public, max-age=60"
+    assert client.get("/api/books").headers["Cache-Control"] == "private, no-cache"
+    assert client.get("/patron/246810").headers["Cache-Control"] == "private, no-store"
+
+
+def _borrow_in_another_process(book_id):
+    """Borrow through a separate interpreter, as another gunicorn worker would."""
+    subprocess.run([sys.executable, "-c", (
+        "import sys; from datetime import datetime, timedelta; import database; "
+        "database.DATABASE = sys.argv[1]; now = datetime.now(); "
+        "database.borrow_book_transaction('135790', int(sys.argv[2]), now, now + timedelta(days=14))"),
+        database.DATABASE, str(book_id)], check=True, cwd=os.path.dirname(os.path.dirname(__file__)))
+
+
+def test_writes_from_another_process_refresh_caches(client):
+    book_id = database.get_book_by_isbn("9300000000001")["id"]
+    api_etag = client.get("/api/books").headers["ETag"]
+    assert b"2/2 Available" in client.get("/catalog").get_data()
+    assert database.get_book_by_id(book_id)["available_copies"] == 2     # now cached
+
+    _borrow_in_another_process(book_id)
+    api = client.get("/api/books", headers={"If-None-Match": api_etag})
+
+    assert api.status_code == 200
+    assert api.headers["ETag"] != api_etag
+    assert api.get_json()["books"][0]["available_copies"] == 1
+    assert b"1/2 Available" in client.get("/catalog").get_data()
+    assert database.get_book_by_id(book_id)["available_copies"] == 1
+
+
+def test_unchanged_database_is_not_queried_for_a_304(client, mocker, monkeypatch):
+    monkeypatch.setattr(database, "_STAMP_SLACK", -1.0)     # no coarse file clock to wait out
+    etag = client.get("/api/books").headers["ETag"]
+    sync = mocker.spy(database, "sync_catalog")
+    acquire = mocker.spy(database.get_pool(), "acquire")
+
+    assert client.get("/api/books", headers={"If-None-Match": etag}).status_code == 304
+    sync.assert_not_called()
+    acquire.assert_not_called()
+
+    _borrow_in_another_process(database.get_book_by_isbn("9300000000001")["id"])
+
+    assert client.get("/api/books", headers={"If-None-Match": etag}).status_code == 200
+    sync.assert_called()
+
+
+def test_sync_without_changes_keeps_the_version(temp_db):
+    version = database.sync_catalog()
+    assert database.sync_catalog() == version == database.get_catalog_version()
+
+    database.insert_book("Synced Book", "Author", "9300000000002", 1, 1)
+
+    assert database.get_catalog_version()[0] == version[0] + 1
@@ -0,0 +1,184 @@
+from datetime import datetime, timedelta
+from unittest.mock import Mock
+
+import pytest
+
+import database
+from app import create_app
+from services.library_service import (
+    calculate_late_fee,
+    calculate_late_fee_for_book,
+    calculate_late_fees,
+    get_patron_late_fees,
+    return_book_by_patron,
+)
+from services.library_services import pay_all_late_fees
+from services.payment_service import PaymentGateway
+
+NOW = datetime(2025, 6, 1, 12, 0, 0)
+
+
+def _book(isbn="7000000000001", title="Fee Book"):
+    database.insert_book(title, "Author", isbn, 50, 50)
+    return database.get_book_by_isbn(isbn)["id"]
+
+
+def _loan(patron_id, book_id, days_late, returned=False):
+    """A loan whose due date is days_late days before NOW."""
+    due = NOW - timedelta(days=days_late)
+    with database.db_connection() as conn:
+        conn.execute("""
+            INSERT INTO borrow_records (patron_id, book_id, borrow_date, due_date, return_date)
+            VALUES (?, ?, ?, ?, ?)
+        """, (patron_id, book_id, (due - timedelta(days=14)).isoformat(), due.isoformat(),
+              NOW.isoformat() if returned else None))
+        conn.commit()
+
+
+@pytest.mark.parametrize("days, fee", [
+    (-3, 0.0), (0, 0.0), (1, 0.5), (7, 3.5), (8, 4.5), (10, 6.5), (18, 14.5), (19, 15.0), (60, 15.0),
+])
+def test_tiered_fee_rule(days, fee):
+    assert calculate_late_fee(days) == fee
+
+
+def test_sql_engine_matches_python_rule(temp_db):
+    book_id = _book()
+    pairs = []
+    for days in range(-2, 41):
+        patron = f"{days + 100:06d}"
+        _loan(patron, book_id, days)
+        pairs.append((patron, book_id))
+
+    fees = database.get_loan_fees(pairs, as_of=NOW)
+
+    for days in range(-2, 41):
+        loan = fees[(f"{days + 100:06d}", book_id)]
+        assert loan["days_overdue"] == max(days, 0)
+        assert loan["fee_amount"] == calculate_late_fee(days)
+
+
+def test_get_loan_fees_prefers_open_loan_then_latest(temp_db):
+    book_id = _book()
+    _loan("111111", book_id, days_late=20, returned=True)
+    _loan("111111", book_id, days_late=3)
+    _loan("222222", book_id, days_late=30, returned=True)
+
+    fees = database.get_loan_fees([("111111", book_id), ("222222", book_id), ("333333", book_id)],
+                                  as_of=NOW)
+
+    assert fees[("111111", book_id)]["fee_amount"] == 1.5
+    # returned on NOW, so the whole 30 days count (capped)
+    assert fees[("222222", book_id)]["fee_amount"] == 15.0
+    assert ("333333", book_id) not in fees
+
+
+def test_get_overdue_fees_sweeps_open_overdue_loans(temp_db):
+    first, second = _book("7000000000001", "First"), _book("7000000000002", "Second")
+    _loan("111111", first, days_late=10)
+    _loan("111111", second, days_late=2)
+    _loan("111111", second, days_late=40, returned=True)
+    _loan("222222", first, days_late=-5)
+    _loan("333333", second, days_late=1)
+
+    everyone = database.get_overdue_fees(as_of=NOW)
+    assert [(f["patron_id"], f["title"], f["fee_amount"]) for f in everyone] == [
+        ("111111", "First", 6.5), ("111111", "Second", 1.0), ("333333", "Second", 0.5)]
+
+    mine = database.get_overdue_fees("111111", as_of=NOW)
+    assert [f["book_id"] for f in mine] == [first, second]
+
+    with database.db_connection() as conn:
+        plan = [row["detail"] for row in conn.execute(
+            "EXPLAIN QUERY PLAN SELECT * FROM borrow_records br "
+            "WHERE br.return_date IS NULL AND br.due_date < ?", (NOW.isoformat(),))]
+    assert any("idx_borrow_active_due" in step for step in plan), plan
+
+
+def test_calculate_late_fee_for_book_reads_borrow_record(temp_db):
+    book_id = _book()
+    borrowed = datetime.now() - timedelta(days=24)
+    database.borrow_book_transaction("123456", book_id, borrowed, borrowed + timedelta(days=14))
+
+    fee = calculate_late_fee_for_book("123456", book_id)
+    assert fee["days_overdue"] == 10
+    assert fee["fee_amount"] == 6.5
+    assert fee["returned"] is False
+
+    assert calculate_late_fee_for_book("654321", book_id)["fee_amount"] == 0.0
+    assert calculate_late_fee_for_book("12", book_id)["status"] == "Invalid patron ID."
+
+
+def test_batch_and_patron_fee_services(temp_db):
+    book_id = _book()
+    borrowed = datetime.now() - timedelta(days=16)
+    database.borrow_book_transaction("123456", book_id, borrowed, borrowed + timedelta(days=14))
+
+    results = calculate_late_fees([("999999", book_id), ("123456", book_id)])
+    assert [r["fee_amount"] for r in results] == [0.0, 1.0]
+
+    report = get_patron_late_fees("123456")
+    assert report["total_fees"] == 1.0
+    assert get_patron_late_fees("abc") == {}
+
+
+def test_patron_fees_include_unpaid_late_returns(temp_db):
+    first, second = _book("7000000000001", "First"), _book("7000000000002", "Second")
+    _loan("111111", first, days_late=3)
+    _loan("111111", second, days_late=30, returned=True)
+    _loan("111111", second, days_late=-2, returned=True)  # returned on time
+
+    fees = database.get_outstanding_fees("111111", as_of=NOW)
+
+    assert [(f["title"], f["fee_amount"], f["return_date"] is not None) for f in fees] == [
+        ("Second", 15.0, True), ("First", 1.5, False)]
+    assert [f["book_id"] for f in database.get_overdue_fees("111111", as_of=NOW)] == [first]
+
+
+def test_pay_all_late_fees_covers_returned_books(temp_db):
+    book_id = _book()
+    borrowed = datetime.now() - timedelta(days=30)
+    database.borrow_book_transaction("123456", book_id, borrowed, borrowed + timedelta(days=14))
+    assert "late fee: $12.50" in return_book_by_patron("123456", book_id)[1]
+    assert get_patron_late_fees("123456")["total_fees"] == 12.5
+
+    gateway = Mock(spec=PaymentGateway)
+    gateway.process_payment.return_value = (True, "txn_123456_1", "Paid")
+    ok, msg, txn, allocations = pay_all_late_fees("123456", gateway)
+
+    assert ok is True
+    assert [(a["book_id"], a["fee_amount"]) for a in allocations] == [(book_id, 12.5)]
+    assert get_patron_late_fees("123456") == {"patron_id": "123456", "fees": [], "total_fees": 0.0}
+    assert calculate_late_fee_for_book("123456", book_id)["amount_due"] == 0.0
+
+
+def test_late_fee_api_routes(temp_db):
+    client = create_app().test_client()
+    book_id = _book()
+    borrowed = datetime.now() - timedelta(days=16)
+    database.borrow_book_transaction("123456", book_id, borrowed, borrowed + timedelta(days=14))
+
+    single = client.get(f"/api/late_fee/123456/{book_id}").get_json()
+    assert single["fee_amount"] == 1.0
+
+    patron = client.get("/api/late_fees/123456").get_json()
+    assert patron["total_fees"] == 1.0
+    assert client.get("/api/late_fees/12").status_code == 400
+
+    batch = client.post("/api/late_fees", json={"items": [{"patron_id": "123456", "book_id": book_id}]})
+    assert batch.get_json()["results"][0]["fee_amount"] == 1.0
+    assert client.post("/api/late_fees", json={"items": [{"book_id": 1}]}).status_code == 400
+
+
+def test_late_fee_report_cli(temp_db, tmp_path):
+    app = create_app()
+    book_id = _book()
+    borrowed = datetime.now() - timedelta(days=16)
+    database.borrow_book_transaction("123456", book_id, borrowed, borrowed + timedelta(days=14))
+    out = tmp_path / "fees.csv"
+
+    result = app.test_cli_runner().invoke(args=["late-fee-report", "--csv", str(out)])
+
+    assert result.exit_code == 0, result.output
+    assert "1 overdue loans, $1.00 in late fees, $1.00 still due." in result.output
+    assert "Fee Book" in out.read_text()
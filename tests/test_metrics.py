@@ -0,0 +1,114 @@
+import logging
+import re
+
+import pytest
+
+import database
+from app import create_app
+from routes.metrics import Histogram
+
+
+@pytest.fixture
+def client(temp_db):
+    return create_app().test_client()
+
+
+def _sample(text, name, **labels):
+    """Value of one sample in Prometheus text output (0 if absent)."""
+    label_text = ','.join(f'{key}="{value}"' for key, value in labels.items())
+    pattern = re.escape(f'{name}{{{label_text}}}' if labels else name) + r' (\S+)$'
+    match = re.search(pattern, text, re.MULTILINE)
+    return float(match.group(1)) if match else 0.0
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram('test_seconds', 'Test.', ('kind',), buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        histogram.observe(value, 'a')
+
+    text = '\n'.join(histogram.render())
+
+    assert _sample(text, 'test_seconds_bucket', kind='a', le='0.1') == 2
+    assert _sample(text, 'test_seconds_bucket', kind='a', le='1.0') == 3
+    assert _sample(text, 'test_seconds_bucket', kind='a', le='+Inf') == 4
+    assert _sample(text, 'test_seconds_count', kind='a') == 4
+    assert _sample(text, 'test_seconds_sum', kind='a') == pytest.approx(3.65)
+    assert '# TYPE test_seconds histogram' in text
+
+
+def test_requests_are_broken_down_by_phase(client):
+    before = client.get('/metrics').get_data(as_text=True)
+    client.get('/search?q=gatsby&type=title')
+    response = client.get('/metrics')
+    text = response.get_data(as_text=True)
+
+    def delta(name, **labels):
+        return _sample(text, name, **labels) - _sample(before, name, **labels)
+
+    endpoint = 'search.search_books'
+
+    assert response.content_type.startswith('text/plain; version=0.0.4')
+    assert response.headers['Cache-Control'] == 'no-store'
+    assert delta('library_http_request_duration_seconds_count', endpoint=endpoint, method='GET') == 1
+    assert delta('library_http_requests_total', endpoint=endpoint, method='GET', status='200') == 1
+    for phase in ('connection', 'sql', 'render'):
+        assert delta('library_http_request_phase_seconds_count', endpoint=endpoint, phase=phase) == 1
+    assert delta('library_http_request_phase_seconds_sum', endpoint=endpoint, phase='render') > 0
+    assert delta('library_template_render_seconds_count', template='search.html') == 1
+    assert delta('library_db_query_duration_seconds_count', function='search_books') >= 1
+    assert 'library_db_pool_connections{state="in_use"}' in text
+    assert 'library_book_cache_events{event="hits"}' in text
+    assert 'library_payment_jobs' in text
+
+
+def test_unmatched_urls_share_one_label(client):
+    client.get('/no/such/page')
+    client.get('/another/missing/page')
+
+    text = client.get('/metrics').get_data(as_text=True)
+
+    assert _sample(text, 'library_http_requests_total', endpoint='<unmatched>', method='GET', status='404') >= 2
+    assert 'missing' not in text
+
+
+def test_slow_queries_are_logged_with_their_plan(temp_db, caplog):
+    client = create_app({'SLOW_QUERY_MS': 0}).test_client()
+
+    with caplog.at_level(logging.WARNING, logger='routes.metrics'):
+        client.get('/api/search?q=9780743273565&type=isbn')
+
+    slow = [record.getMessage() for record in caplog.records if 'in search_books' in record.getMessage()]
+    assert slow
+    assert 'QUERY PLAN' in slow[0]
+    assert 'books' in slow[0].split('QUERY PLAN')[1]
+
+
+def test_slow_full_scan_includes_fetching_its_rows(temp_db, caplog):
+    with database.db_connection() as conn:
+        conn.executemany('INSERT INTO books (title, author, isbn, total_copies, available_copies) '
+                         'VALUES (?, ?, ?, 1, 1)', [(f'Title {n:06d}', 'Author', f'{n:013d}')
+                                                     for n in range(20000)])
+        conn.commit()
+    # stepping to the first row of an index scan takes microseconds;
+    # only fetching all 20,000 rows takes this long
+    create_app({'SLOW_QUERY_MS': 5})
+
+    with caplog.at_level(logging.WARNING, logger='routes.metrics'):
+        assert len(database.get_all_books()) == 20000
+
+    slow = [record.getMessage() for record in caplog.records if 'in get_all_books' in record.getMessage()]
+    assert len(slow) == 1
+    assert 'SCAN books' in slow[0].split('QUERY PLAN')[1]
+
+
+def test_metrics_can_be_disabled(temp_db):
+    client = create_app({'METRICS_ENABLED': False}).test_client()
+
+    assert client.get('/metrics').status_code == 404
+
+
+def test_explain_query_plan(temp_db):
+    with database.db_connection() as conn:
+        plan = database.explain_query_plan(conn, 'SELECT * FROM books WHERE id = ?', (1,))
+        assert any('books' in step for step in plan)
+        assert database.explain_query_plan(conn, 'NOT SQL') == []
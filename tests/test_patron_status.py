@@ -0,0 +1,124 @@
+from datetime import datetime, timedelta
+
+import database
+from app import create_app
+from services.library_service import get_patron_status_report
+
+
+def _book(isbn, title):
+    database.insert_book(title, "Author", isbn, 50, 50)
+    return database.get_book_by_isbn(isbn)["id"]
+
+
+def _history(patron_id, book_id, loans):
+    """Insert `loans` returned loans, one per day, oldest first."""
+    start = datetime(2020, 1, 1)
+    with database.db_connection() as conn:
+        conn.executemany("""
+            INSERT INTO borrow_records (patron_id, book_id, borrow_date, due_date, return_date)
+            VALUES (?, ?, ?, ?, ?)
+        """, [(patron_id, book_id, (start + timedelta(days=n)).isoformat(),
+               (start + timedelta(days=n + 14)).isoformat(),
+               (start + timedelta(days=n + 3)).isoformat()) for n in range(loans)])
+        conn.commit()
+
+
+def test_report_built_from_borrow_records(temp_db):
+    old, late, fresh = _book("8000000000001", "Old"), _book("8000000000002", "Late"), _book("8000000000003", "Fresh")
+    _history("123456", old, 3)
+    borrowed = datetime.now() - timedelta(days=24)
+    database.borrow_book_transaction("123456", late, borrowed, borrowed + timedelta(days=14))
+    database.borrow_book_transaction("123456", fresh, datetime.now(), datetime.now() + timedelta(days=14))
+    database.borrow_book_transaction("654321", fresh, datetime.now(), datetime.now() + timedelta(days=14))
+
+    report = get_patron_status_report("123456")
+
+    assert report["borrowed_count"] == 2
+    assert [(b["title"], b["is_overdue"], b["fee_amount"]) for b in report["borrowed_books"]] == [
+        ("Late", True, 6.5), ("Fresh", False, 0.0)]
+    assert report["borrowed_books"][0]["due_date"] == (borrowed + timedelta(days=14)).strftime("%Y-%m-%d")
+    assert report["total_fees"] == 6.5
+    assert report["history_count"] == 5
+    assert [h["title"] for h in report["history"]] == ["Fresh", "Late", "Old", "Old", "Old"]
+    assert report["history"][-1]["return_date"] == "2020-01-04"
+
+
+def test_total_fees_include_unpaid_late_returns(temp_db):
+    late, paid = _book("8000000000001", "Late"), _book("8000000000002", "Paid")
+    for book_id in (late, paid):
+        borrowed = datetime.now() - timedelta(days=30)
+        database.borrow_book_transaction("123456", book_id, borrowed, borrowed + timedelta(days=14))
+        database.return_book_transaction("123456", book_id, datetime.now())
+    fee = database.get_loan_fees([("123456", paid)])[("123456", paid)]
+    database.create_payment("paid-1", "123456", 12.5, [
+        {"borrow_id": fee["id"], "book_id": paid, "fee_amount": 12.5}])
+    database.settle_payment(database.get_payment("paid-1")["id"], database.PAYMENT_COMPLETED, "txn_1")
+
+    report = get_patron_status_report("123456")
+
+    assert report["borrowed_count"] == 0
+    assert report["total_fees"] == 12.5
+    assert create_app().test_client().get("/api/patron/123456").get_json()["total_fees"] == 12.5
+
+
+def test_page_shows_what_is_still_due_per_loan(temp_db):
+    late, returned = _book("8000000000001", "Late"), _book("8000000000002", "Returned")
+    borrowed = datetime.now() - timedelta(days=24)
+    database.borrow_book_transaction("123456", late, borrowed, borrowed + timedelta(days=14))
+    database.borrow_book_transaction("123456", returned, borrowed, borrowed + timedelta(days=14))
+    database.return_book_transaction("123456", returned, datetime.now())
+    fee = database.get_loan_fees([("123456", late)])[("123456", late)]
+    database.create_payment("part-1", "123456", 2.5, [
+        {"borrow_id": fee["id"], "book_id": late, "fee_amount": 2.5}])
+    database.settle_payment(database.get_payment("part-1")["id"], database.PAYMENT_COMPLETED, "txn_1")
+
+    page = create_app().test_client().get("/patron/123456").get_data(as_text=True)
+
+    assert "<td>$4.00</td>" in page
+    assert "$6.50</td>" not in page
+    assert "$10.50" in page and "($6.50 on books already returned)" in page
+
+
+def test_new_patron_has_empty_report(temp_db):
+    report = get_patron_status_report("999999")
+    assert report == {"patron_id": "999999", "borrowed_books": [], "borrowed_count": 0,
+                      "total_fees": 0.0, "returned_fees": 0.0, "history": [], "history_count": 0}
+
+
+def test_history_is_paged_newest_first(temp_db):
+    book_id = _book("8000000000001", "Old")
+    _history("123456", book_id, 120)
+
+    first = get_patron_status_report("123456")
+    second = get_patron_status_report("123456", history_limit=50, history_offset=50)
+
+    assert first["history_count"] == 120
+    assert len(first["history"]) == 50
+    assert first["history"][0]["borrow_date"] == "2020-04-29"
+    assert second["history"][0]["borrow_date"] == "2020-03-10"
+
+
+def test_history_query_uses_patron_history_index(temp_db):
+    with database.db_connection() as conn:
+        plan = [row["detail"] for row in conn.execute(
+            "EXPLAIN QUERY PLAN SELECT * FROM borrow_records WHERE patron_id = ? "
+            "ORDER BY borrow_date DESC, id DESC LIMIT 50", ("123456",))]
+    assert any("idx_borrow_patron_history" in step for step in plan), plan
+    assert not any("TEMP B-TREE" in step for step in plan), plan
+
+
+def test_patron_routes(temp_db):
+    client = create_app().test_client()
+    book_id = _book("8000000000001", "Route Book")
+    database.borrow_book_transaction("246810", book_id, datetime.now(), datetime.now() + timedelta(days=14))
+
+    api = client.get("/api/patron/246810").get_json()
+    assert api["borrowed_books"][0]["title"] == "Route Book"
+    assert client.get("/api/patron/12").status_code == 400
+    assert client.get("/api/patron/246810?history_limit=0").status_code == 400
+
+    page = client.get("/patron/246810")
+    assert page.status_code == 200
+    assert b"Route Book" in page.data
+    assert client.get("/patron/abc").status_code == 400
+    assert client.get("/patron?patron_id=246810").status_code == 302
@@ -0,0 +1,151 @@
+import asyncio
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+import database
+from app import create_app
+from services.library_services import pay_late_fees
+from services.payment_service import AsyncPaymentGateway, PaymentGateway, PaymentGatewayError
+from services.payment_simulator import StubGatewayServer
+
+
+def test_sync_facade_against_stub_gateway(stub_gateway):
+    gateway = PaymentGateway(base_url=stub_gateway.url)
+
+    ok, txn, msg = gateway.process_payment("123456", 12.5, "Late fees")
+    assert ok is True
+    assert txn.startswith("txn_123456_")
+    assert "processed successfully" in msg
+
+    assert gateway.verify_payment_status(txn)["amount"] == 12.5
+    assert gateway.verify_payment_status("bad")["status"] == "not_found"
+    assert gateway.refund_payment(txn, 12.5)[0] is True
+
+    declined = gateway.process_payment("123456", 1500)
+    assert declined == (False, "", "Payment declined: amount exceeds limit")
+
+
+def test_facades_share_one_pooled_client(stub_gateway):
+    first = PaymentGateway(base_url=stub_gateway.url)
+    second = PaymentGateway(base_url=stub_gateway.url + "/")
+
+    assert first.client is second.client
+    first.process_payment("123456", 1.0)
+    session = first.client._session
+    second.process_payment("123456", 1.0)
+    assert second.client._session is session
+
+
+def test_transaction_ids_are_unique(stub_gateway):
+    gateway = PaymentGateway(base_url=stub_gateway.url)
+    txns = {gateway.process_payment("123456", 1.0)[1] for _ in range(20)}
+    assert len(txns) == 20
+
+
+def test_idempotency_key_is_honoured_by_gateway(stub_gateway):
+    gateway = PaymentGateway(base_url=stub_gateway.url)
+
+    first = gateway.process_payment("123456", 3.0, "Late fees", idempotency_key="k1")
+    retry = gateway.process_payment("123456", 3.0, "Late fees", idempotency_key="k1")
+    refunds = {gateway.refund_payment(first[1], 1.0, idempotency_key="r1") for _ in range(2)}
+
+    assert first == retry
+    assert len(stub_gateway.simulator.charges) == 1
+    assert len(refunds) == 1
+    assert stub_gateway.simulator.refunds[first[1]] == 1.0
+
+
+def test_concurrent_payments_overlap():
+    async def pay_all(url):
+        async with AsyncPaymentGateway(base_url=url) as gateway:
+            return await asyncio.gather(*(gateway.process_payment(f"{n:06d}", 2.0) for n in range(50)))
+
+    with StubGatewayServer(latency=0.2) as server:
+        start = time.perf_counter()
+        results = asyncio.run(pay_all(server.url))
+        elapsed = time.perf_counter() - start
+
+    assert all(ok for ok, _, _ in results)
+    assert elapsed < 1.0  # 50 x 0.2s serially would be 10s
+
+
+def test_sync_callers_from_many_threads_overlap():
+    with StubGatewayServer(latency=0.2) as server:
+        gateway = PaymentGateway(base_url=server.url)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(gateway.process_payment("123456", 1.0)))
+                   for _ in range(20)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+    assert len(results) == 20 and all(ok for ok, _, _ in results)
+    assert elapsed < 1.5
+
+
+def test_unreachable_gateway_raises():
+    with StubGatewayServer() as server:
+        url = server.url
+    gateway = PaymentGateway(base_url=url)
+
+    with pytest.raises(PaymentGatewayError):
+        gateway.process_payment("123456", 5.0)
+
+
+def test_pay_late_fees_through_stub_gateway(temp_db, stub_gateway):
+    database.insert_book("Gateway Book", "Author", "9000000000001", 1, 1)
+    book_id = database.get_book_by_isbn("9000000000001")["id"]
+    borrowed = datetime.now() - timedelta(days=16)
+    database.borrow_book_transaction("123456", book_id, borrowed, borrowed + timedelta(days=14))
+
+    ok, msg, txn = pay_late_fees("123456", book_id, PaymentGateway(base_url=stub_gateway.url))
+
+    assert ok is True
+    assert "$1.00" in msg
+    assert stub_gateway.simulator.charges[txn] == 1.0
+
+
+def test_pay_late_fees_reports_gateway_outage(temp_db, monkeypatch):
+    with StubGatewayServer() as server:
+        url = server.url
+    monkeypatch.setenv("PAYMENT_GATEWAY_URL", url)
+    database.insert_book("Gateway Book", "Author", "9000000000001", 1, 1)
+    book_id = database.get_book_by_isbn("9000000000001")["id"]
+    borrowed = datetime.now() - timedelta(days=16)
+    database.borrow_book_transaction("123456", book_id, borrowed, borrowed + timedelta(days=14))
+
+    ok, msg, txn = pay_late_fees("123456", book_id)
+
+    assert ok is False
+    assert msg.startswith("Payment processing error: Gateway unavailable")
+    assert txn is None
+
+
+def test_pay_all_late_fees_route(temp_db, stub_gateway, monkeypatch):
+    monkeypatch.setenv("PAYMENT_GATEWAY_URL", stub_gateway.url)
+    client = create_app().test_client()
+    borrowed = datetime.now() - timedelta(days=24)
+    for n, isbn in enumerate(("9000000000001", "9000000000002")):
+        database.insert_book(f"Overdue {n}", "Author", isbn, 1, 1)
+        book_id = database.get_book_by_isbn(isbn)["id"]
+        database.borrow_book_transaction("246810", book_id, borrowed, borrowed + timedelta(days=14 + n))
+
+    body = client.post("/api/late_fees/246810/pay").get_json()
+
+    assert body["success"] is True
+    assert body["amount"] == 12.0  # 6.50 + 5.50
+    assert [a["fee_amount"] for a in body["allocations"]] == [6.5, 5.5]
+    assert stub_gateway.simulator.requests == 1
+    assert stub_gateway.simulator.charges[body["transaction_id"]] == 12.0
+
+    assert client.post("/api/late_fees/999999/pay").status_code == 400
+    # the ledger settled both fees, so nothing is left to charge
+    page = client.post("/patron/246810/pay", follow_redirects=True)
+    assert b"No late fees to pay." in page.data
+    assert stub_gateway.simulator.requests == 1
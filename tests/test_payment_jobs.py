@@ -0,0 +1,257 @@
+import threading
+import time
+from datetime import datetime, timedelta
+from unittest.mock import Mock
+
+import pytest
+
+import database
+from app import create_app
+from services import payment_jobs
+from services.job_queue import JobQueue
+from services.payment_jobs import payment_handlers, get_payment_job
+from services.payment_service import PaymentGateway
+
+
+@pytest.fixture
+def overdue_book(temp_db):
+    """A book patron 246810 has kept 10 days past due ($6.50)."""
+    database.insert_book("Queued Book", "Author", "9200000000001", 1, 1)
+    book_id = database.get_book_by_isbn("9200000000001")["id"]
+    borrowed = datetime.now() - timedelta(days=24)
+    database.borrow_book_transaction("246810", book_id, borrowed, borrowed + timedelta(days=14))
+    return book_id
+
+
+@pytest.fixture
+def gateway():
+    gateway = Mock(spec=PaymentGateway)
+    gateway.process_payment.return_value = (True, "txn_246810_1", "Paid")
+    gateway.refund_payment.return_value = (True, "Refunded")
+    return gateway
+
+
+@pytest.fixture
+def queue(temp_db, gateway):
+    """The shared payment queue, running on the temp database with a mock gateway."""
+    queue = JobQueue(payment_handlers(gateway), workers=2, max_attempts=3,
+                     backoff=0.01, poll_interval=0.01).start()
+    payment_jobs.set_payment_queue(queue)
+    yield queue
+    payment_jobs.shutdown_payment_queue()
+
+
+def _wait_for(job_id, timeout=5.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = get_payment_job(job_id)
+        if job["status"] in ("done", "failed"):
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"job {job_id} did not finish")
+
+
+def test_payment_job_runs_in_background(overdue_book, queue, gateway):
+    created, job = payment_jobs.enqueue_late_fee_payment("246810", overdue_book, "key-1")
+
+    finished = _wait_for(job["id"])
+
+    assert created is True
+    assert finished["status"] == "done"
+    assert finished["result"] == {"success": True, "message": "Payment successful! Paid",
+                                  "transaction_id": "txn_246810_1"}
+    assert database.get_payment("key-1")["status"] == "completed"
+    gateway.process_payment.assert_called_once()
+    assert gateway.process_payment.call_args.kwargs["idempotency_key"] == "key-1"
+
+
+def test_gateway_error_is_retried_with_the_same_key(overdue_book, queue, gateway):
+    gateway.process_payment.side_effect = [TimeoutError("read timed out"), (True, "txn_246810_1", "Paid")]
+
+    job = _wait_for(payment_jobs.enqueue_all_late_fees_payment("246810", "key-2")[1]["id"])
+
+    assert (job["status"], job["attempts"]) == ("done", 2)
+    assert job["result"]["amount"] == 6.5
+    keys = [call.kwargs["idempotency_key"] for call in gateway.process_payment.call_args_list]
+    assert keys == ["key-2", "key-2"]
+    assert database.get_payment("key-2")["status"] == "completed"
+    assert queue.stats()["retried"] == 1
+
+
+def test_job_fails_after_max_attempts(overdue_book, queue, gateway):
+    gateway.process_payment.side_effect = TimeoutError("read timed out")
+
+    job = _wait_for(payment_jobs.enqueue_late_fee_payment("246810", overdue_book)[1]["id"])
+
+    assert (job["status"], job["attempts"]) == ("failed", 3)
+    assert "read timed out" in job["error"]
+
+
+def test_declined_payment_is_not_retried(overdue_book, queue, gateway):
+    gateway.process_payment.return_value = (False, "", "declined")
+
+    job = _wait_for(payment_jobs.enqueue_late_fee_payment("246810", overdue_book)[1]["id"])
+
+    assert (job["status"], job["attempts"]) == ("done", 1)
+    assert job["result"]["success"] is False
+
+
+def test_refund_job(overdue_book, queue, gateway):
+    _wait_for(payment_jobs.enqueue_late_fee_payment("246810", overdue_book)[1]["id"])
+
+    job = _wait_for(payment_jobs.enqueue_refund("txn_246810_1", 2.5, "refund-1")[1]["id"])
+
+    assert job["result"] == {"success": True, "message": "Refunded"}
+    gateway.refund_payment.assert_called_once_with("txn_246810_1", 2.5, idempotency_key="refund-1")
+
+
+def test_repeated_key_returns_the_queued_job(temp_db):
+    queue = JobQueue({"echo": lambda payload: payload})
+
+    first = queue.enqueue("echo", {"n": 1}, "same")
+    second = queue.enqueue("echo", {"n": 2}, "same")
+
+    assert (first[0], second[0]) == (True, False)
+    assert first[1]["id"] == second[1]["id"]
+    assert second[1]["payload"] == {"n": 1}
+
+
+def test_jobs_survive_a_restart(temp_db):
+    handled = []
+    stopped = JobQueue({"echo": handled.append})
+    queued = stopped.enqueue("echo", {"n": 1})[1]
+    interrupted = stopped.enqueue("echo", {"n": 2})[1]
+    assert database.claim_job("crashed", lease=0)["id"] == queued["id"]  # left 'running' by a crash
+
+    queue = JobQueue({"echo": lambda payload: handled.append(payload) or payload},
+                     poll_interval=0.01).start()
+    try:
+        for job in (queued, interrupted):
+            deadline = time.time() + 5
+            while database.get_job(job["id"])["status"] != "done" and time.time() < deadline:
+                time.sleep(0.01)
+    finally:
+        queue.stop()
+
+    assert sorted(p["n"] for p in handled) == [1, 2]
+    assert queue.stats()["requeued"] == 1
+
+
+def test_starting_a_queue_leaves_other_live_queues_jobs_alone(temp_db):
+    release, calls = threading.Event(), []
+
+    def blocking(payload):
+        calls.append(payload)
+        release.wait(5)
+        return {}
+
+    first = JobQueue({"block": blocking}, workers=1, poll_interval=0.01).start()
+    second = None
+    try:
+        job = first.enqueue("block", {})[1]
+        deadline = time.time() + 5
+        while not calls and time.time() < deadline:
+            time.sleep(0.01)
+
+        second = JobQueue({"block": blocking}, workers=1, poll_interval=0.01).start()
+        time.sleep(0.1)
+        running = database.get_job(job["id"])
+        release.set()
+        deadline = time.time() + 5
+        while database.get_job(job["id"])["status"] != "done" and time.time() < deadline:
+            time.sleep(0.01)
+    finally:
+        release.set()
+        first.stop()
+        if second:
+            second.stop()
+
+    assert (running["status"], running["owner"]) == ("running", first.owner)
+    assert second.stats()["requeued"] == 0
+    assert len(calls) == 1
+    assert database.get_job(job["id"])["status"] == "done"
+
+
+def test_lapsed_lease_is_taken_over_without_a_restart(temp_db):
+    handled = []
+    queue = JobQueue({"echo": lambda payload: handled.append(payload) or payload},
+                     poll_interval=0.01, lease=0.3)
+    job = queue.enqueue("echo", {"n": 1})[1]
+    database.claim_job("hung-worker", lease=0.2)
+
+    queue.start()
+    try:
+        deadline = time.time() + 5
+        while database.get_job(job["id"])["status"] != "done" and time.time() < deadline:
+            time.sleep(0.01)
+    finally:
+        queue.stop()
+
+    assert handled == [{"n": 1}]
+    assert database.get_job(job["id"])["owner"] == queue.owner
+    assert queue.stats()["requeued"] == 1
+
+
+def test_concurrency_is_bounded_by_workers(temp_db):
+    running, peak, lock = [0], [0], threading.Lock()
+
+    def slow(payload):
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        time.sleep(0.02)
+        with lock:
+            running[0] -= 1
+        return {}
+
+    queue = JobQueue({"slow": slow}, workers=3, poll_interval=0.01).start()
+    try:
+        jobs = [queue.enqueue("slow", {})[1]["id"] for _ in range(12)]
+        deadline = time.time() + 5
+        while queue.stats()["depth"]["done"] < len(jobs) and time.time() < deadline:
+            time.sleep(0.01)
+    finally:
+        queue.stop()
+
+    stats = queue.stats()
+    assert stats["depth"]["done"] == 12
+    assert peak[0] == 3
+    assert stats["run_time"]["count"] == 12
+    assert stats["queue_wait"]["p95_ms"] >= stats["queue_wait"]["p50_ms"]
+
+
+def test_payments_api(overdue_book, queue):
+    client = create_app().test_client()
+
+    response = client.post("/api/payments", json={"type": "late_fee", "patron_id": "246810",
+                                                  "book_id": overdue_book},
+                           headers={"Idempotency-Key": "api-1"})
+    repeat = client.post("/api/payments", json={"type": "late_fee", "patron_id": "246810",
+                                                "book_id": overdue_book},
+                         headers={"Idempotency-Key": "api-1"})
+
+    assert response.status_code == 202
+    assert repeat.status_code == 200
+    job_id = response.get_json()["job_id"]
+    assert repeat.get_json()["job_id"] == job_id
+    _wait_for(job_id)
+    job = client.get(response.get_json()["status_url"]).get_json()
+    assert (job["status"], job["result"]["transaction_id"]) == ("done", "txn_246810_1")
+
+    assert client.get("/api/payments/999999").status_code == 404
+    assert client.post("/api/payments", json={"type": "late_fee", "patron_id": "12"}).status_code == 400
+    assert client.post("/api/payments", json={"type": "cash"}).status_code == 400
+    metrics = client.get("/api/payments/metrics").get_json()
+    assert metrics["depth"]["done"] == 1
+    assert metrics["enqueued"] == 1
+
+
+def test_metrics_poll_does_not_start_the_queue(temp_db):
+    payment_jobs.set_payment_queue(None)
+    database.enqueue_job("refund", {"transaction_id": "txn_1", "amount": 1.0}, "metrics-1")
+
+    metrics = create_app().test_client().get("/api/payments/metrics").get_json()
+
+    assert metrics["running"] is False
+    assert metrics["depth"]["queued"] == 1
+    assert payment_jobs._queue is None
@@ -0,0 +1,231 @@
+import threading
+import time
+from datetime import datetime, timedelta
+from unittest.mock import Mock
+
+import pytest
+
+import database
+from app import create_app
+from services.library_service import calculate_late_fee_for_book, get_patron_late_fees
+from services.library_services import pay_all_late_fees, pay_late_fees, refund_late_fee_payment
+from services.payment_service import PaymentGateway
+
+
+@pytest.fixture
+def overdue_book(temp_db):
+    """A book patron 246810 has kept 10 days past due ($6.50)."""
+    database.insert_book("Ledger Book", "Author", "9100000000001", 1, 1)
+    book_id = database.get_book_by_isbn("9100000000001")["id"]
+    borrowed = datetime.now() - timedelta(days=24)
+    database.borrow_book_transaction("246810", book_id, borrowed, borrowed + timedelta(days=14))
+    return book_id
+
+
+def _gateway(*results):
+    gateway = Mock(spec=PaymentGateway)
+    gateway.process_payment.side_effect = list(results)
+    gateway.refund_payment.return_value = (True, "Refunded")
+    return gateway
+
+
+def test_repeated_key_is_answered_from_ledger(overdue_book):
+    gateway = _gateway((True, "txn_246810_1", "Paid"))
+
+    first = pay_late_fees("246810", overdue_book, gateway, idempotency_key="abc")
+    second = pay_late_fees("246810", overdue_book, gateway, idempotency_key="abc")
+
+    assert first == second == (True, "Payment successful! Paid", "txn_246810_1")
+    gateway.process_payment.assert_called_once()
+    payment = database.get_payment("abc")
+    assert (payment["status"], payment["amount"], payment["transaction_id"]) == ("completed", 6.5, "txn_246810_1")
+    assert payment["allocations"][0]["book_id"] == overdue_book
+
+
+def test_concurrent_submissions_with_one_key_charge_once(overdue_book):
+    calls = []
+
+    def slow_charge(**kwargs):
+        calls.append(kwargs)
+        time.sleep(0.05)
+        return True, "txn_246810_1", "Paid"
+
+    gateway = Mock(spec=PaymentGateway)
+    gateway.process_payment.side_effect = slow_charge
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(
+        pay_all_late_fees("246810", gateway, idempotency_key="same")[0])) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert results.count(True) >= 1
+
+
+def test_settled_fee_is_not_charged_again(overdue_book):
+    gateway = _gateway((True, "txn_246810_1", "Paid"))
+
+    assert pay_late_fees("246810", overdue_book, gateway)[0] is True
+
+    assert calculate_late_fee_for_book("246810", overdue_book)["amount_due"] == 0.0
+    assert get_patron_late_fees("246810")["total_fees"] == 0.0
+    assert pay_late_fees("246810", overdue_book, gateway) == (False, "No late fees to pay for this book.", None)
+    assert pay_all_late_fees("246810", gateway)[1] == "No late fees to pay."
+    gateway.process_payment.assert_called_once()
+
+
+def test_failed_charge_releases_the_fee(overdue_book):
+    gateway = _gateway((False, "", "declined"))
+
+    assert pay_late_fees("246810", overdue_book, gateway, idempotency_key="k1")[0] is False
+
+    assert database.get_payment("k1")["status"] == "failed"
+    assert get_patron_late_fees("246810")["total_fees"] == 6.5
+
+
+def test_gateway_error_leaves_payment_pending(overdue_book):
+    gateway = Mock(spec=PaymentGateway)
+    gateway.process_payment.side_effect = TimeoutError("read timed out")
+
+    ok, msg, txn = pay_late_fees("246810", overdue_book, gateway, idempotency_key="k1")
+    retry = pay_late_fees("246810", overdue_book, gateway, idempotency_key="k1")
+
+    assert "read timed out" in msg and "read timed out" in retry[1]
+    keys = [call.kwargs["idempotency_key"] for call in gateway.process_payment.call_args_list]
+    assert keys == ["k1", "k1"]  # re-sent under the same key, so the gateway charges at most once
+    assert database.get_payment("k1")["status"] == "pending"
+    # the call is over, so the fee shows as due again
+    assert calculate_late_fee_for_book("246810", overdue_book)["amount_due"] == 6.5
+
+
+def test_in_flight_payment_holds_the_fee(overdue_book):
+    database.create_payment("in-flight", "246810", 6.5, [{
+        "borrow_id": calculate_late_fee_for_book("246810", overdue_book)["borrow_id"],
+        "book_id": overdue_book, "fee_amount": 6.5}])
+    gateway = _gateway()
+
+    assert get_patron_late_fees("246810")["total_fees"] == 0.0
+    assert pay_late_fees("246810", overdue_book, gateway) == (False, "No late fees to pay for this book.", None)
+    gateway.process_payment.assert_not_called()
+
+
+@pytest.mark.parametrize("pay", [
+    lambda gateway, book_id: pay_late_fees("246810", book_id, gateway),
+    lambda gateway, book_id: pay_all_late_fees("246810", gateway)[:3],
+])
+def test_payment_after_gateway_exception_resends_it(overdue_book, pay):
+    broken = Mock(spec=PaymentGateway)
+    broken.process_payment.side_effect = ConnectionError("gateway down")
+    assert pay_late_fees("246810", overdue_book, broken)[1] == "Payment processing error: gateway down"
+    [pending] = database.get_unsettled_payments("246810")
+
+    gateway = _gateway((True, "txn_246810_1", "Paid"))
+    ok, msg, txn = pay(gateway, overdue_book)
+
+    assert (ok, txn) == (True, "txn_246810_1")
+    gateway.process_payment.assert_called_once_with(
+        patron_id="246810", amount=6.5, description=pending["description"],
+        idempotency_key=pending["idempotency_key"])
+    assert database.get_payment(pending["idempotency_key"])["status"] == "completed"
+    assert database.get_unsettled_payments() == []
+    assert calculate_late_fee_for_book("246810", overdue_book)["amount_due"] == 0.0
+
+
+def test_still_unreachable_gateway_is_not_charged_anew(overdue_book):
+    broken = Mock(spec=PaymentGateway)
+    broken.process_payment.side_effect = ConnectionError("gateway down")
+    pay_late_fees("246810", overdue_book, broken)
+
+    ok, msg, txn = pay_all_late_fees("246810", broken)[:3]
+
+    assert ok is False and "gateway down" in msg
+    keys = {call.kwargs["idempotency_key"] for call in broken.process_payment.call_args_list}
+    assert len(keys) == 1
+    assert len(database.get_unsettled_payments("246810")) == 1
+
+
+def test_key_reused_by_another_patron(overdue_book):
+    pay_late_fees("246810", overdue_book, _gateway((True, "txn_246810_1", "Paid")), idempotency_key="k1")
+
+    ok, msg, txn = pay_late_fees("135791", overdue_book, _gateway(), idempotency_key="k1")
+
+    assert ok is False
+    assert "another payment" in msg
+
+
+def test_refund_eligibility_reads_the_ledger(overdue_book):
+    pay_late_fees("246810", overdue_book, _gateway((True, "txn_246810_1", "Paid")))
+    gateway = _gateway()
+
+    assert refund_late_fee_payment("txn_unknown", 1.0, gateway)[1] == "Transaction not found in the payment ledger."
+    assert refund_late_fee_payment("txn_246810_1", 7.0, gateway)[1] == "Refund amount exceeds the amount paid."
+    gateway.refund_payment.assert_not_called()
+
+    assert refund_late_fee_payment("txn_246810_1", 4.0, gateway)[0] is True
+    assert refund_late_fee_payment("txn_246810_1", 2.5, gateway)[0] is True
+    assert refund_late_fee_payment("txn_246810_1", 0.5, gateway)[0] is False
+    payment = database.get_payment_by_transaction("txn_246810_1")
+    assert (payment["status"], payment["refunded_amount"]) == ("refunded", 6.5)
+
+
+def test_declined_refund_is_released(overdue_book):
+    pay_late_fees("246810", overdue_book, _gateway((True, "txn_246810_1", "Paid")))
+    gateway = _gateway()
+    gateway.refund_payment.return_value = (False, "declined")
+
+    assert refund_late_fee_payment("txn_246810_1", 6.5, gateway)[0] is False
+
+    payment = database.get_payment_by_transaction("txn_246810_1")
+    assert (payment["status"], payment["refunded_amount"]) == ("completed", 0.0)
+
+
+def test_refund_after_gateway_exception_stays_counted_and_is_resent(overdue_book):
+    pay_late_fees("246810", overdue_book, _gateway((True, "txn_246810_1", "Paid")))
+    gateway = _gateway()
+    gateway.refund_payment.side_effect = [ConnectionError("gateway down"), (True, "Refunded")]
+
+    assert refund_late_fee_payment("txn_246810_1", 6.5, gateway, idempotency_key="r1") == \
+        (False, "Refund processing error: gateway down")
+    # it may have gone through, so it is neither released nor refundable anew
+    assert database.get_payment_by_transaction("txn_246810_1")["refunded_amount"] == 6.5
+    assert refund_late_fee_payment("txn_246810_1", 6.5, gateway, idempotency_key="r2")[1] == \
+        "Refund amount exceeds the amount paid."
+
+    assert refund_late_fee_payment("txn_246810_1", 6.5, gateway, idempotency_key="r1") == (True, "Refunded")
+    assert refund_late_fee_payment("txn_246810_1", 6.5, gateway, idempotency_key="r1") == (True, "Refunded")
+
+    keys = [call.kwargs["idempotency_key"] for call in gateway.refund_payment.call_args_list]
+    assert keys == ["r1", "r1"]
+    assert database.get_refund("r1")["status"] == "completed"
+    payment = database.get_payment_by_transaction("txn_246810_1")
+    assert (payment["status"], payment["refunded_amount"]) == ("refunded", 6.5)
+
+
+def test_interrupted_refund_is_resent_not_counted_twice(overdue_book):
+    pay_late_fees("246810", overdue_book, _gateway((True, "txn_246810_1", "Paid")))
+    database.reserve_refund("txn_246810_1", 2.5, "r1")     # the process died before the gateway answered
+    gateway = _gateway()
+
+    assert refund_late_fee_payment("txn_246810_1", 2.5, gateway, idempotency_key="r1") == \
+        (False, "Refund is still being processed.")
+    assert refund_late_fee_payment("txn_246810_1", 2.5, gateway, idempotency_key="r1",
+                                   retry_pending=True) == (True, "Refunded")
+
+    gateway.refund_payment.assert_called_once_with("txn_246810_1", 2.5, idempotency_key="r1")
+    assert database.get_payment_by_transaction("txn_246810_1")["refunded_amount"] == 2.5
+
+
+def test_pay_api_honours_idempotency_key(overdue_book, mocker):
+    gateway = _gateway((True, "txn_246810_1", "Paid"))
+    mocker.patch("services.library_services.PaymentGateway", return_value=gateway)
+    client = create_app().test_client()
+
+    first = client.post("/api/late_fees/246810/pay", headers={"Idempotency-Key": "req-1"}).get_json()
+    second = client.post("/api/late_fees/246810/pay", headers={"Idempotency-Key": "req-1"}).get_json()
+
+    assert first == second
+    assert first["transaction_id"] == "txn_246810_1"
+    assert first["amount"] == 6.5
+    gateway.process_payment.assert_called_once()
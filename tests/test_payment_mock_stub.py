@@ -1,7 +1,9 @@
 import pytest
-from unittest.mock import Mock
+from unittest.mock import ANY, Mock
+
+import database
 from services.payment_service import PaymentGateway
-from services.library_services import pay_late_fees, refund_late_fee_payment
+from services.library_services import pay_late_fees, pay_all_late_fees, refund_late_fee_payment
 
 
 # ============================
@@ -11,7 +13,7 @@ from services.library_services import pay_late_fees, refund_late_fee_payment
 # Each test covers one required branch: success, decline, invalid patron ID,
 # ============================
 
-def test_pay_late_fees_success(mocker):
+def test_pay_late_fees_success(temp_db, mocker):
     """Successful late fee payment."""
     
     # Stub DB helpers
@@ -29,14 +31,15 @@ def test_pay_late_fees_success(mocker):
     gateway.process_payment.assert_called_once_with(
         patron_id="123456",
         amount=7.50,
-        description="Late fees for 'Book X'"
+        description="Late fees for 'Book X'",
+        idempotency_key=ANY
     )
 
     assert ok is True
     assert txn == "txn_123"
 
 
-def test_pay_late_fees_declined(mocker):
+def test_pay_late_fees_declined(temp_db, mocker):
     """Gateway declines payment."""
     
     mocker.patch("services.library_services.get_book_by_id",
@@ -103,7 +106,7 @@ def test_pay_late_fees_zero_fee(mocker):
     assert txn is None
 
 
-def test_pay_late_fees_gateway_exception(mocker):
+def test_pay_late_fees_gateway_exception(temp_db, mocker):
     """Gateway error → caught by try/except."""
     
     mocker.patch("services.library_services.get_book_by_id",
@@ -121,6 +124,90 @@ def test_pay_late_fees_gateway_exception(mocker):
     assert "Network down" in msg
 
 
+# ============================
+# Tests for pay_all_late_fees()
+# Stub the one fee query; the gateway mock must see exactly one charge.
+# ============================
+
+def test_pay_all_late_fees_single_charge(temp_db, mocker):
+    """All overdue books are paid with one aggregated charge."""
+    
+    mocker.patch("services.library_services.get_patron_late_fees",
+                 return_value={"patron_id": "123456", "total_fees": 8.0, "fees": [
+                     {"book_id": 1, "title": "A", "days_overdue": 10, "fee_amount": 6.5},
+                     {"book_id": 2, "title": "B", "days_overdue": 3, "fee_amount": 1.5}]})
+    book_lookup = mocker.patch("services.library_services.get_book_by_id")
+
+    gateway = Mock(spec=PaymentGateway)
+    gateway.process_payment.return_value = (True, "txn_all", "OK")
+
+    ok, msg, txn, allocations = pay_all_late_fees("123456", gateway)
+
+    gateway.process_payment.assert_called_once_with(
+        patron_id="123456",
+        amount=8.0,
+        description="Late fees for 2 book(s): 'A' $6.50, 'B' $1.50",
+        idempotency_key=ANY
+    )
+    book_lookup.assert_not_called()
+    assert ok is True
+    assert txn == "txn_all"
+    assert [(a["book_id"], a["fee_amount"]) for a in allocations] == [(1, 6.5), (2, 1.5)]
+
+
+def test_pay_all_late_fees_nothing_owed(mocker):
+    """No overdue books → gateway not called."""
+    
+    mocker.patch("services.library_services.get_patron_late_fees",
+                 return_value={"patron_id": "123456", "total_fees": 0.0, "fees": []})
+
+    gateway = Mock(spec=PaymentGateway)
+
+    ok, msg, txn, allocations = pay_all_late_fees("123456", gateway)
+
+    gateway.process_payment.assert_not_called()
+    assert ok is False
+    assert txn is None
+    assert allocations == []
+
+
+def test_pay_all_late_fees_invalid_patron_id():
+    """Invalid patron ID → gateway not called."""
+    
+    gateway = Mock(spec=PaymentGateway)
+
+    ok, msg, txn, allocations = pay_all_late_fees("12", gateway)
+
+    gateway.process_payment.assert_not_called()
+    assert ok is False
+
+
+def test_pay_all_late_fees_declined(temp_db, mocker):
+    """Declined charge returns no transaction ID."""
+    
+    mocker.patch("services.library_services.get_patron_late_fees",
+                 return_value={"patron_id": "123456", "total_fees": 15.0, "fees": [
+                     {"book_id": 3, "title": "C", "days_overdue": 40, "fee_amount": 15.0}]})
+
+    gateway = Mock(spec=PaymentGateway)
+    gateway.process_payment.return_value = (False, "", "declined")
+
+    ok, msg, txn, allocations = pay_all_late_fees("123456", gateway)
+
+    assert ok is False
+    assert txn is None
+    assert "declined" in msg
+
+
+@pytest.fixture
+def paid_txn(temp_db):
+    """A completed $15.00 payment with transaction ID txn_1 in the ledger."""
+    created, payment = database.create_payment("key-1", "123456", 15.0,
+                                               [{"borrow_id": None, "book_id": 1, "fee_amount": 15.0}])
+    database.settle_payment(payment["id"], database.PAYMENT_COMPLETED, "txn_1", "OK")
+    return "txn_1"
+
+
 # ============================
 # Tests for refund_late_fee_payment()
 # No DB stubs needed because the function does not touch the database.
@@ -129,7 +216,7 @@ def test_pay_late_fees_gateway_exception(mocker):
 # negative amount, >$15 amount, gateway-decline, and exception.
 # ============================
 
-def test_refund_success():
+def test_refund_success(paid_txn):
     """Successful refund."""
     
     gateway = Mock(spec=PaymentGateway)
@@ -137,7 +224,7 @@ def test_refund_success():
 
     ok, msg = refund_late_fee_payment("txn_1", 5.0, gateway)
 
-    gateway.refund_payment.assert_called_once_with("txn_1", 5.0)
+    gateway.refund_payment.assert_called_once_with("txn_1", 5.0, idempotency_key=ANY)
     assert ok is True
 
 
@@ -174,7 +261,7 @@ def test_refund_amount_negative():
     assert ok is False
 
 
-def test_refund_amount_exceeds_cap():
+def test_refund_amount_exceeds_cap(paid_txn):
     """Refund cannot exceed $15."""
     
     gateway = Mock(spec=PaymentGateway)
@@ -185,7 +272,7 @@ def test_refund_amount_exceeds_cap():
     assert ok is False
 
 
-def test_refund_gateway_declined():
+def test_refund_gateway_declined(paid_txn):
     """Gateway rejects refund."""
     
     gateway = Mock(spec=PaymentGateway)
@@ -197,7 +284,7 @@ def test_refund_gateway_declined():
     assert ok is False
 
 
-def test_refund_gateway_exception():
+def test_refund_gateway_exception(paid_txn):
     """Gateway exception handled."""
     
     gateway = Mock(spec=PaymentGateway)
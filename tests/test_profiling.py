@@ -0,0 +1,91 @@
+import os
+import pstats
+import time
+
+import pytest
+
+from app import create_app
+from routes import api_routes
+from routes.profiling import RequestProfiler
+from services.library_service import search_books_in_catalog
+
+
+@pytest.fixture
+def slow_search(mocker):
+    """Make /api/search take long enough for the sampler to see it."""
+    def slow_search_books(*args, **kwargs):
+        time.sleep(0.05)
+        return search_books_in_catalog(*args, **kwargs)
+    mocker.patch.object(api_routes, 'search_books_in_catalog', side_effect=slow_search_books)
+
+
+def _profiles(directory, suffix='.collapsed'):
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory) if name.endswith(suffix)) \
+        if os.path.isdir(directory) else []
+
+
+def _stacks(path):
+    with open(path, encoding='utf-8') as f:
+        return dict(line.rsplit(' ', 1) for line in f.read().splitlines())
+
+
+def test_sampling_profile_writes_collapsed_stacks(sample_data, tmp_path, slow_search):
+    client = create_app({'PROFILE_REQUESTS': True, 'PROFILE_DIR': str(tmp_path),
+                         'PROFILE_SAMPLE_INTERVAL': 0.002}).test_client()
+
+    response = client.get('/api/search?q=gatsby&type=title')
+
+    [profile] = _profiles(str(tmp_path))
+    stacks = _stacks(profile)
+    assert response.status_code == 200
+    assert response.get_json()['count'] == 1
+    assert response.headers['X-Profile-File'] == os.path.basename(profile)
+    assert '-GET-api_search-' in profile
+    sleeping = [stack for stack in stacks if 'slow_search_books' in stack]
+    assert sleeping and sum(int(stacks[stack]) for stack in sleeping) >= 5
+    assert all(stack.split(';')[0].startswith('flask.app') for stack in stacks)
+
+
+def test_cprofile_mode_writes_pstats_and_stacks(temp_db, tmp_path):
+    client = create_app({'PROFILE_REQUESTS': True, 'PROFILE_DIR': str(tmp_path),
+                         'PROFILE_MODE': 'cprofile'}).test_client()
+
+    client.get('/api/search?q=gatsby&type=title')
+
+    [prof] = _profiles(str(tmp_path), '.prof')
+    [collapsed] = _profiles(str(tmp_path))
+    assert pstats.Stats(prof).total_calls > 0
+    assert any('library_service.search_books_in_catalog;database.search_books' in stack
+               for stack in _stacks(collapsed))
+
+
+def test_header_token_profiles_single_requests(temp_db, tmp_path):
+    client = create_app({'PROFILE_HEADER_TOKEN': 's3cret', 'PROFILE_DIR': str(tmp_path)}).test_client()
+
+    plain = client.get('/catalog')
+    wrong = client.get('/catalog', headers={'X-Profile': 'guess'})
+    profiled = client.get('/catalog', headers={'X-Profile': 's3cret'})
+
+    assert 'X-Profile-File' not in plain.headers and 'X-Profile-File' not in wrong.headers
+    assert profiled.status_code == 200
+    assert [os.path.basename(p) for p in _profiles(str(tmp_path))] == [profiled.headers['X-Profile-File']]
+
+
+def test_profile_paths_limit_what_is_profiled(temp_db, tmp_path):
+    client = create_app({'PROFILE_REQUESTS': True, 'PROFILE_PATHS': ['/return'],
+                         'PROFILE_DIR': str(tmp_path)}).test_client()
+
+    client.get('/catalog')
+    client.post('/return', data={'patron_id': '123456', 'book_id': '3'})
+
+    [profile] = _profiles(str(tmp_path))
+    assert '-POST-return-' in profile
+
+
+def test_profiling_is_off_by_default(temp_db, monkeypatch):
+    monkeypatch.delenv('PROFILE_HEADER_TOKEN', raising=False)
+    app = create_app()
+
+    assert not isinstance(app.wsgi_app, RequestProfiler)
+    with pytest.raises(ValueError):
+        create_app({'PROFILE_REQUESTS': True, 'PROFILE_MODE': 'perf'})
@@ -0,0 +1,88 @@
+
+import database
+from app import create_app
+from services import reconciliation
+from services.payment_service import AsyncPaymentGateway
+from services.payment_simulator import StubGatewayServer
+from services.reconciliation import reconcile_payments
+
+
+def _ledger_payments(count, prefix="txn_246810_"):
+    """Completed ledger payments with transaction IDs prefix0..prefixN."""
+    ids = []
+    for n in range(count):
+        _, payment = database.create_payment(f"key-{prefix}{n}", "246810", 5.0, [])
+        database.settle_payment(payment["id"], database.PAYMENT_COMPLETED, f"{prefix}{n}", "Paid")
+        ids.append(f"{prefix}{n}")
+    return ids
+
+
+def test_lookups_run_concurrently_and_are_recorded(temp_db):
+    ids = _ledger_payments(40)
+    assert database.get_unreconciled_transactions() == ids
+
+    with StubGatewayServer(latency=0.05) as server:
+        report = reconcile_payments(ids, workers=20, gateway=AsyncPaymentGateway(base_url=server.url))
+
+    assert (report["checked"], report["updated"], report["matched"]) == (40, 40, 40)
+    assert report["mismatched"] == [] and report["errors"] == []
+    # sequentially this is 40 x 50 ms
+    assert report["seconds"] < 1.0
+    assert database.get_unreconciled_transactions() == []
+    assert database.get_payment_by_transaction(ids[0])["gateway_status"] == "completed"
+
+
+def test_results_are_written_in_batches(temp_db, mocker):
+    ids = _ledger_payments(20)
+    spy = mocker.spy(reconciliation, "record_reconciliation")
+
+    report = reconcile_payments(ids, workers=4, batch_size=7)
+
+    assert report["updated"] == 20
+    assert [len(call.args[0]) for call in spy.call_args_list] == [7, 7, 6]
+
+
+def test_mismatches_are_reported(temp_db):
+    ids = _ledger_payments(2, prefix="lost_")
+
+    report = reconcile_payments(ids + ["txn_135791_missing"])
+
+    assert report["matched"] == 0
+    assert sorted((m["transaction_id"], m["ledger_status"], m["gateway_status"])
+                  for m in report["mismatched"]) == [
+        ("lost_0", "completed", "not_found"),
+        ("lost_1", "completed", "not_found"),
+        ("txn_135791_missing", None, "completed"),
+    ]
+
+
+def test_rate_limit_spaces_lookups(temp_db):
+    ids = _ledger_payments(10)
+
+    report = reconcile_payments(ids, workers=10, rate_limit=50)
+
+    assert report["checked"] == 10
+    assert report["seconds"] >= 0.17
+
+
+def test_unreachable_gateway_leaves_payments_unreconciled(temp_db):
+    ids = _ledger_payments(3)
+
+    report = reconcile_payments(ids, gateway=AsyncPaymentGateway(base_url="http://127.0.0.1:9", timeout=1))
+
+    assert (report["checked"], report["updated"], len(report["errors"])) == (0, 0, 3)
+    assert database.get_unreconciled_transactions() == ids
+
+
+def test_reconcile_command(temp_db, monkeypatch):
+    monkeypatch.delenv("PAYMENT_GATEWAY_URL", raising=False)
+    _ledger_payments(5)
+    runner = create_app().test_cli_runner()
+
+    result = runner.invoke(args=["reconcile-payments", "--unreconciled", "--workers", "2"])
+    usage = runner.invoke(args=["reconcile-payments"])
+
+    assert result.exit_code == 0
+    assert "5 transactions checked" in result.output
+    assert "5 match, 0 mismatched, 0 errors" in result.output
+    assert usage.exit_code != 0
@@ -0,0 +1,43 @@
+import os
+import runpy
+
+import database
+
+CONFIG = os.path.join(os.path.dirname(os.path.dirname(__file__)), "gunicorn.conf.py")
+
+
+def test_gunicorn_settings_from_environment(monkeypatch):
+    monkeypatch.setenv("WEB_CONCURRENCY", "3")
+    monkeypatch.setenv("GUNICORN_THREADS", "8")
+    monkeypatch.setenv("PORT", "8080")
+    monkeypatch.setenv("GUNICORN_ACCESS_LOG", "")
+
+    settings = runpy.run_path(CONFIG)
+
+    assert (settings["workers"], settings["threads"], settings["bind"]) == (3, 8, "0.0.0.0:8080")
+    assert settings["worker_class"] == "gthread" and settings["preload_app"]
+    assert settings["accesslog"] is None
+
+
+def test_pre_fork_closes_the_masters_connections(temp_db):
+    database.get_all_books()
+    pool = database.get_pool()
+    assert pool.stats()["open"] > 0
+
+    runpy.run_path(CONFIG)["pre_fork"](server=None, worker=None)
+
+    assert pool.stats()["open"] == 0
+    assert database.get_pool() is not pool
+
+
+def test_wsgi_app_uses_database_path(tmp_path, monkeypatch):
+    monkeypatch.setenv("DATABASE_PATH", str(tmp_path / "served.db"))
+    monkeypatch.setattr(database, "DATABASE", database.DATABASE)
+    try:
+        app = runpy.run_path(os.path.join(os.path.dirname(CONFIG), "wsgi.py"))["app"]
+
+        assert app.test_client().get("/api/books").status_code == 200
+        assert database.DATABASE == str(tmp_path / "served.db")
+        assert os.path.exists(tmp_path / "served.db")
+    finally:
+        database.close_pool()
@@ -0,0 +1,20 @@
+"""
+Production WSGI entry point for the Library Management System.
+
+Serve with gunicorn (settings in gunicorn.conf.py):
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+DATABASE_PATH selects the SQLite file (default library.db in the working
+directory). Each worker's connection pool has one connection per thread.
+"""
+
+import os
+
+import database
+from app import create_app
+
+database.DATABASE = os.environ.get('DATABASE_PATH', database.DATABASE)
+
+app = create_app({
+    'DATABASE_POOL_SIZE': max(int(os.environ.get('GUNICORN_THREADS', 4)), database.DEFAULT_POOL_SIZE),
+})